@@ -1,9 +1,15 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import httpx
 import json
 
+import asyncio
+
+from tokens import token_de_cabecera
+from sesiones import CacheSesiones, TokenRechazado
+
 app = FastAPI(title="API Gateway - Biblioteca Universitaria")
 
 # CORS
@@ -23,6 +29,27 @@ SERVICES = {
     "reservas": "http://microservicio-reservas:8004"
 }
 
+# Identidad que el gateway agrega a lo que reenvía; la que mande el cliente se descarta
+PREFIJO_IDENTIDAD = "x-usuario-"
+# Rutas entre servicios que no se exponen hacia afuera: revocaciones que consulta
+# el propio gateway y eventos de préstamos que entrega la outbox
+RUTAS_INTERNAS = {
+    ("autenticacion", "tokens/revocados"),
+    ("catalogo", "eventos/prestamos"),
+    ("reservas", "eventos/prestamos"),
+}
+
+sesiones = CacheSesiones(SERVICES["autenticacion"])
+
+@app.on_event("startup")
+async def startup_event():
+    # Logouts y cambios de contraseña hechos en autenticación (o en otra réplica del gateway)
+    app.state.tarea_revocaciones = asyncio.create_task(sesiones.tarea_revocaciones())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.tarea_revocaciones.cancel()
+
 @app.get("/")
 async def root():
     return {
@@ -30,18 +57,87 @@ async def root():
         "services": list(SERVICES.keys())
     }
 
+def autenticar(request: Request):
+    """
+    Valida localmente, sin llamar a autenticación, el token Bearer si viene.
+
+    Devuelve las cabeceras de identidad para el servicio destino, vacías si la
+    petición no trae token. Un token mal firmado, vencido o revocado se
+    rechaza con 401 antes de llegar al servicio.
+    """
+    token = token_de_cabecera(request.headers.get("authorization"))
+    if token is None:
+        return {}
+    try:
+        claims = sesiones.autenticar(token)
+    except TokenRechazado as e:
+        raise HTTPException(status_code=401, detail=f"Token inválido: {e}")
+    return {
+        "X-Usuario-Id": claims["sub"],
+        "X-Usuario-Nombre": claims.get("usr", ""),
+        "X-Usuario-Rol": claims.get("rol", ""),
+    }
+
+@app.get("/sesiones/estado")
+async def estado_sesiones():
+    """Tasa de aciertos de la caché de sesiones, revocaciones conocidas y latencia de autenticar"""
+    return sesiones.estado()
+
+# Respuestas largas (exportaciones, eventos en vivo): se reenvían en streaming, sin cargar el cuerpo en memoria
+async def reenviar_stream(request: Request, service_name: str, path: str, headers_extra=None):
+    client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None))
+    try:
+        response = await client.send(
+            client.build_request(
+                "GET", f"{SERVICES[service_name]}/{path}", params=request.query_params, headers=headers_extra
+            ),
+            stream=True,
+        )
+    except httpx.ConnectError:
+        await client.aclose()
+        raise HTTPException(status_code=503, detail=f"Servicio {service_name} no disponible. No se puede conectar.")
+
+    async def cerrar():
+        await response.aclose()
+        await client.aclose()
+
+    headers = {
+        k: v for k, v in response.headers.items()
+        if k.lower() in ["content-type", "content-disposition", "cache-control", "x-accel-buffering"]
+    }
+    return StreamingResponse(
+        response.aiter_raw(), status_code=response.status_code, headers=headers, background=BackgroundTask(cerrar)
+    )
+
+@app.get("/prestamos/prestamos/export")
+async def exportar_prestamos_proxy(request: Request):
+    return await reenviar_stream(request, "prestamos", "prestamos/export", autenticar(request))
+
+@app.get("/reservas/notificaciones/usuario/{usuario_id}/stream")
+async def stream_notificaciones_proxy(usuario_id: int, request: Request):
+    headers = autenticar(request)
+    # Last-Event-ID permite al servicio reenviar lo perdido durante una reconexión
+    ultimo = request.headers.get("last-event-id")
+    if ultimo:
+        headers["Last-Event-ID"] = ultimo
+    return await reenviar_stream(request, "reservas", f"notificaciones/usuario/{usuario_id}/stream", headers)
+
 @app.api_route("/{service_name}/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def proxy_request(service_name: str, path: str, request: Request):
     if service_name not in SERVICES:
         raise HTTPException(status_code=404, detail=f"Servicio {service_name} no encontrado")
-    
+    if (service_name, path.strip("/")) in RUTAS_INTERNAS:
+        raise HTTPException(status_code=404, detail="Not Found")
     # Construir URL destino
     base_url = SERVICES[service_name]
     target_url = f"{base_url}/{path}"
     
     # Headers
     headers = {key: value for key, value in request.headers.items() 
-               if key.lower() not in ["host", "content-length"]}
+               if key.lower() not in ["host", "content-length"] and not key.lower().startswith(PREFIJO_IDENTIDAD)}
+    # Autenticación valida sus propios tokens; un token viejo no debe impedir volver a iniciar sesión
+    if service_name != "autenticacion":
+        headers.update(autenticar(request))
     
     # Body
     body = None
@@ -60,6 +156,13 @@ async def proxy_request(service_name: str, path: str, request: Request):
                 timeout=30.0
             )
             
+            # Logout o cambio de contraseña: esta réplica deja de aceptar el token ya, sin esperar la sincronización
+            if service_name == "autenticacion" and path in ("logout", "users/me/password") and response.status_code == 200:
+                try:
+                    await sesiones.sincronizar(client)
+                except Exception as e:
+                    print(f"No se pudieron sincronizar las revocaciones de tokens: {e}")
+            
             # Manejar diferentes tipos de respuesta
             if response.status_code == 204:  # No Content
                 return JSONResponse(content={}, status_code=response.status_code)
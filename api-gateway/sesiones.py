@@ -0,0 +1,146 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+import httpx
+
+from tokens import verificar_token, TokenInvalido
+
+SESION_CACHE_MAX = int(os.getenv("SESION_CACHE_MAX", "10000"))
+# Cuánto se recuerda un token válido (nunca más allá de su exp) y uno rechazado
+SESION_CACHE_TTL_SEGUNDOS = int(os.getenv("SESION_CACHE_TTL", "300"))
+SESION_CACHE_TTL_NEGATIVO_SEGUNDOS = int(os.getenv("SESION_CACHE_TTL_NEGATIVO", "30"))
+# Cada cuánto se traen de autenticación los logouts y cambios de contraseña nuevos
+SESION_REVOCACIONES_INTERVALO_SEGUNDOS = float(os.getenv("SESION_REVOCACIONES_INTERVALO", "5"))
+
+
+class TokenRechazado(Exception):
+    pass
+
+
+class CacheSesiones:
+    """
+    Token -> claims en memoria del gateway, LRU con TTL.
+
+    Un acierto evita decodificar y verificar la firma; un token inválido se
+    recuerda un rato (caché negativa) para que repetirlo sea igual de barato.
+    Las revocaciones se guardan aparte y se consultan en cada petición, incluso
+    en aciertos: un logout o un cambio de contraseña invalida las entradas ya
+    cacheadas sin tener que recorrer la caché.
+    """
+
+    def __init__(self, url_autenticacion):
+        self._url = url_autenticacion
+        self._entradas = OrderedDict()
+        self._jti_revocados = {}
+        self._revocados_antes = {}
+        self._ultima_revocacion = 0
+        self._latencias_us = deque(maxlen=1000)
+        self.metricas = {
+            "aciertos": 0,
+            "fallos": 0,
+            "aciertos_negativos": 0,
+            "rechazados": 0,
+            "revocados": 0,
+            "desalojados": 0,
+            "sincronizaciones": 0,
+            "errores_sincronizacion": 0,
+        }
+
+    def _guardar(self, token, claims, error, ttl):
+        self._entradas[token] = (claims, error, time.monotonic() + ttl)
+        self._entradas.move_to_end(token)
+        if len(self._entradas) > SESION_CACHE_MAX:
+            self._entradas.popitem(last=False)
+            self.metricas["desalojados"] += 1
+
+    def _revocado(self, claims):
+        if claims.get("jti") in self._jti_revocados:
+            return True
+        antes = self._revocados_antes.get(claims.get("sub"))
+        return antes is not None and claims.get("iat", 0) <= antes
+
+    def autenticar(self, token):
+        """Claims del token; lanza TokenRechazado si es inválido, venció o fue revocado"""
+        inicio = time.perf_counter()
+        try:
+            entrada = self._entradas.get(token)
+            if entrada is not None and entrada[2] > time.monotonic():
+                self._entradas.move_to_end(token)
+                claims, error, _ = entrada
+                if error is not None:
+                    self.metricas["aciertos_negativos"] += 1
+                    raise TokenRechazado(error)
+                self.metricas["aciertos"] += 1
+            else:
+                self.metricas["fallos"] += 1
+                try:
+                    claims = verificar_token(token)
+                except TokenInvalido as e:
+                    self.metricas["rechazados"] += 1
+                    self._guardar(token, None, str(e), SESION_CACHE_TTL_NEGATIVO_SEGUNDOS)
+                    raise TokenRechazado(str(e))
+                vigencia = claims["exp"] - time.time()
+                self._guardar(token, claims, None, min(SESION_CACHE_TTL_SEGUNDOS, max(vigencia, 0)))
+            if self._revocado(claims):
+                self.metricas["revocados"] += 1
+                raise TokenRechazado("Token revocado")
+            return claims
+        finally:
+            self._latencias_us.append((time.perf_counter() - inicio) * 1e6)
+
+    def aplicar_revocaciones(self, revocaciones):
+        for r in revocaciones:
+            if r.get("jti"):
+                self._jti_revocados[r["jti"]] = r["expira"]
+            if r.get("emitidos_antes") is not None:
+                sub = str(r["usuario_id"])
+                self._revocados_antes[sub] = max(self._revocados_antes.get(sub, 0), r["emitidos_antes"])
+        # Un jti revocado deja de importar cuando su token habría vencido igual
+        ahora = time.time()
+        for jti in [j for j, expira in self._jti_revocados.items() if expira < ahora]:
+            del self._jti_revocados[jti]
+
+    async def sincronizar(self, client):
+        """Trae las revocaciones nuevas desde la última vista"""
+        while True:
+            response = await client.get(
+                f"{self._url}/tokens/revocados", params={"desde": self._ultima_revocacion}, timeout=5.0
+            )
+            response.raise_for_status()
+            datos = response.json()
+            self.aplicar_revocaciones(datos["revocaciones"])
+            self._ultima_revocacion = datos["ultimo"]
+            self.metricas["sincronizaciones"] += 1
+            if not datos["revocaciones"]:
+                return
+
+    async def tarea_revocaciones(self):
+        async with httpx.AsyncClient() as client:
+            while True:
+                try:
+                    await self.sincronizar(client)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.metricas["errores_sincronizacion"] += 1
+                    print(f"No se pudieron sincronizar las revocaciones de tokens: {e}")
+                await asyncio.sleep(SESION_REVOCACIONES_INTERVALO_SEGUNDOS)
+
+    def estado(self):
+        consultas = self.metricas["aciertos"] + self.metricas["aciertos_negativos"] + self.metricas["fallos"]
+        latencias = sorted(self._latencias_us)
+        return {
+            "entradas": len(self._entradas),
+            "capacidad": SESION_CACHE_MAX,
+            "ttl_segundos": SESION_CACHE_TTL_SEGUNDOS,
+            "ttl_negativo_segundos": SESION_CACHE_TTL_NEGATIVO_SEGUNDOS,
+            "tasa_aciertos": round((consultas - self.metricas["fallos"]) / consultas, 4) if consultas else None,
+            **self.metricas,
+            "jti_revocados": len(self._jti_revocados),
+            "usuarios_revocados": len(self._revocados_antes),
+            "ultima_revocacion": self._ultima_revocacion,
+            "latencia_p50_us": round(latencias[len(latencias) // 2], 1) if latencias else None,
+            "latencia_p99_us": round(latencias[min(int(len(latencias) * 0.99), len(latencias) - 1)], 1) if latencias else None,
+        }
@@ -4,6 +4,8 @@ const API_BASE = 'http://localhost:8000';
 // Estado
 let currentUser = null;
 let prestamos = [];
+// Un préstamo vencido sigue en manos del usuario hasta que lo devuelve
+const ESTADOS_ABIERTOS = ['activo', 'vencido'];
 
 // Inicialización
 document.addEventListener('DOMContentLoaded', function() {
@@ -52,8 +54,8 @@ async function loadPrestamos() {
         
         if (response.ok) {
             prestamos = await response.json();
-            displayPrestamosActivos(prestamos.filter(p => p.estado === 'activo'));
-            displayHistorial(prestamos.filter(p => p.estado !== 'activo'));
+            displayPrestamosActivos(prestamos.filter(p => ESTADOS_ABIERTOS.includes(p.estado)));
+            displayHistorial(prestamos.filter(p => !ESTADOS_ABIERTOS.includes(p.estado)));
         } else {
             throw new Error('Error al cargar préstamos');
         }
@@ -37,6 +37,7 @@ function checkAuthStatus() {
             updateUserInfo();
             loadReservas();
             loadNotificaciones();
+            suscribirNotificaciones();
         } catch (error) {
             console.error('Error parsing user data:', error);
             redirectToLogin();
@@ -239,10 +240,11 @@ async function cancelarReserva(reservaId) {
 // Cargar notificaciones
 async function loadNotificaciones() {
     try {
-        const response = await fetch(`${API_BASE}/reservas/notificaciones/usuario/${currentUser.id}`);
+        const response = await fetch(`${API_BASE}/reservas/notificaciones/usuario/${currentUser.id}?solo_no_leidas=true`);
         
         if (response.ok) {
-            notificaciones = await response.json();
+            const pagina = await response.json();
+            notificaciones = pagina.items;
             console.log('Notificaciones recibidas:', notificaciones);
             displayNotificaciones(notificaciones.filter(n => !n.leida));
         } else {
@@ -253,6 +255,20 @@ async function loadNotificaciones() {
     }
 }
 
+// Notificaciones en vivo (Server-Sent Events); el navegador reconecta solo y
+// envía Last-Event-ID para recuperar lo que llegó mientras estaba desconectado
+function suscribirNotificaciones() {
+    if (!window.EventSource) return;
+    
+    const fuente = new EventSource(`${API_BASE}/reservas/notificaciones/usuario/${currentUser.id}/stream`);
+    fuente.addEventListener('notificacion', function(evento) {
+        const notif = JSON.parse(evento.data);
+        if (notificaciones.some(n => n.id === notif.id)) return;
+        notificaciones.unshift(notif);
+        displayNotificaciones(notificaciones.filter(n => !n.leida));
+    });
+}
+
 // Mostrar notificaciones
 function displayNotificaciones(notificacionesToShow) {
     const list = document.getElementById('notifications-list');
@@ -6,6 +6,8 @@ let currentUser = null;
 let books = [];
 let loans = [];
 let reservations = [];
+// Un préstamo vencido sigue en manos del usuario hasta que lo devuelve
+const ESTADOS_ABIERTOS = ['activo', 'vencido'];
 
 // Elementos del DOM
 const navbar = document.getElementById('navbar');
@@ -216,21 +218,34 @@ async function getTotalLibros() {
     }
 }
 
-// Obtener préstamos activos desde el microservicio de préstamos
+// Préstamos de un usuario recorriendo todas las páginas del listado paginado por cursor
+async function fetchPrestamosUsuario(usuarioId, estado) {
+    const prestamos = [];
+    let cursor = null;
+    do {
+        const params = new URLSearchParams({ usuario_id: usuarioId, limite: 500 });
+        if (estado) params.set('estado', estado);
+        if (cursor) params.set('cursor', cursor);
+        const response = await fetch(`${API_BASE}/prestamos/prestamos?${params}`);
+        if (!response.ok) {
+            throw new Error('Error al cargar préstamos');
+        }
+        const pagina = await response.json();
+        prestamos.push(...pagina.items);
+        cursor = pagina.siguiente_cursor;
+    } while (cursor);
+    return prestamos;
+}
+
 // Obtener préstamos activos del usuario actual
 async function getPrestamosActivos() {
     try {
         if (!currentUser) return 0;
         
-        const response = await fetch(`${API_BASE}/prestamos/prestamos`);
-        if (response.ok) {
-            const prestamos = await response.json();
-            if (Array.isArray(prestamos)) {
-                // Filtrar solo los préstamos ACTIVOS del usuario actual
-                return prestamos.filter(p => p.estado === 'activo' && p.usuario_id === currentUser.id).length;
-            }
-        }
-        return 0;
+        const porEstado = await Promise.all(
+            ESTADOS_ABIERTOS.map(estado => fetchPrestamosUsuario(currentUser.id, estado))
+        );
+        return porEstado.reduce((total, prestamos) => total + prestamos.length, 0);
     } catch (error) {
         console.error('Error obteniendo préstamos activos:', error);
         return 0;
@@ -441,15 +456,9 @@ async function loanBook(bookId) {
 async function loadLoans() {
     try {
         showLoading(true);
-        const response = await fetch(`${API_BASE}/prestamos/prestamos`);
-        if (response.ok) {
-            loans = await response.json();
-            // Filtrar préstamos del usuario actual
-            const userLoans = loans.filter(loan => loan.usuario_id === currentUser.id);
-            displayLoans(userLoans);
-        } else {
-            throw new Error('Error al cargar préstamos');
-        }
+        // El servidor ya filtra por el usuario actual
+        loans = await fetchPrestamosUsuario(currentUser.id);
+        displayLoans(loans);
     } catch (error) {
         console.error('Error loading loans:', error);
         const container = document.getElementById('loans-container');
@@ -478,7 +487,7 @@ function displayLoans(loansToShow) {
                 <div><strong>Estado:</strong> ${loan.estado}</div>
                 ${loan.multa > 0 ? `<div><strong>Multa:</strong> $${loan.multa}</div>` : ''}
             </div>
-            ${loan.estado === 'activo' ? `
+            ${ESTADOS_ABIERTOS.includes(loan.estado) ? `
                 <div class="book-actions">
                     <button class="btn btn-primary" onclick="returnBook(${loan.id})">
                         <i class="fas fa-undo"></i> Devolver
@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import statistics
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import tokens
+
+
+def _verificar_sin_cache(token, secretos):
+    """Verificación ingenua: inicializa el HMAC y decodifica la cabecera en cada llamada"""
+    cuerpo, firma = token.rsplit(".", 1)
+    segmento_cabecera, segmento_claims = cuerpo.split(".")
+    kid = json.loads(tokens._desde_b64(segmento_cabecera))["kid"]
+    esperada = hmac.new(secretos[kid], cuerpo.encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(esperada, tokens._desde_b64(firma)):
+        raise tokens.TokenInvalido("Firma inválida")
+    claims = json.loads(tokens._desde_b64(segmento_claims))
+    if claims["exp"] < time.time():
+        raise tokens.TokenInvalido("Token vencido")
+    return claims
+
+
+def _medir(verificar, lista, repeticiones):
+    """Microsegundos por verificación en varias pasadas sobre la lista de tokens"""
+    por_pasada = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for token in lista:
+            verificar(token)
+        por_pasada.append((time.perf_counter() - inicio) * 1e6 / len(lista))
+    return statistics.median(por_pasada)
+
+
+def benchmark_tokens(cantidad, repeticiones):
+    secretos = {
+        kid: secreto.encode()
+        for kid, _, secreto in (p.strip().partition(":") for p in tokens.TOKEN_CLAVES.split(",") if p.strip())
+    }
+
+    inicio = time.perf_counter()
+    lista = [tokens.emitir_token(i, f"usuario{i}", "estudiante")[0] for i in range(cantidad)]
+    emision_us = (time.perf_counter() - inicio) * 1e6 / cantidad
+
+    modos = {
+        "sin caché": lambda t: _verificar_sin_cache(t, secretos),
+        "con caché": tokens.verificar_token,
+    }
+    print(f"Emisión: {emision_us:.2f} µs/token ({1e6 / emision_us:,.0f} tokens/s)")
+    print(f"{'verificación':<14}{'µs/token':>10}{'tokens/s':>14}")
+    for nombre, verificar in modos.items():
+        us = _medir(verificar, lista, repeticiones)
+        print(f"{nombre:<14}{us:>10.2f}{1e6 / us:>14,.0f}")
+
+    # Rotación: un token firmado con otra clave conocida sigue siendo válido
+    if len(tokens.CLAVES) > 1:
+        otras = [kid for kid in tokens.CLAVES if kid != tokens.CLAVE_ACTIVA]
+        activa = tokens.CLAVE_ACTIVA
+        tokens.CLAVE_ACTIVA = otras[0]
+        token_viejo, _ = tokens.emitir_token(0, "rotacion", "estudiante")
+        tokens.CLAVE_ACTIVA = activa
+        tokens.verificar_token(token_viejo)
+        print(f"✅ Tokens firmados con '{otras[0]}' siguen siendo válidos mientras la clave esté en TOKEN_CLAVES")
+
+
+def benchmark_hash(verificaciones, procesos):
+    """Verificaciones pbkdf2 por segundo según la cantidad de procesos del pool"""
+    from database import pwd_context, verify_password
+
+    hash_guardado = pwd_context.hash("estudiante123")
+    print(f"{'procesos':>9}{'verif/s':>10}{'aceleración':>13}")
+    base = None
+    for n in procesos:
+        with ProcessPoolExecutor(max_workers=n) as pool:
+            # Calienta los procesos antes de medir
+            list(pool.map(verify_password, ["x"] * n, [hash_guardado] * n))
+            inicio = time.perf_counter()
+            list(pool.map(verify_password, ["estudiante123"] * verificaciones, [hash_guardado] * verificaciones))
+            por_segundo = verificaciones / (time.perf_counter() - inicio)
+        base = base or por_segundo
+        print(f"{n:>9}{por_segundo:>10.1f}{por_segundo / base:>12.2f}x")
+
+
+async def benchmark_login(base_url, logins, concurrentes):
+    """
+    Tormenta de logins contra el servicio mientras se mide la latencia de /health.
+
+    Compara /health en reposo y durante la tormenta: con el hash fuera del event
+    loop no debería cambiar aunque los logins se encolen o reciban 429.
+    """
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("❌ login requiere 'httpx' (pip install httpx)")
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+        async def medir_health(hasta):
+            latencias = []
+            while not hasta.is_set():
+                inicio = time.perf_counter()
+                await client.get("/health")
+                latencias.append((time.perf_counter() - inicio) * 1000)
+                await asyncio.sleep(0.05)
+            return latencias
+
+        reposo = asyncio.Event()
+        tarea = asyncio.create_task(medir_health(reposo))
+        await asyncio.sleep(2)
+        reposo.set()
+        en_reposo = await tarea
+
+        codigos = Counter()
+        pendientes = iter(range(logins))
+
+        async def cliente():
+            for _ in pendientes:
+                r = await client.post("/login", json={"username": "estudiante1", "password": "estudiante123"})
+                codigos[r.status_code] += 1
+
+        fin = asyncio.Event()
+        tarea = asyncio.create_task(medir_health(fin))
+        inicio = time.perf_counter()
+        await asyncio.gather(*(cliente() for _ in range(concurrentes)))
+        duracion = time.perf_counter() - inicio
+        fin.set()
+        en_tormenta = await tarea
+
+    def p95(valores):
+        valores = sorted(valores)
+        return valores[min(int(len(valores) * 0.95), len(valores) - 1)]
+
+    print(f"Logins: {codigos[200] / duracion:.1f}/s exitosos en {duracion:.1f} s, respuestas {dict(codigos)}")
+    print(f"/health en reposo:   p50 {statistics.median(en_reposo):.1f} ms, p95 {p95(en_reposo):.1f} ms")
+    print(f"/health en tormenta: p50 {statistics.median(en_tormenta):.1f} ms, p95 {p95(en_tormenta):.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks del microservicio de autenticación")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("tokens", help="Emisión y verificación local de tokens firmados")
+    p.add_argument("--cantidad", type=int, default=20000)
+    p.add_argument("--repeticiones", type=int, default=5)
+
+    p = sub.add_parser("hash", help="Escalamiento de la verificación pbkdf2 con procesos")
+    p.add_argument("--verificaciones", type=int, default=200)
+    p.add_argument("--procesos", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}))
+
+    p = sub.add_parser("login", help="Tormenta de logins contra el servicio midiendo /health")
+    p.add_argument("--url", default="http://localhost:8001")
+    p.add_argument("--logins", type=int, default=500)
+    p.add_argument("--concurrentes", type=int, default=64)
+
+    args = parser.parse_args()
+    if args.comando == "tokens":
+        benchmark_tokens(args.cantidad, args.repeticiones)
+    elif args.comando == "hash":
+        benchmark_hash(args.verificaciones, args.procesos)
+    elif args.comando == "login":
+        asyncio.run(benchmark_login(args.url, args.logins, args.concurrentes))
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from database import verify_password, hash_password
+
+# pbkdf2 ocupa un núcleo entero mientras corre: un proceso por núcleo
+HASH_PROCESOS = int(os.getenv("HASH_PROCESOS", str(os.cpu_count() or 1)))
+# Verificaciones que pueden esperar turno además de las que ya corren; el resto recibe 429
+HASH_COLA_MAX = int(os.getenv("HASH_COLA_MAX", str(HASH_PROCESOS * 8)))
+
+
+class ColaLlena(Exception):
+    pass
+
+
+class PoolContrasenas:
+    """
+    Verificación y hash de contraseñas en un pool de procesos acotado.
+
+    Con 30.000 rondas de pbkdf2 cada verificación tarda decenas de ms de CPU.
+    Fuera del event loop el resto de las peticiones siguen atendiéndose, y con
+    varios procesos los logins se reparten entre los núcleos en lugar de
+    hacerse de a uno. Si ya hay HASH_PROCESOS + HASH_COLA_MAX trabajos
+    pendientes se rechaza de inmediato: esperar más solo alargaría la cola
+    sin aumentar el ritmo de logins.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._pendientes = 0
+        self._latencias_ms = deque(maxlen=500)
+        self.metricas = {"completadas": 0, "rechazadas": 0, "max_pendientes": 0}
+
+    def iniciar(self):
+        self._pool = ProcessPoolExecutor(max_workers=HASH_PROCESOS)
+
+    def cerrar(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def _ejecutar(self, funcion, *args):
+        if self._pendientes >= HASH_PROCESOS + HASH_COLA_MAX:
+            self.metricas["rechazadas"] += 1
+            raise ColaLlena()
+        self._pendientes += 1
+        self.metricas["max_pendientes"] = max(self.metricas["max_pendientes"], self._pendientes)
+        inicio = time.perf_counter()
+        try:
+            if self._pool is None:
+                # Sin pool (scripts): al menos fuera del event loop
+                return await asyncio.to_thread(funcion, *args)
+            return await asyncio.get_running_loop().run_in_executor(self._pool, funcion, *args)
+        finally:
+            self._pendientes -= 1
+            self._latencias_ms.append((time.perf_counter() - inicio) * 1000)
+            self.metricas["completadas"] += 1
+
+    async def verificar(self, contrasena, hash_guardado):
+        return await self._ejecutar(verify_password, contrasena, hash_guardado)
+
+    async def hashear(self, contrasena):
+        return await self._ejecutar(hash_password, contrasena)
+
+    def estado(self):
+        latencias = sorted(self._latencias_ms)
+        return {
+            "procesos": HASH_PROCESOS,
+            "pendientes": self._pendientes,
+            "capacidad": HASH_PROCESOS + HASH_COLA_MAX,
+            **self.metricas,
+            "p50_ms": round(latencias[len(latencias) // 2], 1) if latencias else None,
+            "p95_ms": round(latencias[min(int(len(latencias) * 0.95), len(latencias) - 1)], 1) if latencias else None,
+        }
+
+
+pool_contrasenas = PoolContrasenas()
@@ -1,8 +1,9 @@
 from sqlalchemy.orm import Session
-from models import SessionLocal, Usuario
+from models import SessionLocal, Usuario, TokenRevocado
 from passlib.context import CryptContext
 import hashlib
 import secrets
+import time
 
 # CAMBIAR A PBKDF2 que no tiene límite de longitud
 pwd_context = CryptContext(
@@ -17,6 +18,42 @@ def get_user_by_username(db: Session, username: str):
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+def hash_password(plain_password):
+    return pwd_context.hash(plain_password)
+
+def revocar_token(db: Session, usuario_id, jti=None, emitidos_antes=None, expira=0):
+    """Registra un token (logout) o todos los de un usuario hasta un instante (cambio de contraseña)"""
+    ahora = int(time.time())
+    # Las revocaciones de tokens ya vencidos no aportan nada
+    db.query(TokenRevocado).filter(TokenRevocado.expira < ahora).delete()
+    db.add(TokenRevocado(usuario_id=usuario_id, jti=jti, emitidos_antes=emitidos_antes, expira=expira))
+    db.commit()
+
+def esta_revocado(db: Session, claims):
+    return db.query(TokenRevocado).filter(
+        TokenRevocado.usuario_id == int(claims["sub"]),
+        (TokenRevocado.jti == claims["jti"]) | (TokenRevocado.emitidos_antes >= claims["iat"])
+    ).first() is not None
+
+def usuario_de_claims(db: Session, claims):
+    """Usuario activo dueño del token, o None si no existe, está inactivo o el token fue revocado"""
+    if esta_revocado(db, claims):
+        return None
+    usuario = db.get(Usuario, int(claims["sub"]))
+    return usuario if usuario and usuario.is_active else None
+
+def guardar_password(db: Session, usuario_id, password_hash, expira):
+    """Guarda el hash nuevo y revoca lo emitido hasta ahora para el usuario, en una transacción"""
+    db.query(Usuario).filter(Usuario.id == usuario_id).update({Usuario.password_hash: password_hash})
+    revocar_token(db, usuario_id, emitidos_antes=time.time(), expira=expira)
+
+def revocaciones_desde(db: Session, desde: int, limite: int = 1000):
+    """Revocaciones vigentes con id mayor a `desde`, para que el gateway las sincronice"""
+    return db.query(TokenRevocado).filter(
+        TokenRevocado.id > desde,
+        TokenRevocado.expira >= int(time.time())
+    ).order_by(TokenRevocado.id).limit(limite).all()
+
 def initialize_database():
     """Inicializa la base de datos con datos de prueba"""
     from models import create_tables
@@ -1,14 +1,20 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional
 from sqlalchemy.orm import Session
-import hashlib
 import time
+import asyncio
 from sqlalchemy import text
 
 # Importar nuestros módulos
-from models import get_db, create_tables
-from database import get_user_by_username, verify_password, initialize_database
+from models import get_db, create_tables, Usuario
+from database import (
+    get_user_by_username, initialize_database, revocar_token, revocaciones_desde,
+    usuario_de_claims, guardar_password,
+)
+from tokens import emitir_token, verificar_token, token_de_cabecera, TokenInvalido, TOKEN_DURACION_SEGUNDOS
+from contrasenas import pool_contrasenas, ColaLlena
 
 app = FastAPI(title="Microservicio de Autenticación")
 
@@ -26,14 +32,29 @@ class LoginRequest(BaseModel):
     username: str
     password: str
 
+class CambioPassword(BaseModel):
+    password_actual: str
+    password_nueva: str
+
 class Token(BaseModel):
     access_token: str
     token_type: str
+    expires_in: int
     user: dict
 
-def create_access_token(username: str, role: str):
-    token_data = f"{username}_{role}_{time.time()}"
-    return hashlib.sha256(token_data.encode()).hexdigest()
+def create_access_token(user_id: int, username: str, role: str):
+    # Token firmado: cualquier servicio con la clave lo valida sin consultar la base
+    return emitir_token(user_id, username, role)
+
+def claims_de_peticion(authorization: Optional[str], token: Optional[str] = None):
+    """Valida el token de 'Authorization: Bearer ...' (o del parámetro) y devuelve sus claims"""
+    token = token_de_cabecera(authorization) or token
+    if not token:
+        raise HTTPException(status_code=401, detail="Token requerido")
+    try:
+        return verificar_token(token)
+    except TokenInvalido as e:
+        raise HTTPException(status_code=401, detail=f"Token inválido: {e}")
 
 def wait_for_database(max_retries=30, delay=2):
     """Espera a que PostgreSQL esté disponible"""
@@ -59,6 +80,12 @@ async def startup_event():
     print("🚀 Inicializando base de datos...")
     initialize_database()
     print("✅ Base de datos lista")
+    # Después de inicializar, para que los procesos no hereden conexiones abiertas
+    pool_contrasenas.iniciar()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    pool_contrasenas.cerrar()
 
 @app.get("/")
 async def root():
@@ -67,22 +94,35 @@ async def root():
 @app.post("/login", response_model=Token)
 async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
     try:
-        # Buscar usuario en la base de datos
-        user_db = get_user_by_username(db, login_data.username)
+        # Buscar usuario en la base de datos; en un hilo, porque esperar una
+        # conexión libre del pool no debe bloquear el event loop
+        user_db = await asyncio.to_thread(get_user_by_username, db, login_data.username)
         
         if not user_db:
             raise HTTPException(status_code=401, detail="Credenciales inválidas")
+        # Devuelve la conexión antes del hash; los atributos ya cargados siguen disponibles
+        db.expunge(user_db)
+        db.close()
         
-        # Verificar contraseña con bcrypt
-        if not verify_password(login_data.password, user_db.password_hash):
+        # Verificar contraseña en el pool de procesos, sin bloquear el event loop
+        try:
+            valida = await pool_contrasenas.verificar(login_data.password, user_db.password_hash)
+        except ColaLlena:
+            raise HTTPException(
+                status_code=429,
+                detail="Demasiados inicios de sesión simultáneos, reintenta en unos segundos",
+                headers={"Retry-After": "1"}
+            )
+        if not valida:
             raise HTTPException(status_code=401, detail="Credenciales inválidas")
         
         # Crear token
-        access_token = create_access_token(user_db.username, user_db.role)
+        access_token, expires_in = create_access_token(user_db.id, user_db.username, user_db.role)
         
         return {
             "access_token": access_token,
             "token_type": "bearer",
+            "expires_in": expires_in,
             "user": {
                 "id": user_db.id,
                 "username": user_db.username,
@@ -98,19 +138,88 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 @app.get("/users/me")
-async def read_users_me(token: str):
-    # Por ahora mantenemos esta función simple
-    return {"message": "Endpoint de usuario actual"}
+async def read_users_me(
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    # El token llega como 'Authorization: Bearer ...' o, por compatibilidad, como parámetro
+    claims = claims_de_peticion(authorization, token)
+    # Consultas síncronas en un hilo, como en /login
+    user_db = await asyncio.to_thread(usuario_de_claims, db, claims)
+    if not user_db:
+        raise HTTPException(status_code=401, detail="Token revocado o usuario no encontrado o inactivo")
+    return {
+        "id": user_db.id,
+        "username": user_db.username,
+        "email": user_db.email,
+        "role": user_db.role,
+        "full_name": user_db.full_name,
+        "token_expira": claims["exp"],
+    }
+
+@app.post("/logout")
+async def logout(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """Revoca el token usado; el gateway lo deja de aceptar al sincronizar las revocaciones"""
+    claims = claims_de_peticion(authorization)
+    await asyncio.to_thread(revocar_token, db, int(claims["sub"]), jti=claims["jti"], expira=claims["exp"])
+    return {"message": "Sesión cerrada"}
+
+@app.post("/users/me/password")
+async def cambiar_password(
+    datos: CambioPassword,
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Cambia la contraseña y revoca todos los tokens emitidos hasta ahora para el usuario"""
+    claims = claims_de_peticion(authorization)
+    user_db = await asyncio.to_thread(usuario_de_claims, db, claims)
+    if not user_db:
+        raise HTTPException(status_code=401, detail="Token revocado o usuario inexistente")
+    # Como en /login: la conexión vuelve al pool antes de los dos hashes
+    db.expunge(user_db)
+    db.close()
+    try:
+        if not await pool_contrasenas.verificar(datos.password_actual, user_db.password_hash):
+            raise HTTPException(status_code=401, detail="Contraseña actual incorrecta")
+        password_hash = await pool_contrasenas.hashear(datos.password_nueva)
+    except ColaLlena:
+        raise HTTPException(status_code=429, detail="Servicio ocupado, reintenta en unos segundos", headers={"Retry-After": "1"})
+    await asyncio.to_thread(
+        guardar_password, db, user_db.id, password_hash,
+        # Los tokens anteriores vencen como mucho una duración completa después de ahora
+        int(time.time()) + TOKEN_DURACION_SEGUNDOS
+    )
+    return {"message": "Contraseña actualizada, vuelve a iniciar sesión"}
+
+@app.get("/tokens/revocados")
+async def listar_revocaciones(desde: int = 0, db: Session = Depends(get_db)):
+    """Revocaciones vigentes posteriores al id `desde`; el gateway las consulta periódicamente"""
+    revocaciones = await asyncio.to_thread(revocaciones_desde, db, desde)
+    return {
+        "revocaciones": [
+            {
+                "id": r.id,
+                "usuario_id": r.usuario_id,
+                "jti": r.jti,
+                "emitidos_antes": r.emitidos_antes,
+                "expira": r.expira,
+            }
+            for r in revocaciones
+        ],
+        "ultimo": revocaciones[-1].id if revocaciones else desde,
+    }
 
 @app.get("/health")
 async def health_check(db: Session = Depends(get_db)):
     try:
-        # Verificar conexión a la base de datos
-        db.execute("SELECT 1")
+        # Verificar conexión a la base de datos, sin esperar el pool en el event loop
+        await asyncio.to_thread(db.execute, text("SELECT 1"))
         return {
             "status": "healthy", 
             "service": "autenticacion",
-            "database": "connected"
+            "database": "connected",
+            "contrasenas": pool_contrasenas.estado()
         }
     except Exception as e:
         return {
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -23,6 +23,16 @@ class Usuario(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class TokenRevocado(Base):
+    __tablename__ = "tokens_revocados"
+
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, nullable=False)
+    jti = Column(String(32), nullable=True)  # logout: un token concreto
+    emitidos_antes = Column(Float, nullable=True)  # cambio de contraseña: todos los tokens anteriores
+    expira = Column(Integer, nullable=False, index=True)  # pasado este instante ya no hace falta recordarla
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 # Crear tablas
 def create_tables():
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,131 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+from functools import lru_cache
+
+# Claves de firma como "id:secreto" separadas por coma. TOKEN_CLAVE_ACTIVA firma
+# los tokens nuevos; las demás solo se aceptan al verificar.
+# Rotación: agregar la clave nueva en todos los servicios, pasar TOKEN_CLAVE_ACTIVA
+# a ella y quitar la vieja cuando hayan vencido los tokens que firmó.
+# Sin TOKEN_CLAVES el servicio no arranca: cualquiera podría firmar tokens con una
+# clave conocida. La de desarrollo solo se acepta con TOKEN_PERMITIR_CLAVE_DESARROLLO=true.
+SECRETO_DESARROLLO = "clave-de-desarrollo-cambiar-en-produccion"
+TOKEN_PERMITIR_CLAVE_DESARROLLO = os.getenv("TOKEN_PERMITIR_CLAVE_DESARROLLO", "false").lower() == "true"
+TOKEN_CLAVES = os.getenv("TOKEN_CLAVES", "") or (f"dev:{SECRETO_DESARROLLO}" if TOKEN_PERMITIR_CLAVE_DESARROLLO else "")
+TOKEN_CLAVE_ACTIVA = os.getenv("TOKEN_CLAVE_ACTIVA", "")
+TOKEN_DURACION_SEGUNDOS = int(os.getenv("TOKEN_DURACION_MINUTOS", "60")) * 60
+# Tolerancia de reloj entre el servicio que emite y el que verifica
+TOKEN_TOLERANCIA_SEGUNDOS = 30
+
+
+class TokenInvalido(ValueError):
+    pass
+
+
+def _b64(datos: bytes) -> str:
+    return base64.urlsafe_b64encode(datos).rstrip(b"=").decode("ascii")
+
+
+def _desde_b64(texto: str) -> bytes:
+    return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+
+def _cargar_claves(texto):
+    """Un HMAC ya inicializado por clave; verificar solo copia su estado"""
+    claves = {}
+    for par in filter(None, (p.strip() for p in texto.split(","))):
+        kid, _, secreto = par.partition(":")
+        if not secreto:
+            raise RuntimeError(f"Clave de token sin secreto: {kid!r}")
+        if secreto == SECRETO_DESARROLLO and not TOKEN_PERMITIR_CLAVE_DESARROLLO:
+            raise RuntimeError("TOKEN_CLAVES usa la clave pública de desarrollo; definir un secreto propio")
+        claves[kid] = hmac.new(secreto.encode(), digestmod=hashlib.sha256)
+    if not claves:
+        raise RuntimeError(
+            "TOKEN_CLAVES no define ninguna clave (solo para desarrollo local: TOKEN_PERMITIR_CLAVE_DESARROLLO=true)"
+        )
+    return claves
+
+
+CLAVES = _cargar_claves(TOKEN_CLAVES)
+CLAVE_ACTIVA = TOKEN_CLAVE_ACTIVA or next(iter(CLAVES))
+if CLAVE_ACTIVA not in CLAVES:
+    raise RuntimeError(f"TOKEN_CLAVE_ACTIVA {CLAVE_ACTIVA!r} no está en TOKEN_CLAVES")
+
+
+def _firmar(kid, mensaje: bytes) -> bytes:
+    h = CLAVES[kid].copy()
+    h.update(mensaje)
+    return h.digest()
+
+
+@lru_cache(maxsize=32)
+def _cabecera(kid):
+    return _b64(json.dumps({"alg": "HS256", "typ": "JWT", "kid": kid}, separators=(",", ":")).encode())
+
+
+@lru_cache(maxsize=32)
+def _kid_de_cabecera(segmento):
+    # Todos los tokens de una misma clave comparten cabecera: se decodifica una vez
+    try:
+        cabecera = json.loads(_desde_b64(segmento))
+    except ValueError:
+        raise TokenInvalido("Cabecera ilegible")
+    if not isinstance(cabecera, dict) or cabecera.get("alg") != "HS256":
+        raise TokenInvalido("Algoritmo no admitido")
+    return cabecera.get("kid")
+
+
+def emitir_token(usuario_id: int, username: str, rol: str, duracion: int = TOKEN_DURACION_SEGUNDOS):
+    """JWT HS256 firmado con la clave activa; devuelve (token, expira_en_segundos)"""
+    ahora = time.time()
+    claims = {
+        "sub": str(usuario_id),
+        "usr": username,
+        "rol": rol,
+        # Con milésimas: un cambio de contraseña revoca lo emitido antes, no lo del mismo segundo después
+        "iat": round(ahora, 3),
+        "exp": int(ahora) + duracion,
+        "jti": uuid.uuid4().hex,
+    }
+    cuerpo = f"{_cabecera(CLAVE_ACTIVA)}.{_b64(json.dumps(claims, separators=(',', ':')).encode())}"
+    return f"{cuerpo}.{_b64(_firmar(CLAVE_ACTIVA, cuerpo.encode()))}", duracion
+
+
+def verificar_token(token: str):
+    """
+    Valida firma y vencimiento sin consultar la base; devuelve los claims.
+
+    Lanza TokenInvalido si el token está mal formado, lo firmó una clave
+    desconocida, la firma no coincide o ya venció.
+    """
+    try:
+        cuerpo, firma = token.rsplit(".", 1)
+        segmento_cabecera, segmento_claims = cuerpo.split(".")
+    except (AttributeError, ValueError):
+        raise TokenInvalido("Token mal formado")
+    kid = _kid_de_cabecera(segmento_cabecera)
+    if kid not in CLAVES:
+        raise TokenInvalido("Clave de firma desconocida")
+    try:
+        firma_recibida = _desde_b64(firma)
+    except ValueError:
+        raise TokenInvalido("Firma ilegible")
+    if not hmac.compare_digest(_firmar(kid, cuerpo.encode()), firma_recibida):
+        raise TokenInvalido("Firma inválida")
+    claims = json.loads(_desde_b64(segmento_claims))
+    if claims.get("exp", 0) + TOKEN_TOLERANCIA_SEGUNDOS < time.time():
+        raise TokenInvalido("Token vencido")
+    return claims
+
+
+def token_de_cabecera(authorization):
+    """Extrae el token de un encabezado 'Authorization: Bearer <token>'"""
+    if not authorization:
+        return None
+    esquema, _, token = authorization.partition(" ")
+    return token.strip() if esquema.lower() == "bearer" and token.strip() else None
@@ -0,0 +1,87 @@
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from generador import cargar_catalogo, CATEGORIAS
+
+
+def _usar_mongo_en_memoria():
+    """Sustituye las colecciones de models por colecciones de mongomock"""
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("❌ --memoria requiere 'mongomock' (pip install mongomock)")
+
+    import models
+    db = mongomock.MongoClient().biblioteca
+    models.db = db
+    models.libros_collection = db.libros
+    models.autores_collection = db.autores
+    models.categorias_collection = db.categorias
+
+
+def _medir(client, url, repeticiones):
+    """Ejecuta una petición varias veces y devuelve latencias (ms) y pico de memoria (MB)"""
+    # Una pasada con tracemalloc para la memoria; no se cronometra porque lo ralentiza
+    tracemalloc.start()
+    response = client.get(url)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} respondió {response.status_code}: {response.text[:200]}")
+
+    latencias = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        client.get(url)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+    return latencias, pico / (1024 * 1024)
+
+
+def ejecutar(num_libros, repeticiones, semilla, memoria, cargar):
+    if memoria:
+        _usar_mongo_en_memoria()
+
+    import models
+    if cargar or memoria:
+        inicio = time.perf_counter()
+        cargar_catalogo(models.libros_collection, models.autores_collection, num_libros, semilla=semilla)
+        print(f"⏱️  Carga: {time.perf_counter() - inicio:.1f}s")
+
+    # Sin bloque `with` para no disparar los eventos de startup (inicializar_datos)
+    from fastapi.testclient import TestClient
+    from main import app, construir_indice_sugerencias
+    construir_indice_sugerencias()
+    client = TestClient(app)
+
+    autor = models.libros_collection.find_one({}, {"autor": 1})["autor"]
+    casos = [
+        ("listar", "/libros"),
+        ("filtrar categoría", f"/libros?categoria={CATEGORIAS[-1][0]}"),
+        ("filtrar autor", f"/libros?autor={autor}"),
+        ("buscar título", "/libros?search=memoria"),
+        ("sugerir", "/libros/suggest?q=mem"),
+        ("por id", f"/libros/{num_libros // 2 or 1}"),
+        ("categorías", "/categorias"),
+    ]
+
+    print(f"\n📊 {num_libros} libros, {repeticiones} repeticiones")
+    print(f"{'endpoint':<20}{'p50 ms':>10}{'p95 ms':>10}{'máx ms':>10}{'pico MB':>10}")
+    for nombre, url in casos:
+        latencias, pico = _medir(client, url, repeticiones)
+        latencias.sort()
+        p95 = latencias[min(int(len(latencias) * 0.95), len(latencias) - 1)]
+        print(f"{nombre:<20}{statistics.median(latencias):>10.2f}{p95:>10.2f}{latencias[-1]:>10.2f}{pico:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de los endpoints del catálogo")
+    parser.add_argument("--libros", type=int, default=100000)
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--memoria", action="store_true", help="Usar mongomock en lugar de un mongod local")
+    parser.add_argument("--cargar", action="store_true", help="Recargar el catálogo sintético en el mongod")
+    args = parser.parse_args()
+
+    ejecutar(args.libros, args.repeticiones, args.semilla, args.memoria, args.cargar)
@@ -1,5 +1,10 @@
 from models import libros_collection, autores_collection, categorias_collection
 from datetime import datetime
+import os
+
+# Si se define, el catálogo se llena con N libros sintéticos en lugar de los de ejemplo
+CATALOGO_SINTETICO_LIBROS = int(os.getenv("CATALOGO_SINTETICO_LIBROS", "0"))
+CATALOGO_SINTETICO_SEMILLA = int(os.getenv("CATALOGO_SINTETICO_SEMILLA", "42"))
 
 def inicializar_datos():
     """Inicializa MongoDB con datos de ejemplo"""
@@ -9,6 +14,12 @@ def inicializar_datos():
         print("✅ MongoDB ya contiene datos")
         return
     
+    if CATALOGO_SINTETICO_LIBROS > 0:
+        from generador import cargar_catalogo
+        cargar_catalogo(libros_collection, autores_collection, CATALOGO_SINTETICO_LIBROS,
+                        semilla=CATALOGO_SINTETICO_SEMILLA)
+        return
+    
     # Insertar autores
     autores = [
         {"_id": 1, "nombre": "Gabriel García Márquez", "nacionalidad": "Colombiana"},
@@ -0,0 +1,144 @@
+import argparse
+import random
+from typing import Dict, Iterator, List, Tuple
+
+# Distribución aproximada de categorías en una biblioteca universitaria
+CATEGORIAS = [
+    ("Literatura", 0.22), ("Ciencia", 0.12), ("Historia", 0.10), ("Ingeniería", 0.10),
+    ("Ciencia Ficción", 0.07), ("Filosofía", 0.06), ("Matemáticas", 0.06), ("Derecho", 0.05),
+    ("Medicina", 0.05), ("Economía", 0.05), ("Poesía", 0.04), ("Fantasía", 0.03),
+    ("Romance", 0.02), ("Terror", 0.02), ("Teatro", 0.01),
+]
+
+NACIONALIDADES = [
+    "Colombiana", "Argentina", "Chilena", "Peruana", "Mexicana", "Española",
+    "Británica", "Estadounidense", "Francesa", "Alemana", "Rusa", "Italiana",
+]
+
+NOMBRES = [
+    "Gabriel", "Isabel", "Mario", "Julio", "Jorge", "Pablo", "Laura", "Ana", "Carlos",
+    "María", "Sofía", "Andrés", "Lucía", "Juan", "Elena", "Pedro", "Clara", "Tomás",
+    "Valeria", "Diego", "Camila", "Santiago", "Paula", "Ricardo", "Marta", "Héctor",
+]
+
+APELLIDOS = [
+    "García", "Márquez", "Allende", "Vargas", "Cortázar", "Borges", "Neruda", "López",
+    "Rodríguez", "González", "Pérez", "Martínez", "Sánchez", "Ramírez", "Castro", "Ortiz",
+    "Salcedo", "Betancourth", "Ibarra", "Oliva", "Moreno", "Rojas", "Herrera", "Mejía",
+]
+
+PALABRAS_TITULO = [
+    "historia", "tiempo", "ciudad", "noche", "amor", "guerra", "mar", "sombra", "memoria",
+    "ciencia", "mundo", "río", "silencio", "luz", "camino", "casa", "sueño", "fuego",
+    "principios", "teoría", "introducción", "fundamentos", "análisis", "sistemas", "cálculo",
+    "derecho", "economía", "filosofía", "soledad", "viento", "espejo", "laberinto", "jardín",
+]
+
+CONECTORES = ["de", "del", "en", "y", "sobre", "para", "la", "el", "los", "las"]
+
+EDITORIALES = [
+    "Sudamericana", "Planeta", "Alfaguara", "Anagrama", "Debate", "Seix Barral",
+    "Salamandra", "Penguin", "McGraw-Hill", "Pearson", "Siglo XXI", "Fondo de Cultura Económica",
+]
+
+
+def calcular_isbn13(prefijo: str) -> str:
+    """Completa un prefijo de 12 dígitos con el dígito de control ISBN-13"""
+    suma = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(prefijo))
+    return prefijo + str((10 - suma % 10) % 10)
+
+
+def _pesos_zipf(n: int, s: float = 1.1) -> List[float]:
+    """Pesos acumulados de una distribución Zipf: pocos autores concentran muchos títulos"""
+    acumulado, total = [], 0.0
+    for rango in range(1, n + 1):
+        total += 1.0 / (rango ** s)
+        acumulado.append(total)
+    return acumulado
+
+
+def generar_autores(num_autores: int, semilla: int = 42) -> List[Dict]:
+    """Genera autores con nombres y nacionalidades plausibles"""
+    rng = random.Random(semilla)
+    return [
+        {
+            "_id": autor_id,
+            "nombre": f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}",
+            "nacionalidad": rng.choice(NACIONALIDADES),
+        }
+        for autor_id in range(1, num_autores + 1)
+    ]
+
+
+def generar_libros(num_libros: int, autores: List[Dict], semilla: int = 42) -> Iterator[Dict]:
+    """
+    Genera libros de forma perezosa y determinista para una semilla dada.
+
+    Los autores siguen una distribución Zipf, las categorías los pesos de
+    CATEGORIAS y los ejemplares una distribución geométrica (la mayoría de
+    títulos tienen 1-3 copias y unos pocos decenas).
+    """
+    rng = random.Random(semilla + 1)
+    pesos_autores = _pesos_zipf(len(autores))
+    nombres_categorias = [c for c, _ in CATEGORIAS]
+    pesos_categorias = [p for _, p in CATEGORIAS]
+
+    for libro_id in range(1, num_libros + 1):
+        autor = rng.choices(autores, cum_weights=pesos_autores)[0]
+        palabras = rng.sample(PALABRAS_TITULO, rng.randint(1, 3))
+        titulo = f" {rng.choice(CONECTORES)} ".join(palabras).capitalize()
+        ejemplares_totales = min(1 + int(rng.expovariate(0.35)), 60)
+
+        yield {
+            "_id": libro_id,
+            "titulo": titulo,
+            "autor_id": autor["_id"],
+            "autor": autor["nombre"],
+            "categoria": rng.choices(nombres_categorias, weights=pesos_categorias)[0],
+            "isbn": calcular_isbn13(f"978{libro_id:09d}"),
+            "año_publicacion": int(min(max(rng.gauss(1995, 20), 1600), 2024)),
+            "editorial": rng.choice(EDITORIALES),
+            "ejemplares_disponibles": rng.randint(0, ejemplares_totales),
+            "ejemplares_totales": ejemplares_totales,
+            "descripcion": f"Obra de {autor['nombre']} sobre {palabras[0]}",
+        }
+
+
+def generar_catalogo(num_libros: int, num_autores: int = None, semilla: int = 42) -> Tuple[List[Dict], Iterator[Dict]]:
+    """Devuelve (autores, generador de libros); por defecto un autor por cada 20 libros"""
+    num_autores = num_autores or max(num_libros // 20, 1)
+    autores = generar_autores(num_autores, semilla)
+    return autores, generar_libros(num_libros, autores, semilla)
+
+
+def cargar_catalogo(libros_collection, autores_collection, num_libros: int,
+                    num_autores: int = None, semilla: int = 42, lote: int = 10000):
+    """Reemplaza el contenido de las colecciones con un catálogo sintético insertado por lotes"""
+    autores, libros = generar_catalogo(num_libros, num_autores, semilla)
+
+    libros_collection.delete_many({})
+    autores_collection.delete_many({})
+    autores_collection.insert_many(autores, ordered=False)
+
+    buffer = []
+    for libro in libros:
+        buffer.append(libro)
+        if len(buffer) >= lote:
+            libros_collection.insert_many(buffer, ordered=False)
+            buffer = []
+    if buffer:
+        libros_collection.insert_many(buffer, ordered=False)
+
+    print(f"✅ Catálogo sintético cargado: {num_libros} libros y {len(autores)} autores (semilla {semilla})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga un catálogo sintético en MongoDB")
+    parser.add_argument("--libros", type=int, default=100000)
+    parser.add_argument("--autores", type=int, default=None)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--lote", type=int, default=10000)
+    args = parser.parse_args()
+
+    from models import libros_collection, autores_collection
+    cargar_catalogo(libros_collection, autores_collection, args.libros, args.autores, args.semilla, args.lote)
@@ -6,12 +6,14 @@ from bson import ObjectId
 import json
 import time
 from pymongo import MongoClient
+from pymongo import UpdateOne
 from pymongo.errors import ServerSelectionTimeoutError
 
 
 # Importar nuestros módulos
 from models import get_libros_collection, get_autores_collection
 from database import inicializar_datos
+from sugerencias import indice_sugerencias, MAX_SUGERENCIAS
 
 app = FastAPI(title="Microservicio de Catálogo")
 
@@ -52,8 +54,20 @@ async def startup_event():
     if wait_for_mongodb():
         inicializar_datos()
         print("✅ Base de datos lista")
+        construir_indice_sugerencias()
     else:
         print("❌ No se pudo inicializar la base de datos")
+
+# Campos que usa el índice de autocompletado
+PROYECCION_SUGERENCIAS = {"titulo": 1, "autor": 1, "popularidad": 1, "ejemplares_totales": 1, "ejemplares_disponibles": 1}
+
+def construir_indice_sugerencias():
+    """Carga títulos y autores en el índice de autocompletado"""
+    inicio = time.perf_counter()
+    libros = get_libros_collection().find({}, PROYECCION_SUGERENCIAS)
+    indice_sugerencias.construir(libros)
+    print(f"✅ Índice de sugerencias con {len(indice_sugerencias)} libros ({time.perf_counter() - inicio:.2f}s)")
+
 # Modelos Pydantic
 class LibroResponse(BaseModel):
     id: int
@@ -68,6 +82,22 @@ class LibroResponse(BaseModel):
     ejemplares_totales: int
     descripcion: Optional[str] = None
 
+class SugerenciaResponse(BaseModel):
+    id: int
+    titulo: str
+    autor: str
+    popularidad: int
+
+class EventoPrestamo(BaseModel):
+    id: int
+    tipo: str
+    prestamo_id: int
+    usuario_id: int
+    libro_id: int
+
+class LoteEventosPrestamo(BaseModel):
+    eventos: List[EventoPrestamo]
+
 class AutorResponse(BaseModel):
     id: int
     nombre: str
@@ -91,6 +121,15 @@ async def startup_event():
 async def root():
     return {"message": "Microservicio de Catálogo funcionando"}
 
+# Campos internos que no se exponen en la API
+PROYECCION_LIBRO = {"eventos_aplicados": 0}
+
+# Ids de eventos recordados por libro para descartar entregas repetidas
+EVENTOS_RECORDADOS_POR_LIBRO = 500
+
+# Cambio en ejemplares disponibles por tipo de evento de préstamo
+DELTA_DISPONIBLES = {"prestamo_creado": -1, "prestamo_devuelto": 1}
+
 @app.get("/libros", response_model=List[LibroResponse])
 async def listar_libros(
     categoria: Optional[str] = Query(None, description="Filtrar por categoría"),
@@ -107,7 +146,7 @@ async def listar_libros(
     if search:
         query["titulo"] = {"$regex": search, "$options": "i"}
     
-    libros = list(collection.find(query))
+    libros = list(collection.find(query, PROYECCION_LIBRO))
     
     # Convertir _id de MongoDB a id numérico
     for libro in libros:
@@ -116,10 +155,18 @@ async def listar_libros(
     
     return libros
 
+# Debe declararse antes de /libros/{libro_id} para que "suggest" no se tome como id
+@app.get("/libros/suggest", response_model=List[SugerenciaResponse])
+async def sugerir_libros(
+    q: str = Query(..., min_length=1, description="Prefijo de título o autor"),
+    limite: int = Query(10, ge=1, le=MAX_SUGERENCIAS, description="Máximo de sugerencias")
+):
+    return indice_sugerencias.sugerir(q, limite)
+
 @app.get("/libros/{libro_id}", response_model=LibroResponse)
 async def obtener_libro(libro_id: int):
     collection = get_libros_collection()
-    libro = collection.find_one({"_id": libro_id})
+    libro = collection.find_one({"_id": libro_id}, PROYECCION_LIBRO)
     
     if not libro:
         raise HTTPException(status_code=404, detail="Libro no encontrado")
@@ -128,6 +175,38 @@ async def obtener_libro(libro_id: int):
     del libro["_id"]
     return libro
 
+@app.post("/eventos/prestamos")
+async def procesar_eventos_prestamos(lote: LoteEventosPrestamo):
+    """
+    Ajusta la disponibilidad con los eventos de la outbox de préstamos.
+
+    El id del evento se guarda en el mismo documento que se actualiza, así la
+    condición `$ne` vuelve idempotente cada entrega sin transacciones. La
+    popularidad del autocompletado depende de los disponibles: se relee de los
+    libros tocados para que una entrega repetida no la cuente dos veces.
+    """
+    operaciones = [
+        UpdateOne(
+            {"_id": evento.libro_id, "eventos_aplicados": {"$ne": evento.id}},
+            {
+                "$inc": {"ejemplares_disponibles": DELTA_DISPONIBLES[evento.tipo]},
+                "$push": {"eventos_aplicados": {"$each": [evento.id], "$slice": -EVENTOS_RECORDADOS_POR_LIBRO}},
+            },
+        )
+        for evento in lote.eventos
+        if evento.tipo in DELTA_DISPONIBLES
+    ]
+    if not operaciones:
+        return {"aplicados": 0}
+    
+    collection = get_libros_collection()
+    result = collection.bulk_write(operaciones, ordered=True)
+    if result.modified_count:
+        libro_ids = list({evento.libro_id for evento in lote.eventos if evento.tipo in DELTA_DISPONIBLES})
+        for libro in collection.find({"_id": {"$in": libro_ids}}, PROYECCION_SUGERENCIAS):
+            indice_sugerencias.actualizar_popularidad(libro["_id"], indice_sugerencias.popularidad(libro))
+    return {"aplicados": result.modified_count}
+
 @app.get("/autores", response_model=List[AutorResponse])
 async def listar_autores():
     collection = get_autores_collection()
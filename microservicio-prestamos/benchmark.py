@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+from sqlalchemy import text
+
+BASE_URL = "http://localhost:8003"
+
+
+def _resumen(latencias, duracion):
+    latencias.sort()
+    p95 = latencias[min(int(len(latencias) * 0.95), len(latencias) - 1)]
+    return {
+        "rps": len(latencias) / duracion,
+        "p50": statistics.median(latencias),
+        "p95": p95,
+    }
+
+
+async def _peticion(client, metodo, url, latencias, **kwargs):
+    inicio = time.perf_counter()
+    response = await client.request(metodo, url, **kwargs)
+    latencias.append((time.perf_counter() - inicio) * 1000)
+    response.raise_for_status()
+    return response
+
+
+async def concurrencia(base_url, niveles, peticiones):
+    """Mide rendimiento de lecturas y escrituras mezcladas a distintos niveles de concurrencia"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0,
+                                 limits=httpx.Limits(max_connections=max(niveles))) as client:
+        print(f"{'concurrencia':>12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'pico pool':>12}")
+        for nivel in niveles:
+            latencias = []
+            semaforo = asyncio.Semaphore(nivel)
+
+            async def una(i):
+                async with semaforo:
+                    if i % 4 == 0:
+                        await _peticion(client, "POST", "/prestamos", latencias, json={
+                            "usuario_id": random.randint(1, 1000),
+                            "libro_id": random.randint(1, 5000),
+                        })
+                    else:
+                        await _peticion(client, "GET", f"/prestamos/usuario/{random.randint(1, 1000)}", latencias)
+
+            inicio = time.perf_counter()
+            await asyncio.gather(*(una(i) for i in range(peticiones)))
+            r = _resumen(latencias, time.perf_counter() - inicio)
+            pool = (await client.get("/health")).json().get("pool", {})
+            print(f"{nivel:>12}{r['rps']:>10.0f}{r['p50']:>10.2f}{r['p95']:>10.2f}{pool.get('pico_checked_out', 0):>12}")
+
+
+async def bulk(base_url, items, rondas):
+    """Compara préstamos y devoluciones una a una contra los endpoints masivos"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0) as client:
+        def nuevos():
+            return [{"usuario_id": random.randint(1, 1000), "libro_id": random.randint(1, 5000)}
+                    for _ in range(items)]
+
+        tiempos = {"individual": [], "bulk": []}
+        for _ in range(rondas):
+            latencias = []
+            inicio = time.perf_counter()
+            ids = []
+            for item in nuevos():
+                ids.append((await _peticion(client, "POST", "/prestamos", latencias, json=item)).json()["id"])
+            for prestamo_id in ids:
+                await _peticion(client, "POST", f"/prestamos/{prestamo_id}/devolver", latencias)
+            tiempos["individual"].append(time.perf_counter() - inicio)
+
+            inicio = time.perf_counter()
+            creados = (await _peticion(client, "POST", "/prestamos/bulk", latencias, json={"items": nuevos()})).json()
+            await _peticion(client, "POST", "/prestamos/devolver/bulk", latencias,
+                            json={"prestamo_ids": [p["id"] for p in creados]})
+            tiempos["bulk"].append(time.perf_counter() - inicio)
+
+        print(f"{'modo':<12}{'items/s':>12}{'ms por ronda':>16}")
+        for modo, duraciones in tiempos.items():
+            media = statistics.mean(duraciones)
+            print(f"{modo:<12}{2 * items / media:>12.0f}{media * 1000:>16.1f}")
+
+
+# Consultas calientes que nunca deben recorrer la tabla completa
+CONSULTAS_CALIENTES = {
+    "préstamos por usuario": "SELECT * FROM prestamos WHERE usuario_id = 4242",
+    "préstamos activos por usuario": "SELECT * FROM prestamos WHERE usuario_id = 4242 AND estado = 'activo'",
+    "activos por libro": "SELECT count(*) FROM prestamos WHERE libro_id = 777 AND estado = 'activo'",
+    "préstamos vencidos": "SELECT id FROM prestamos WHERE estado = 'activo' AND fecha_devolucion_esperada < now()",
+    "reservas por usuario": "SELECT * FROM reservas WHERE usuario_id = 4242",
+    "reservas activas por libro": "SELECT count(*) FROM reservas WHERE libro_id = 777 AND estado = 'activa'",
+    "reservas vencidas": "SELECT id FROM reservas WHERE estado = 'activa' AND fecha_vencimiento < now()",
+}
+
+
+def _nodos(plan):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+async def planes(filas):
+    """
+    Verifica con EXPLAIN que las consultas calientes usan índices.
+
+    Con --filas inserta datos sintéticos (95% de préstamos devueltos) dentro de
+    una transacción que se revierte al final, así que no deja rastro en la base.
+    """
+    from models import engine, SIN_LIMITE_SENTENCIAS
+    from migraciones import aplicar_migraciones
+
+    await aplicar_migraciones()
+    fallos = []
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        try:
+            await conn.execute(SIN_LIMITE_SENTENCIAS)
+            if filas:
+                await conn.execute(text("""
+                    INSERT INTO prestamos (usuario_id, libro_id, fecha_prestamo, fecha_devolucion_esperada,
+                                           estado, multa, dias_retraso, created_at)
+                    SELECT (random() * 50000)::int, (random() * 100000)::int, f, f + interval '15 days',
+                           CASE WHEN random() < 0.95 THEN 'devuelto' ELSE 'activo' END, 0, 0, f
+                    FROM (SELECT now() - random() * interval '3 years' AS f FROM generate_series(1, :n)) s
+                """), {"n": filas})
+                await conn.execute(text("""
+                    INSERT INTO reservas (usuario_id, libro_id, fecha_reserva, fecha_vencimiento, estado, created_at)
+                    SELECT (random() * 50000)::int, (random() * 100000)::int, f, f + interval '7 days',
+                           CASE WHEN random() < 0.95 THEN 'cumplida' ELSE 'activa' END, f
+                    FROM (SELECT now() - random() * interval '3 years' AS f FROM generate_series(1, :n)) s
+                """), {"n": filas})
+                await conn.execute(text("ANALYZE prestamos"))
+                await conn.execute(text("ANALYZE reservas"))
+
+            for nombre, consulta in CONSULTAS_CALIENTES.items():
+                plan = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {consulta}"))).scalar()[0]["Plan"]
+                tipos = [n["Node Type"] for n in _nodos(plan)]
+                estado = "❌" if "Seq Scan" in tipos else "✅"
+                if estado == "❌":
+                    fallos.append(nombre)
+                print(f"{estado} {nombre:<32}{' > '.join(tipos)}")
+        finally:
+            await trans.rollback()
+
+    if fallos:
+        raise SystemExit(f"❌ Consultas con Seq Scan: {', '.join(fallos)}")
+
+
+# Consultas sobre préstamos en curso, que no deberían depender del tamaño del historial
+CONSULTAS_ACTIVOS = {
+    "activos por usuario": "SELECT * FROM prestamos WHERE usuario_id = 4242 AND estado = 'activo'",
+    "activos por libro": "SELECT count(*) FROM prestamos WHERE libro_id = 777 AND estado = 'activo'",
+    "vencidos por marcar": "SELECT id FROM prestamos WHERE estado = 'activo' AND fecha_devolucion_esperada < now()",
+}
+
+
+async def particiones(pasos, repeticiones):
+    """
+    Latencia de las consultas de préstamos activos a medida que crece el historial.
+
+    En cada paso agrega préstamos devueltos de meses pasados hasta llegar al total
+    indicado. Como en `planes`, todo se revierte al terminar.
+    """
+    from models import engine, SIN_LIMITE_SENTENCIAS
+    from migraciones import aplicar_migraciones
+    from particiones import asegurar_particiones
+
+    await aplicar_migraciones()
+    await asegurar_particiones()
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        try:
+            await conn.execute(SIN_LIMITE_SENTENCIAS)
+            await conn.execute(text("""
+                INSERT INTO prestamos (usuario_id, libro_id, fecha_prestamo, fecha_devolucion_esperada,
+                                       estado, multa, dias_retraso, created_at)
+                SELECT (random() * 50000)::int, (random() * 100000)::int, f, f + interval '15 days', 'activo', 0, 0, f
+                FROM (SELECT now() - random() * interval '20 days' AS f FROM generate_series(1, 10000)) s
+            """))
+            print(f"{'historial':>12}" + "".join(f"{nombre:>24}" for nombre in CONSULTAS_ACTIVOS))
+            historial = 0
+            for total in pasos:
+                await conn.execute(text("""
+                    INSERT INTO prestamos (usuario_id, libro_id, fecha_prestamo, fecha_devolucion_esperada,
+                                           fecha_devolucion_real, estado, multa, dias_retraso, created_at)
+                    SELECT (random() * 50000)::int, (random() * 100000)::int, f, f + interval '15 days',
+                           f + interval '10 days', 'devuelto', 0, 0, f
+                    FROM (SELECT now() - interval '1 month' - random() * interval '3 years' AS f
+                          FROM generate_series(1, :n)) s
+                """), {"n": max(total - historial, 0)})
+                historial = max(total, historial)
+                await conn.execute(text("ANALYZE prestamos"))
+
+                medias = []
+                for consulta in CONSULTAS_ACTIVOS.values():
+                    latencias = []
+                    for _ in range(repeticiones):
+                        inicio = time.perf_counter()
+                        await conn.execute(text(consulta))
+                        latencias.append((time.perf_counter() - inicio) * 1000)
+                    medias.append(statistics.median(latencias))
+                print(f"{historial:>12}" + "".join(f"{m:>21.2f} ms" for m in medias))
+        finally:
+            await trans.rollback()
+
+
+def multas(filas, escenarios):
+    """
+    Compara calcular_multa fila por fila contra el motor vectorizado de reportes.
+
+    Usa datos sintéticos en memoria, sin base de datos, y verifica que ambos den
+    el mismo total con la tarifa vigente.
+    """
+    import numpy as np
+    from datetime import datetime, timezone
+    from database import calcular_multa, MULTA_POR_DIA
+    from reportes import calcular_reporte
+
+    ahora = datetime.utcnow()
+    rng = np.random.default_rng(42)
+    epoch_ahora = ahora.replace(tzinfo=timezone.utc).timestamp()
+    arreglos = {
+        "usuario_id": rng.integers(1, 50_000, filas),
+        "libro_id": rng.integers(1, 100_000, filas),
+        "vencimiento": epoch_ahora - rng.uniform(-30, 200, filas) * 86400,
+        "vencido": rng.random(filas) < 0.5,
+    }
+
+    inicio = time.perf_counter()
+    fechas = [datetime.utcfromtimestamp(v) for v in arreglos["vencimiento"]]
+    total_filas = sum(calcular_multa(f, ahora)[0] for f in fechas)
+    por_fila = time.perf_counter() - inicio
+
+    lista = [{"tarifa_dia": MULTA_POR_DIA, "dias_gracia": 0}] + [
+        {"tarifa_dia": MULTA_POR_DIA * (1 + i), "dias_gracia": i} for i in range(1, escenarios)
+    ]
+    inicio = time.perf_counter()
+    reporte = calcular_reporte(arreglos, lista, ahora)
+    vectorizado = time.perf_counter() - inicio
+
+    total_vectorizado = reporte[0]["multa_total"]
+    print(f"{'modo':<14}{'escenarios':>12}{'ms':>12}{'filas/s':>16}{'multa total':>18}")
+    print(f"{'por fila':<14}{1:>12}{por_fila * 1000:>12.1f}{filas / por_fila:>16.0f}{total_filas:>18.2f}")
+    print(f"{'vectorizado':<14}{escenarios:>12}{vectorizado * 1000:>12.1f}"
+          f"{filas * escenarios / vectorizado:>16.0f}{total_vectorizado:>18.2f}")
+    if abs(total_filas - total_vectorizado) > 0.01:
+        raise SystemExit("❌ El motor vectorizado no coincide con calcular_multa")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks del microservicio de préstamos")
+    parser.add_argument("--url", default=BASE_URL)
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("concurrencia", help="Escalamiento con peticiones concurrentes")
+    p.add_argument("--niveles", type=int, nargs="+", default=[1, 4, 16, 64])
+    p.add_argument("--peticiones", type=int, default=2000)
+
+    p = sub.add_parser("bulk", help="Préstamos/devoluciones individuales contra masivos")
+    p.add_argument("--items", type=int, default=50)
+    p.add_argument("--rondas", type=int, default=5)
+
+    p = sub.add_parser("planes", help="Verifica con EXPLAIN que las consultas calientes usan índices")
+    p.add_argument("--filas", type=int, default=1_000_000, help="Filas sintéticas temporales (0 = datos actuales)")
+
+    p = sub.add_parser("particiones", help="Consultas de activos con un historial creciente")
+    p.add_argument("--pasos", type=int, nargs="+", default=[0, 1_000_000, 5_000_000, 10_000_000])
+    p.add_argument("--repeticiones", type=int, default=50)
+
+    p = sub.add_parser("multas", help="calcular_multa por fila contra el reporte vectorizado")
+    p.add_argument("--filas", type=int, default=1_000_000)
+    p.add_argument("--escenarios", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.comando == "concurrencia":
+        asyncio.run(concurrencia(args.url, args.niveles, args.peticiones))
+    elif args.comando == "bulk":
+        asyncio.run(bulk(args.url, args.items, args.rondas))
+    elif args.comando == "planes":
+        asyncio.run(planes(args.filas))
+    elif args.comando == "particiones":
+        asyncio.run(particiones(args.pasos, args.repeticiones))
+    elif args.comando == "multas":
+        multas(args.filas, args.escenarios)
@@ -1,29 +1,74 @@
-from sqlalchemy.orm import Session
-from models import SessionLocal, Prestamo, Reserva, create_tables
-from datetime import datetime, timedelta
+from sqlalchemy import select, tuple_, func, cast, Integer
+from models import SessionLocal, Prestamo, create_tables
+from migraciones import aplicar_migraciones
+from datetime import datetime
+import base64
 
-def initialize_database():
+# Tamaño de página por defecto y máximo para los listados
+PAGINA_POR_DEFECTO = 50
+PAGINA_MAXIMA = 500
+# Máximo de préstamos o devoluciones por petición masiva
+MAX_ITEMS_BULK = 200
+
+async def initialize_database():
     """Inicializa la base de datos con tablas de préstamos y reservas"""
-    create_tables()
+    await create_tables()
+    await aplicar_migraciones()
     
-    db = SessionLocal()
-    try:
-        # Verificar si ya existen datos
-        if db.query(Prestamo).count() == 0:
-            print("✅ Tablas de préstamos y reservas creadas correctamente")
-        else:
-            print("✅ Base de datos de préstamos ya contiene datos")
-            
-    except Exception as e:
-        print(f"❌ Error inicializando base de datos de préstamos: {e}")
-        db.rollback()
-    finally:
-        db.close()
+    async with SessionLocal() as db:
+        try:
+            # Verificar si ya existen datos
+            existe = (await db.execute(select(Prestamo.id).limit(1))).first()
+            if existe is None:
+                print("✅ Tablas de préstamos y reservas creadas correctamente")
+            else:
+                print("✅ Base de datos de préstamos ya contiene datos")
+                
+        except Exception as e:
+            print(f"❌ Error inicializando base de datos de préstamos: {e}")
+            await db.rollback()
+
+# Multa por cada día de retraso
+MULTA_POR_DIA = 2.0
 
 def calcular_multa(fecha_devolucion_esperada, fecha_devolucion_real):
     """Calcula la multa por retraso en la devolución"""
     if fecha_devolucion_real > fecha_devolucion_esperada:
         dias_retraso = (fecha_devolucion_real - fecha_devolucion_esperada).days
-        multa = dias_retraso * 2.0  # $2 por día de retraso
+        multa = dias_retraso * MULTA_POR_DIA
         return multa, dias_retraso
-    return 0.0, 0
\ No newline at end of file
+    return 0.0, 0
+
+def expr_multa_y_dias(columna_esperada, fecha_devolucion):
+    """Versión SQL de calcular_multa para calcular multas de muchas filas en una sola sentencia"""
+    segundos = func.extract("epoch", fecha_devolucion - columna_esperada)
+    dias = func.greatest(func.floor(segundos / 86400), 0)
+    return dias * MULTA_POR_DIA, cast(dias, Integer)
+
+def codificar_cursor(fecha, id_):
+    """Cursor opaco con la clave (fecha, id) de la última fila de una página"""
+    return base64.urlsafe_b64encode(f"{fecha.isoformat()}|{id_}".encode()).decode()
+
+def decodificar_cursor(cursor):
+    """Devuelve (fecha, id) de un cursor; lanza ValueError si es inválido"""
+    fecha, id_ = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(fecha), int(id_)
+
+async def consultar_pagina(db, columnas, columna_fecha, columna_id, filtros, cursor, limite):
+    """
+    Página de filas ordenadas por (fecha, id) descendente usando paginación por clave.
+
+    Trae solo las columnas pedidas como tuplas (sin objetos ORM) y pide una fila
+    de más para saber si existe una página siguiente.
+    """
+    consulta = select(*columnas).where(*filtros)
+    if cursor:
+        consulta = consulta.where(tuple_(columna_fecha, columna_id) < tuple_(*decodificar_cursor(cursor)))
+    consulta = consulta.order_by(columna_fecha.desc(), columna_id.desc()).limit(limite + 1)
+
+    filas = (await db.execute(consulta)).mappings().all()
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(filas[-1][columna_fecha.key], filas[-1][columna_id.key])
+    return {"items": [dict(fila) for fila in filas], "siguiente_cursor": siguiente}
\ No newline at end of file
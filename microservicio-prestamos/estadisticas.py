@@ -0,0 +1,70 @@
+import asyncio
+import os
+from datetime import datetime
+
+from sqlalchemy import text
+from models import engine
+
+ESTADISTICAS_INTERVALO_SEGUNDOS = int(os.getenv("ESTADISTICAS_INTERVALO", "60"))
+# Por debajo de estas páginas un COUNT(*) exacto es más barato que fiarse de reltuples
+PAGINAS_CONTEO_EXACTO = 100
+
+TABLAS = {"total_prestamos": "prestamos", "total_reservas": "reservas"}
+
+# Tabla y particiones hoja; las vacías nunca analizadas no invalidan la estimación
+SQL_ESTIMACION = """
+    SELECT sum(greatest(c.reltuples, 0))::bigint AS filas, sum(c.relpages) AS relpages,
+           coalesce(min(c.reltuples) FILTER (WHERE c.relpages > 0), 0) AS minimo
+    FROM pg_class c
+    WHERE c.relkind = 'r'
+      AND (c.oid = to_regclass(:tabla)
+           OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:tabla)))
+"""
+
+# Última instantánea calculada en segundo plano
+instantanea = {}
+
+
+async def contar(exacto: bool = False):
+    """
+    Totales por tabla.
+
+    Por defecto usa la estimación de pg_class.reltuples, que no recorre la tabla;
+    en las tablas particionadas se suman las particiones. Las tablas con datos
+    nunca analizadas (reltuples = -1) o muy pequeñas se cuentan exacto.
+    """
+    resultado = {}
+    async with engine.connect() as conn:
+        for clave, tabla in TABLAS.items():
+            if not exacto:
+                fila = (await conn.execute(text(SQL_ESTIMACION), {"tabla": tabla})).first()
+                if fila.filas is not None and fila.minimo >= 0 and fila.relpages >= PAGINAS_CONTEO_EXACTO:
+                    resultado[clave] = fila.filas
+                    continue
+            resultado[clave] = (await conn.execute(text(f"SELECT count(*) FROM {tabla}"))).scalar()
+    return resultado
+
+
+async def refrescar_instantanea():
+    totales = await contar()
+    instantanea.clear()
+    instantanea.update({**totales, "fecha": datetime.utcnow(), "origen": "estimado"})
+    return instantanea
+
+
+async def tarea_estadisticas():
+    """Refresca la instantánea de estadísticas cada ESTADISTICAS_INTERVALO segundos"""
+    while True:
+        try:
+            await refrescar_instantanea()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error refrescando estadísticas: {e}")
+        await asyncio.sleep(ESTADISTICAS_INTERVALO_SEGUNDOS)
+
+
+async def verificar_conexion():
+    """Readiness: toma una conexión del pool y ejecuta SELECT 1"""
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
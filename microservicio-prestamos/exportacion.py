@@ -0,0 +1,57 @@
+import csv
+import io
+import json
+import os
+
+from sqlalchemy import select
+from models import engine
+
+# Filas que trae el cursor del servidor en cada viaje
+EXPORTACION_LOTE = int(os.getenv("EXPORTACION_LOTE", "1000"))
+EXPORTACION_LOTE_MAXIMO = 10_000
+
+TIPOS_CONTENIDO = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _valor(valor):
+    return valor.isoformat() if hasattr(valor, "isoformat") else valor
+
+
+def _csv(filas):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerows([[_valor(v) for v in fila] for fila in filas])
+    return buffer.getvalue()
+
+
+def _ndjson(nombres, filas):
+    return "".join(
+        json.dumps({nombre: _valor(v) for nombre, v in zip(nombres, fila)}, ensure_ascii=False) + "\n"
+        for fila in filas
+    )
+
+
+async def exportar_filas(columnas, columna_fecha, columna_id, filtros, formato="csv", lote=EXPORTACION_LOTE):
+    """
+    Genera el export en trozos de texto de `lote` filas.
+
+    Usa un cursor del lado del servidor (stream_results + yield_per) sobre su propia
+    conexión, así en memoria solo vive un lote a la vez sin importar cuántas filas
+    se exporten. El orden (fecha, id) ascendente aprovecha el índice de paginación.
+    """
+    nombres = [c.key for c in columnas]
+    consulta = (
+        select(*columnas).where(*filtros)
+        .order_by(columna_fecha, columna_id)
+        .execution_options(yield_per=lote)
+    )
+    if formato == "csv":
+        yield _csv([nombres])
+
+    async with engine.connect() as conn:
+        resultado = await conn.stream(consulta)
+        async for filas in resultado.partitions():
+            yield _csv(filas) if formato == "csv" else _ndjson(nombres, filas)
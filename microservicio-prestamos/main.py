@@ -1,14 +1,33 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timedelta
 from enum import Enum
-from sqlalchemy.orm import Session
+import asyncio
+from sqlalchemy import select, insert, update, literal, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Importar nuestros módulos
-from models import get_db, Prestamo, Reserva, create_tables
-from database import initialize_database, calcular_multa
+from models import get_db, Prestamo, Reserva, engine, pool_metrics
+from database import (
+    initialize_database, consultar_pagina, expr_multa_y_dias,
+    PAGINA_POR_DEFECTO, PAGINA_MAXIMA, MAX_ITEMS_BULK, MULTA_POR_DIA,
+)
+from vencimientos import barrer_vencidos, tarea_barrido_vencidos, historial_barridos
+from outbox import evento_prestamo, registrar_eventos, tarea_relay_outbox, estado_outbox
+from resumenes import (
+    obtener_resumen_usuario, obtener_resumen_libro, reconciliar_resumenes,
+    tarea_reconciliacion_resumenes, ultima_reconciliacion,
+)
+from estadisticas import contar, instantanea, tarea_estadisticas, verificar_conexion
+from exportacion import exportar_filas, EXPORTACION_LOTE, EXPORTACION_LOTE_MAXIMO, TIPOS_CONTENIDO
+from reportes import reporte_multas, MAX_ESCENARIOS
+from particiones import (
+    listar_particiones, asegurar_particiones, archivar_particiones_antiguas,
+    tarea_particiones, historial_archivo,
+)
 
 app = FastAPI(title="Microservicio de Préstamos")
 
@@ -45,11 +64,25 @@ class PrestamoResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class PaginaPrestamos(BaseModel):
+    items: List[PrestamoResponse]
+    siguiente_cursor: Optional[str] = None
+
+class FormatoExportacion(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
 class PrestamoCreate(BaseModel):
     usuario_id: int
     libro_id: int
     dias_prestamo: int = 15
 
+class PrestamoBulkCreate(BaseModel):
+    items: List[PrestamoCreate]
+
+class DevolucionBulk(BaseModel):
+    prestamo_ids: List[int]
+
 class ReservaResponse(BaseModel):
     id: int
     usuario_id: int
@@ -61,16 +94,48 @@ class ReservaResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class PaginaReservas(BaseModel):
+    items: List[ReservaResponse]
+    siguiente_cursor: Optional[str] = None
+
 class ReservaCreate(BaseModel):
     usuario_id: int
     libro_id: int
 
+class EscenarioMulta(BaseModel):
+    tarifa_dia: float = MULTA_POR_DIA
+    dias_gracia: int = 0
+
+class ReporteMultasRequest(BaseModel):
+    escenarios: List[EscenarioMulta] = [EscenarioMulta()]
+    fecha: Optional[datetime] = None
+
 # Inicializar base de datos al iniciar
 @app.on_event("startup")
 async def startup_event():
     print("🚀 Inicializando base de datos de préstamos...")
-    initialize_database()
+    await initialize_database()
     print("✅ Base de datos de préstamos lista")
+    
+    # Iniciar barrido periódico de préstamos vencidos
+    app.state.tarea_vencidos = asyncio.create_task(tarea_barrido_vencidos())
+    # Entregar eventos de préstamos a catálogo y reservas
+    app.state.tarea_outbox = asyncio.create_task(tarea_relay_outbox())
+    # Verificar periódicamente los resúmenes por usuario y por libro
+    app.state.tarea_resumenes = asyncio.create_task(tarea_reconciliacion_resumenes())
+    # Estadísticas en segundo plano para que /health no cuente filas
+    app.state.tarea_estadisticas = asyncio.create_task(tarea_estadisticas())
+    # Particiones mensuales futuras y archivo de las antiguas
+    app.state.tarea_particiones = asyncio.create_task(tarea_particiones())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.tarea_vencidos.cancel()
+    app.state.tarea_outbox.cancel()
+    app.state.tarea_resumenes.cancel()
+    app.state.tarea_estadisticas.cancel()
+    app.state.tarea_particiones.cancel()
+    await engine.dispose()
 
 @app.get("/")
 async def root():
@@ -78,7 +143,7 @@ async def root():
 
 # PRÉSTAMOS
 @app.post("/prestamos", response_model=PrestamoResponse)
-async def crear_prestamo(prestamo_data: PrestamoCreate, db: Session = Depends(get_db)):
+async def crear_prestamo(prestamo_data: PrestamoCreate, db: AsyncSession = Depends(get_db)):
     try:
         fecha_prestamo = datetime.utcnow()
         fecha_devolucion = fecha_prestamo + timedelta(days=prestamo_data.dias_prestamo)
@@ -92,59 +157,225 @@ async def crear_prestamo(prestamo_data: PrestamoCreate, db: Session = Depends(ge
         )
         
         db.add(prestamo)
-        db.commit()
-        db.refresh(prestamo)
+        await db.flush()
+        # El evento se confirma en la misma transacción que el préstamo
+        await registrar_eventos(db, [
+            evento_prestamo("prestamo_creado", prestamo.id, prestamo.usuario_id, prestamo.libro_id)
+        ])
+        await db.commit()
+        await db.refresh(prestamo)
         
         return prestamo
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error creando préstamo: {str(e)}")
 
-@app.get("/prestamos", response_model=List[PrestamoResponse])
-async def listar_prestamos(db: Session = Depends(get_db)):
-    return db.query(Prestamo).all()
+COLUMNAS_PRESTAMO = [
+    Prestamo.id, Prestamo.usuario_id, Prestamo.libro_id, Prestamo.fecha_prestamo,
+    Prestamo.fecha_devolucion_esperada, Prestamo.fecha_devolucion_real,
+    Prestamo.estado, Prestamo.multa, Prestamo.dias_retraso,
+]
+
+COLUMNAS_RESERVA = [
+    Reserva.id, Reserva.usuario_id, Reserva.libro_id,
+    Reserva.fecha_reserva, Reserva.fecha_vencimiento, Reserva.estado,
+]
+
+@app.get("/prestamos", response_model=PaginaPrestamos)
+async def listar_prestamos(
+    estado: Optional[EstadoPrestamo] = Query(None, description="Filtrar por estado"),
+    usuario_id: Optional[int] = Query(None, description="Filtrar por usuario"),
+    libro_id: Optional[int] = Query(None, description="Filtrar por libro"),
+    desde: Optional[datetime] = Query(None, description="Fecha de préstamo mínima"),
+    hasta: Optional[datetime] = Query(None, description="Fecha de préstamo máxima (exclusiva)"),
+    cursor: Optional[str] = Query(None, description="Cursor devuelto por la página anterior"),
+    limite: int = Query(PAGINA_POR_DEFECTO, ge=1, le=PAGINA_MAXIMA),
+    db: AsyncSession = Depends(get_db)
+):
+    filtros = []
+    if estado:
+        filtros.append(Prestamo.estado == estado.value)
+    if usuario_id is not None:
+        filtros.append(Prestamo.usuario_id == usuario_id)
+    if libro_id is not None:
+        filtros.append(Prestamo.libro_id == libro_id)
+    if desde:
+        filtros.append(Prestamo.fecha_prestamo >= desde)
+    if hasta:
+        filtros.append(Prestamo.fecha_prestamo < hasta)
+    
+    try:
+        return await consultar_pagina(
+            db, COLUMNAS_PRESTAMO, Prestamo.fecha_prestamo, Prestamo.id, filtros, cursor, limite
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+@app.get("/prestamos/export")
+async def exportar_prestamos(
+    formato: FormatoExportacion = Query(FormatoExportacion.CSV),
+    desde: Optional[datetime] = Query(None, description="Fecha de préstamo mínima"),
+    hasta: Optional[datetime] = Query(None, description="Fecha de préstamo máxima (exclusiva)"),
+    estado: Optional[EstadoPrestamo] = Query(None, description="Filtrar por estado"),
+    lote: int = Query(EXPORTACION_LOTE, ge=1, le=EXPORTACION_LOTE_MAXIMO, description="Filas por viaje al servidor"),
+):
+    """Historial completo de préstamos en streaming, con memoria constante"""
+    filtros = []
+    if desde:
+        filtros.append(Prestamo.fecha_prestamo >= desde)
+    if hasta:
+        filtros.append(Prestamo.fecha_prestamo < hasta)
+    if estado:
+        filtros.append(Prestamo.estado == estado.value)
+
+    return StreamingResponse(
+        exportar_filas(COLUMNAS_PRESTAMO, Prestamo.fecha_prestamo, Prestamo.id, filtros, formato.value, lote),
+        media_type=TIPOS_CONTENIDO[formato.value],
+        headers={"Content-Disposition": f'attachment; filename="prestamos.{formato.value}"'},
+    )
+
+@app.post("/prestamos/bulk", response_model=List[PrestamoResponse])
+async def crear_prestamos_bulk(datos: PrestamoBulkCreate, db: AsyncSession = Depends(get_db)):
+    """Crea varios préstamos en una transacción con un solo INSERT ... RETURNING"""
+    if not datos.items:
+        return []
+    if len(datos.items) > MAX_ITEMS_BULK:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_ITEMS_BULK} préstamos por petición")
+    
+    fecha_prestamo = datetime.utcnow()
+    filas = [
+        {
+            "usuario_id": item.usuario_id,
+            "libro_id": item.libro_id,
+            "fecha_prestamo": fecha_prestamo,
+            "fecha_devolucion_esperada": fecha_prestamo + timedelta(days=item.dias_prestamo),
+            "estado": "activo",
+            "multa": 0.0,
+            "dias_retraso": 0,
+            "created_at": fecha_prestamo,
+        }
+        for item in datos.items
+    ]
+    
+    try:
+        result = await db.execute(insert(Prestamo).values(filas).returning(*COLUMNAS_PRESTAMO))
+        creados = [dict(fila) for fila in result.mappings()]
+        await registrar_eventos(db, [
+            evento_prestamo("prestamo_creado", p["id"], p["usuario_id"], p["libro_id"]) for p in creados
+        ])
+        await db.commit()
+        return creados
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error creando préstamos: {str(e)}")
+
+@app.post("/prestamos/devolver/bulk")
+async def devolver_libros_bulk(datos: DevolucionBulk, db: AsyncSession = Depends(get_db)):
+    """Devuelve varios préstamos con un solo UPDATE ... RETURNING que calcula todas las multas"""
+    ids = list(dict.fromkeys(datos.prestamo_ids))
+    if len(ids) > MAX_ITEMS_BULK:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_ITEMS_BULK} devoluciones por petición")
+    if not ids:
+        return {"devueltos": 0, "multa_total": 0.0, "resultados": []}
+    
+    fecha_devolucion = literal(datetime.utcnow(), DateTime)
+    multa, dias_retraso = expr_multa_y_dias(Prestamo.fecha_devolucion_esperada, fecha_devolucion)
+    
+    try:
+        result = await db.execute(
+            update(Prestamo)
+            .where(Prestamo.id.in_(ids), Prestamo.estado != "devuelto")
+            .values(fecha_devolucion_real=fecha_devolucion, estado="devuelto",
+                    multa=multa, dias_retraso=dias_retraso)
+            .returning(Prestamo.id, Prestamo.usuario_id, Prestamo.libro_id, Prestamo.multa, Prestamo.dias_retraso)
+        )
+        devueltos = {fila.id: fila for fila in result}
+        await registrar_eventos(db, [
+            evento_prestamo("prestamo_devuelto", f.id, f.usuario_id, f.libro_id) for f in devueltos.values()
+        ])
+        
+        # Distinguir préstamos inexistentes de los que ya estaban devueltos
+        pendientes = [i for i in ids if i not in devueltos]
+        existentes = set()
+        if pendientes:
+            existentes = set((await db.execute(select(Prestamo.id).where(Prestamo.id.in_(pendientes)))).scalars())
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error devolviendo préstamos: {str(e)}")
+    
+    resultados = []
+    for prestamo_id in ids:
+        if prestamo_id in devueltos:
+            fila = devueltos[prestamo_id]
+            resultados.append({"prestamo_id": prestamo_id, "estado": "devuelto",
+                               "multa": fila.multa, "dias_retraso": fila.dias_retraso})
+        elif prestamo_id in existentes:
+            resultados.append({"prestamo_id": prestamo_id, "estado": "ya_devuelto"})
+        else:
+            resultados.append({"prestamo_id": prestamo_id, "estado": "no_encontrado"})
+    
+    return {
+        "devueltos": len(devueltos),
+        "multa_total": sum(fila.multa for fila in devueltos.values()),
+        "resultados": resultados
+    }
+
+@app.post("/prestamos/vencidos/barrer")
+async def ejecutar_barrido_vencidos():
+    return await barrer_vencidos()
+
+@app.get("/prestamos/vencidos/barridos")
+async def listar_barridos_vencidos():
+    return list(historial_barridos)
 
 @app.get("/prestamos/usuario/{usuario_id}", response_model=List[PrestamoResponse])
-async def obtener_prestamos_usuario(usuario_id: int, db: Session = Depends(get_db)):
-    return db.query(Prestamo).filter(Prestamo.usuario_id == usuario_id).all()
+async def obtener_prestamos_usuario(usuario_id: int, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(Prestamo).where(Prestamo.usuario_id == usuario_id))
+    return result.scalars().all()
 
 @app.get("/prestamos/{prestamo_id}", response_model=PrestamoResponse)
-async def obtener_prestamo(prestamo_id: int, db: Session = Depends(get_db)):
-    prestamo = db.query(Prestamo).filter(Prestamo.id == prestamo_id).first()
+async def obtener_prestamo(prestamo_id: int, db: AsyncSession = Depends(get_db)):
+    prestamo = await db.get(Prestamo, prestamo_id)
     if not prestamo:
         raise HTTPException(status_code=404, detail="Préstamo no encontrado")
     return prestamo
 
 @app.post("/prestamos/{prestamo_id}/devolver")
-async def devolver_libro(prestamo_id: int, db: Session = Depends(get_db)):
-    prestamo = db.query(Prestamo).filter(Prestamo.id == prestamo_id).first()
-    if not prestamo:
-        raise HTTPException(status_code=404, detail="Préstamo no encontrado")
+async def devolver_libro(prestamo_id: int, db: AsyncSession = Depends(get_db)):
+    # Comprobar y devolver en un solo UPDATE condicional: de dos devoluciones
+    # simultáneas solo una recibe la fila y registra el evento
+    fecha_devolucion = literal(datetime.utcnow(), DateTime)
+    multa, dias_retraso = expr_multa_y_dias(Prestamo.fecha_devolucion_esperada, fecha_devolucion)
+    devuelto = (await db.execute(
+        update(Prestamo)
+        .where(Prestamo.id == prestamo_id, Prestamo.estado != "devuelto")
+        .values(fecha_devolucion_real=fecha_devolucion, estado="devuelto",
+                multa=multa, dias_retraso=dias_retraso)
+        .returning(Prestamo.id, Prestamo.usuario_id, Prestamo.libro_id, Prestamo.multa, Prestamo.dias_retraso)
+    )).first()
     
-    if prestamo.estado == "devuelto":
+    if devuelto is None:
+        existe = (await db.execute(select(Prestamo.id).where(Prestamo.id == prestamo_id))).first()
+        if existe is None:
+            raise HTTPException(status_code=404, detail="Préstamo no encontrado")
         raise HTTPException(status_code=400, detail="El libro ya fue devuelto")
     
-    fecha_devolucion = datetime.utcnow()
-    prestamo.fecha_devolucion_real = fecha_devolucion
-    prestamo.estado = "devuelto"
-    
-    # Calcular multa si hay retraso
-    multa, dias_retraso = calcular_multa(prestamo.fecha_devolucion_esperada, fecha_devolucion)
-    prestamo.multa = multa
-    prestamo.dias_retraso = dias_retraso
-    
-    db.commit()
+    await registrar_eventos(db, [
+        evento_prestamo("prestamo_devuelto", devuelto.id, devuelto.usuario_id, devuelto.libro_id)
+    ])
+    await db.commit()
     
     return {
         "message": "Libro devuelto exitosamente", 
-        "multa": multa,
-        "dias_retraso": dias_retraso
+        "multa": devuelto.multa,
+        "dias_retraso": devuelto.dias_retraso
     }
 
 # RESERVAS
 @app.post("/reservas", response_model=ReservaResponse)
-async def crear_reserva(reserva_data: ReservaCreate, db: Session = Depends(get_db)):
+async def crear_reserva(reserva_data: ReservaCreate, db: AsyncSession = Depends(get_db)):
     try:
         fecha_reserva = datetime.utcnow()
         fecha_vencimiento = fecha_reserva + timedelta(days=7)  # 7 días para reserva
@@ -158,26 +389,53 @@ async def crear_reserva(reserva_data: ReservaCreate, db: Session = Depends(get_d
         )
         
         db.add(reserva)
-        db.commit()
-        db.refresh(reserva)
+        await db.commit()
+        await db.refresh(reserva)
         
         return reserva
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error creando reserva: {str(e)}")
 
-@app.get("/reservas", response_model=List[ReservaResponse])
-async def listar_reservas(db: Session = Depends(get_db)):
-    return db.query(Reserva).all()
+@app.get("/reservas", response_model=PaginaReservas)
+async def listar_reservas(
+    estado: Optional[EstadoReserva] = Query(None, description="Filtrar por estado"),
+    usuario_id: Optional[int] = Query(None, description="Filtrar por usuario"),
+    libro_id: Optional[int] = Query(None, description="Filtrar por libro"),
+    desde: Optional[datetime] = Query(None, description="Fecha de reserva mínima"),
+    hasta: Optional[datetime] = Query(None, description="Fecha de reserva máxima (exclusiva)"),
+    cursor: Optional[str] = Query(None, description="Cursor devuelto por la página anterior"),
+    limite: int = Query(PAGINA_POR_DEFECTO, ge=1, le=PAGINA_MAXIMA),
+    db: AsyncSession = Depends(get_db)
+):
+    filtros = []
+    if estado:
+        filtros.append(Reserva.estado == estado.value)
+    if usuario_id is not None:
+        filtros.append(Reserva.usuario_id == usuario_id)
+    if libro_id is not None:
+        filtros.append(Reserva.libro_id == libro_id)
+    if desde:
+        filtros.append(Reserva.fecha_reserva >= desde)
+    if hasta:
+        filtros.append(Reserva.fecha_reserva < hasta)
+    
+    try:
+        return await consultar_pagina(
+            db, COLUMNAS_RESERVA, Reserva.fecha_reserva, Reserva.id, filtros, cursor, limite
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
 
 @app.get("/reservas/usuario/{usuario_id}", response_model=List[ReservaResponse])
-async def obtener_reservas_usuario(usuario_id: int, db: Session = Depends(get_db)):
-    return db.query(Reserva).filter(Reserva.usuario_id == usuario_id).all()
+async def obtener_reservas_usuario(usuario_id: int, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(Reserva).where(Reserva.usuario_id == usuario_id))
+    return result.scalars().all()
 
 @app.post("/reservas/{reserva_id}/cancelar")
-async def cancelar_reserva(reserva_id: int, db: Session = Depends(get_db)):
-    reserva = db.query(Reserva).filter(Reserva.id == reserva_id).first()
+async def cancelar_reserva(reserva_id: int, db: AsyncSession = Depends(get_db)):
+    reserva = await db.get(Reserva, reserva_id)
     if not reserva:
         raise HTTPException(status_code=404, detail="Reserva no encontrada")
     
@@ -185,19 +443,84 @@ async def cancelar_reserva(reserva_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Solo se pueden cancelar reservas activas")
     
     reserva.estado = "cancelada"
-    db.commit()
+    await db.commit()
     
     return {"message": "Reserva cancelada exitosamente"}
 
+# RESÚMENES
+@app.get("/resumen/usuarios/{usuario_id}")
+async def resumen_usuario(usuario_id: int, db: AsyncSession = Depends(get_db)):
+    return await obtener_resumen_usuario(db, usuario_id)
+
+@app.get("/resumen/libros/{libro_id}")
+async def resumen_libro(libro_id: int, db: AsyncSession = Depends(get_db)):
+    return await obtener_resumen_libro(db, libro_id)
+
+@app.post("/resumen/reconciliar")
+async def ejecutar_reconciliacion(corregir: bool = False):
+    return await reconciliar_resumenes(corregir)
+
+@app.get("/resumen/reconciliacion")
+async def obtener_ultima_reconciliacion():
+    return ultima_reconciliacion
+
+# REPORTES
+@app.post("/reportes/multas")
+async def obtener_reporte_multas(datos: ReporteMultasRequest):
+    """Multas proyectadas de los préstamos abiertos bajo distintas tarifas y días de gracia"""
+    if not datos.escenarios or len(datos.escenarios) > MAX_ESCENARIOS:
+        raise HTTPException(status_code=400, detail=f"Se permiten entre 1 y {MAX_ESCENARIOS} escenarios")
+    if any(e.tarifa_dia < 0 or e.dias_gracia < 0 for e in datos.escenarios):
+        raise HTTPException(status_code=400, detail="Tarifa y días de gracia no pueden ser negativos")
+    return await reporte_multas([e.dict() for e in datos.escenarios], datos.fecha)
+
+# PARTICIONES DEL HISTORIAL
+@app.get("/particiones")
+async def obtener_particiones():
+    async with engine.connect() as conn:
+        particiones = await listar_particiones(conn)
+    return {"particiones": particiones, "archivadas": historial_archivo}
+
+@app.post("/particiones/archivar")
+async def ejecutar_archivo_particiones(meses_retencion: Optional[int] = None):
+    await asegurar_particiones()
+    if meses_retencion is None:
+        return await archivar_particiones_antiguas()
+    return await archivar_particiones_antiguas(meses_retencion)
+
+@app.get("/outbox/estado")
+async def obtener_estado_outbox():
+    return await estado_outbox()
+
+@app.get("/health/live")
+async def liveness():
+    return {"status": "alive", "service": "prestamos"}
+
+@app.get("/health/ready")
+async def readiness():
+    try:
+        await verificar_conexion()
+        return {"status": "ready", "service": "prestamos"}
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "not_ready", "service": "prestamos", "error": str(e)})
+
+@app.get("/estadisticas")
+async def obtener_estadisticas(exacto: bool = False):
+    """Totales de la instantánea en segundo plano, o un conteo exacto si se pide"""
+    if exacto:
+        return {**await contar(exacto=True), "fecha": datetime.utcnow(), "origen": "exacto"}
+    return instantanea
+
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
-    total_prestamos = db.query(Prestamo).count()
-    total_reservas = db.query(Reserva).count()
+async def health_check():
+    # No consulta la base: los totales salen de la última instantánea
     return {
         "status": "healthy", 
         "service": "prestamos", 
-        "total_prestamos": total_prestamos,
-        "total_reservas": total_reservas
+        "total_prestamos": instantanea.get("total_prestamos"),
+        "total_reservas": instantanea.get("total_reservas"),
+        "estadisticas_fecha": instantanea.get("fecha"),
+        "pool": pool_metrics()
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+from sqlalchemy import text
+from models import engine, SIN_LIMITE_SENTENCIAS
+
+# Clave del advisory lock que serializa las migraciones entre réplicas
+MIGRACIONES_LOCK_ID = 480_029
+
+# Migraciones en orden: (versión, nombre, sentencias). Nunca editar una ya publicada,
+# agregar una nueva versión al final.
+MIGRACIONES = [
+    (1, "indices_acceso_prestamos_reservas", [
+        # Préstamos de un usuario, filtrados o no por estado
+        "CREATE INDEX IF NOT EXISTS ix_prestamos_usuario_estado ON prestamos (usuario_id, estado)",
+        # Disponibilidad por libro: solo interesan los préstamos activos
+        "CREATE INDEX IF NOT EXISTS ix_prestamos_libro_activo ON prestamos (libro_id) WHERE estado = 'activo'",
+        # Detección de vencidos
+        "CREATE INDEX IF NOT EXISTS ix_prestamos_vencimiento_activo "
+        "ON prestamos (fecha_devolucion_esperada) WHERE estado = 'activo'",
+        "CREATE INDEX IF NOT EXISTS ix_reservas_usuario_estado ON reservas (usuario_id, estado)",
+        "CREATE INDEX IF NOT EXISTS ix_reservas_libro_activa ON reservas (libro_id) WHERE estado = 'activa'",
+        "CREATE INDEX IF NOT EXISTS ix_reservas_vencimiento_activa "
+        "ON reservas (fecha_vencimiento) WHERE estado = 'activa'",
+    ]),
+    (2, "indice_prestamos_vencidos", [
+        # Acumulación diaria de multas sobre préstamos ya vencidos
+        "CREATE INDEX IF NOT EXISTS ix_prestamos_vencidos ON prestamos (id) WHERE estado = 'vencido'",
+    ]),
+    (3, "indices_paginacion_por_clave", [
+        # Orden (fecha, id) de los listados paginados
+        "CREATE INDEX IF NOT EXISTS ix_prestamos_fecha_id ON prestamos (fecha_prestamo, id)",
+        "CREATE INDEX IF NOT EXISTS ix_reservas_fecha_id ON reservas (fecha_reserva, id)",
+    ]),
+    (4, "indice_outbox_pendientes", [
+        # El relay solo recorre los eventos aún no entregados
+        "CREATE INDEX IF NOT EXISTS ix_outbox_pendientes ON outbox_eventos (id) WHERE enviado_en IS NULL",
+    ]),
+    (5, "resumenes_usuario_libro", [
+        """
+        CREATE OR REPLACE FUNCTION aplicar_delta_resumen(
+            p_usuario INTEGER, p_libro INTEGER, d_activos INTEGER, d_totales INTEGER, d_multa FLOAT8
+        ) RETURNS void AS $$
+        BEGIN
+            INSERT INTO usuario_resumen AS r (usuario_id, prestamos_activos, prestamos_totales, multa_total, actualizado_en)
+            VALUES (p_usuario, d_activos, d_totales, d_multa, now())
+            ON CONFLICT (usuario_id) DO UPDATE SET
+                prestamos_activos = r.prestamos_activos + EXCLUDED.prestamos_activos,
+                prestamos_totales = r.prestamos_totales + EXCLUDED.prestamos_totales,
+                multa_total = r.multa_total + EXCLUDED.multa_total,
+                actualizado_en = now();
+
+            IF d_activos <> 0 OR d_totales <> 0 THEN
+                INSERT INTO libro_resumen AS r (libro_id, prestamos_activos, prestamos_totales, actualizado_en)
+                VALUES (p_libro, d_activos, d_totales, now())
+                ON CONFLICT (libro_id) DO UPDATE SET
+                    prestamos_activos = r.prestamos_activos + EXCLUDED.prestamos_activos,
+                    prestamos_totales = r.prestamos_totales + EXCLUDED.prestamos_totales,
+                    actualizado_en = now();
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION actualizar_resumenes_prestamo() RETURNS trigger AS $$
+        DECLARE
+            activo_old INTEGER := 0;
+            activo_new INTEGER := 0;
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                activo_old := (OLD.estado IN ('activo', 'vencido'))::int;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                activo_new := (NEW.estado IN ('activo', 'vencido'))::int;
+            END IF;
+
+            IF TG_OP = 'UPDATE' AND OLD.usuario_id = NEW.usuario_id AND OLD.libro_id = NEW.libro_id THEN
+                -- Caso habitual: cambia el estado o la multa de un préstamo existente
+                IF activo_new <> activo_old OR coalesce(NEW.multa, 0) <> coalesce(OLD.multa, 0) THEN
+                    PERFORM aplicar_delta_resumen(NEW.usuario_id, NEW.libro_id, activo_new - activo_old, 0,
+                                                  coalesce(NEW.multa, 0) - coalesce(OLD.multa, 0));
+                END IF;
+                RETURN NULL;
+            END IF;
+
+            IF TG_OP <> 'INSERT' THEN
+                PERFORM aplicar_delta_resumen(OLD.usuario_id, OLD.libro_id, -activo_old, -1, -coalesce(OLD.multa, 0));
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                PERFORM aplicar_delta_resumen(NEW.usuario_id, NEW.libro_id, activo_new, 1, coalesce(NEW.multa, 0));
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        # Bloquear escrituras mientras se crea el trigger y se cargan los resúmenes iniciales
+        "LOCK TABLE prestamos IN SHARE ROW EXCLUSIVE MODE",
+        "DROP TRIGGER IF EXISTS trg_resumenes_prestamo ON prestamos",
+        "CREATE TRIGGER trg_resumenes_prestamo AFTER INSERT OR UPDATE OR DELETE ON prestamos "
+        "FOR EACH ROW EXECUTE FUNCTION actualizar_resumenes_prestamo()",
+        "DELETE FROM usuario_resumen",
+        "DELETE FROM libro_resumen",
+        """
+        INSERT INTO usuario_resumen (usuario_id, prestamos_activos, prestamos_totales, multa_total, actualizado_en)
+        SELECT usuario_id, count(*) FILTER (WHERE estado IN ('activo', 'vencido')), count(*),
+               coalesce(sum(multa), 0), now()
+        FROM prestamos GROUP BY usuario_id
+        """,
+        """
+        INSERT INTO libro_resumen (libro_id, prestamos_activos, prestamos_totales, actualizado_en)
+        SELECT libro_id, count(*) FILTER (WHERE estado IN ('activo', 'vencido')), count(*), now()
+        FROM prestamos GROUP BY libro_id
+        """,
+    ]),
+    (6, "particionar_prestamos_por_mes", [
+        "LOCK TABLE prestamos IN ACCESS EXCLUSIVE MODE",
+        "ALTER TABLE prestamos RENAME TO prestamos_sin_particion",
+        # La secuencia de ids pasa a la tabla nueva para no reiniciar la numeración
+        "ALTER SEQUENCE prestamos_id_seq OWNED BY NONE",
+        """
+        CREATE TABLE prestamos (
+            id INTEGER NOT NULL DEFAULT nextval('prestamos_id_seq'),
+            usuario_id INTEGER NOT NULL,
+            libro_id INTEGER NOT NULL,
+            fecha_prestamo TIMESTAMP NOT NULL,
+            fecha_devolucion_esperada TIMESTAMP NOT NULL,
+            fecha_devolucion_real TIMESTAMP,
+            estado VARCHAR(20),
+            multa FLOAT,
+            dias_retraso INTEGER,
+            created_at TIMESTAMP,
+            PRIMARY KEY (id, fecha_prestamo)
+        ) PARTITION BY RANGE (fecha_prestamo)
+        """,
+        "ALTER SEQUENCE prestamos_id_seq OWNED BY prestamos.id",
+        "CREATE TABLE prestamos_default PARTITION OF prestamos DEFAULT",
+        # Una partición por mes desde el préstamo más antiguo hasta tres meses adelante
+        """
+        DO $$
+        DECLARE
+            mes DATE;
+        BEGIN
+            FOR mes IN
+                SELECT generate_series(
+                    date_trunc('month', coalesce((SELECT min(fecha_prestamo) FROM prestamos_sin_particion), now())),
+                    date_trunc('month', now()) + interval '3 months',
+                    interval '1 month'
+                )::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF prestamos FOR VALUES FROM (%L) TO (%L)',
+                    'prestamos_' || to_char(mes, 'YYYY_MM'), mes, (mes + interval '1 month')::date
+                );
+            END LOOP;
+        END
+        $$
+        """,
+        """
+        INSERT INTO prestamos (id, usuario_id, libro_id, fecha_prestamo, fecha_devolucion_esperada,
+                               fecha_devolucion_real, estado, multa, dias_retraso, created_at)
+        SELECT id, usuario_id, libro_id, coalesce(fecha_prestamo, created_at, now()), fecha_devolucion_esperada,
+               fecha_devolucion_real, estado, multa, dias_retraso, created_at
+        FROM prestamos_sin_particion
+        """,
+        # Se lleva consigo sus índices y el trigger de resúmenes
+        "DROP TABLE prestamos_sin_particion",
+        # Índices de las migraciones 1-3, ahora particionados
+        "CREATE INDEX ix_prestamos_usuario_estado ON prestamos (usuario_id, estado)",
+        "CREATE INDEX ix_prestamos_libro_activo ON prestamos (libro_id) WHERE estado = 'activo'",
+        "CREATE INDEX ix_prestamos_vencimiento_activo ON prestamos (fecha_devolucion_esperada) WHERE estado = 'activo'",
+        "CREATE INDEX ix_prestamos_vencidos ON prestamos (id) WHERE estado = 'vencido'",
+        "CREATE INDEX ix_prestamos_fecha_id ON prestamos (fecha_prestamo, id)",
+        "CREATE TRIGGER trg_resumenes_prestamo AFTER INSERT OR UPDATE OR DELETE ON prestamos "
+        "FOR EACH ROW EXECUTE FUNCTION actualizar_resumenes_prestamo()",
+    ]),
+    (7, "indice_prestamos_libro_paginacion", [
+        # Listado de un libro en cualquier estado, en el mismo orden (fecha, id) del cursor
+        "CREATE INDEX IF NOT EXISTS ix_prestamos_libro_fecha_id ON prestamos (libro_id, fecha_prestamo, id)",
+    ]),
+    (8, "outbox_reclamos_y_retencion", [
+        # El relay reclama lotes con un plazo en lugar de bloquearlos durante el envío
+        "ALTER TABLE outbox_eventos ADD COLUMN IF NOT EXISTS reclamado_hasta TIMESTAMP",
+        # Purga de los eventos ya entregados
+        "CREATE INDEX IF NOT EXISTS ix_outbox_enviados ON outbox_eventos (enviado_en) WHERE enviado_en IS NOT NULL",
+    ]),
+]
+
+
+async def aplicar_migraciones():
+    """Aplica en una transacción las migraciones pendientes y devuelve las versiones aplicadas"""
+    aplicadas = []
+    async with engine.begin() as conn:
+        # Esperar el lock de otra réplica o copiar toda la tabla tarda más que una petición
+        await conn.execute(SIN_LIMITE_SENTENCIAS)
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRACIONES_LOCK_ID})
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migraciones ("
+            "version INTEGER PRIMARY KEY, nombre VARCHAR(100) NOT NULL, "
+            "aplicada_en TIMESTAMP NOT NULL DEFAULT now())"
+        ))
+        existentes = set((await conn.execute(text("SELECT version FROM schema_migraciones"))).scalars())
+
+        for version, nombre, sentencias in MIGRACIONES:
+            if version in existentes:
+                continue
+            for sentencia in sentencias:
+                await conn.execute(text(sentencia))
+            await conn.execute(
+                text("INSERT INTO schema_migraciones (version, nombre) VALUES (:version, :nombre)"),
+                {"version": version, "nombre": nombre},
+            )
+            aplicadas.append(version)
+            print(f"✅ Migración {version} aplicada: {nombre}")
+    return aplicadas
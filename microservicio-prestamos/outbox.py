@@ -0,0 +1,174 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import select, update, delete, func, insert, or_
+
+from models import engine, OutboxEvento
+
+# Servicios que consumen los eventos de préstamos
+CONSUMIDORES = {
+    "catalogo": os.getenv("CATALOGO_URL", "http://microservicio-catalogo:8001") + "/eventos/prestamos",
+    "reservas": os.getenv("RESERVAS_URL", "http://microservicio-reservas:8004") + "/eventos/prestamos",
+}
+
+OUTBOX_LOTE = int(os.getenv("OUTBOX_LOTE", "200"))
+OUTBOX_INTERVALO_SEGUNDOS = float(os.getenv("OUTBOX_INTERVALO", "1"))
+OUTBOX_TIMEOUT_SEGUNDOS = float(os.getenv("OUTBOX_TIMEOUT", "5"))
+# Un lote reclamado queda reservado para su réplica este tiempo; si se cae, otra lo retoma
+OUTBOX_RECLAMO_SEGUNDOS = float(os.getenv("OUTBOX_RECLAMO", str(OUTBOX_TIMEOUT_SEGUNDOS * len(CONSUMIDORES) + 10)))
+# Los eventos ya entregados se borran pasadas estas horas
+OUTBOX_RETENCION_HORAS = int(os.getenv("OUTBOX_RETENCION_HORAS", "24"))
+OUTBOX_PURGA_INTERVALO_SEGUNDOS = int(os.getenv("OUTBOX_PURGA_INTERVALO", "3600"))
+
+# Métricas del relay
+metricas_outbox = {
+    "eventos_enviados": 0,
+    "lotes_enviados": 0,
+    "errores": 0,
+    "eventos_purgados": 0,
+    "ultimo_error": None,
+    "ultimo_lag_ms": None,
+    "max_lag_ms": 0.0,
+}
+
+
+def evento_prestamo(tipo, prestamo_id, usuario_id, libro_id):
+    """Fila de outbox para un cambio de estado de un préstamo"""
+    return {
+        "tipo": tipo,
+        "payload": {"prestamo_id": prestamo_id, "usuario_id": usuario_id, "libro_id": libro_id},
+        "creado_en": datetime.utcnow(),
+    }
+
+
+async def registrar_eventos(db, eventos):
+    """Agrega eventos a la outbox dentro de la transacción de la sesión, sin confirmarla"""
+    if eventos:
+        await db.execute(insert(OutboxEvento).values(eventos))
+
+
+async def _reclamar_lote():
+    """Marca como reclamado un lote de pendientes libres y lo devuelve en orden de id"""
+    ahora = datetime.utcnow()
+    libres = (
+        select(OutboxEvento.id)
+        .where(
+            OutboxEvento.enviado_en.is_(None),
+            or_(OutboxEvento.reclamado_hasta.is_(None), OutboxEvento.reclamado_hasta < ahora),
+        )
+        .order_by(OutboxEvento.id)
+        .limit(OUTBOX_LOTE)
+        .with_for_update(skip_locked=True)
+    )
+    async with engine.begin() as conn:
+        filas = (await conn.execute(
+            update(OutboxEvento)
+            .where(OutboxEvento.id.in_(libres))
+            .values(reclamado_hasta=ahora + timedelta(seconds=OUTBOX_RECLAMO_SEGUNDOS))
+            .returning(OutboxEvento.id, OutboxEvento.tipo, OutboxEvento.payload, OutboxEvento.creado_en)
+        )).all()
+    return sorted(filas, key=lambda f: f.id)
+
+
+async def enviar_lote(client):
+    """
+    Entrega un lote de eventos pendientes a todos los consumidores.
+
+    Primero reclama el lote en una transacción corta (SKIP LOCKED y un plazo en
+    reclamado_hasta), así dos réplicas no entregan el mismo lote a la vez y
+    ninguna conexión ni bloqueo queda abierto durante las llamadas HTTP. Después
+    envía y marca los eventos como enviados en otra transacción corta. Si algún
+    consumidor falla, el reclamo se libera y el lote se reintenta completo: la
+    entrega es al menos una vez y los consumidores descartan los eventos
+    repetidos por su id.
+    """
+    filas = await _reclamar_lote()
+    if not filas:
+        return 0
+    ids = [f.id for f in filas]
+
+    eventos = [
+        {"id": f.id, "tipo": f.tipo, "fecha": f.creado_en.isoformat(), **f.payload}
+        for f in filas
+    ]
+    try:
+        for url in CONSUMIDORES.values():
+            response = await client.post(url, json={"eventos": eventos}, timeout=OUTBOX_TIMEOUT_SEGUNDOS)
+            response.raise_for_status()
+    except Exception:
+        async with engine.begin() as conn:
+            await conn.execute(
+                update(OutboxEvento).where(OutboxEvento.id.in_(ids)).values(reclamado_hasta=None)
+            )
+        raise
+
+    ahora = datetime.utcnow()
+    async with engine.begin() as conn:
+        await conn.execute(
+            update(OutboxEvento).where(OutboxEvento.id.in_(ids)).values(enviado_en=ahora, reclamado_hasta=None)
+        )
+
+    lag_ms = (ahora - min(f.creado_en for f in filas)).total_seconds() * 1000
+    metricas_outbox["eventos_enviados"] += len(filas)
+    metricas_outbox["lotes_enviados"] += 1
+    metricas_outbox["ultimo_lag_ms"] = round(lag_ms, 2)
+    metricas_outbox["max_lag_ms"] = round(max(metricas_outbox["max_lag_ms"], lag_ms), 2)
+    return len(filas)
+
+
+async def purgar_enviados(retencion_horas: int = OUTBOX_RETENCION_HORAS):
+    """Borra por lotes los eventos entregados hace más de la retención"""
+    corte = datetime.utcnow() - timedelta(hours=retencion_horas)
+    purgados = 0
+    while True:
+        viejos = (
+            select(OutboxEvento.id)
+            .where(OutboxEvento.enviado_en < corte)
+            .limit(OUTBOX_LOTE * 10)
+        )
+        async with engine.begin() as conn:
+            borrados = (await conn.execute(delete(OutboxEvento).where(OutboxEvento.id.in_(viejos)))).rowcount
+        purgados += borrados
+        if borrados < OUTBOX_LOTE * 10:
+            break
+    metricas_outbox["eventos_purgados"] += purgados
+    return purgados
+
+
+async def tarea_relay_outbox():
+    """Tarea en segundo plano que vacía la outbox hacia los consumidores y purga lo entregado"""
+    proxima_purga = 0.0
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if time.monotonic() >= proxima_purga:
+                    proxima_purga = time.monotonic() + OUTBOX_PURGA_INTERVALO_SEGUNDOS
+                    await purgar_enviados()
+                enviados = await enviar_lote(client)
+                # Con un lote lleno probablemente quedan más pendientes: seguir sin esperar
+                if enviados < OUTBOX_LOTE:
+                    await asyncio.sleep(OUTBOX_INTERVALO_SEGUNDOS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metricas_outbox["errores"] += 1
+                metricas_outbox["ultimo_error"] = str(e)
+                print(f"Error entregando eventos de la outbox: {e}")
+                await asyncio.sleep(OUTBOX_INTERVALO_SEGUNDOS * 5)
+
+
+async def estado_outbox():
+    """Pendientes, antigüedad del evento más viejo sin entregar y métricas del relay"""
+    async with engine.connect() as conn:
+        pendientes, mas_antiguo = (await conn.execute(
+            select(func.count(), func.min(OutboxEvento.creado_en)).where(OutboxEvento.enviado_en.is_(None))
+        )).one()
+    lag_actual = (datetime.utcnow() - mas_antiguo).total_seconds() * 1000 if mas_antiguo else 0.0
+    return {
+        "pendientes": pendientes,
+        "lag_actual_ms": round(lag_actual, 2),
+        **metricas_outbox,
+    }
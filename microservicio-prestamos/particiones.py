@@ -0,0 +1,197 @@
+import asyncio
+import gzip
+import os
+import re
+import shutil
+import time
+from datetime import date, datetime
+
+from sqlalchemy import text
+from models import engine, SIN_LIMITE_SENTENCIAS
+
+# Meses de particiones creadas por adelantado
+PARTICIONES_MESES_ADELANTE = int(os.getenv("PARTICIONES_MESES_ADELANTE", "3"))
+# Las particiones con más de estos meses y sin préstamos abiertos se archivan
+ARCHIVO_MESES_RETENCION = int(os.getenv("ARCHIVO_MESES_RETENCION", "24"))
+ARCHIVO_DIR = os.getenv("ARCHIVO_DIR", "/app/archivo")
+PARTICIONES_INTERVALO_SEGUNDOS = int(os.getenv("PARTICIONES_INTERVALO", "86400"))
+
+PATRON_PARTICION = re.compile(r"^prestamos_(\d{4})_(\d{2})$")
+
+# Historial de particiones archivadas por este proceso
+historial_archivo = []
+
+
+def _sumar_meses(mes: date, n: int) -> date:
+    total = mes.year * 12 + mes.month - 1 + n
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _nombre_particion(mes: date) -> str:
+    return f"prestamos_{mes.year:04d}_{mes.month:02d}"
+
+
+async def listar_particiones(conn):
+    """Particiones mensuales de prestamos con su mes y filas estimadas"""
+    filas = (await conn.execute(text("""
+        SELECT c.relname AS nombre, c.reltuples::bigint AS filas_estimadas
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'prestamos'::regclass
+        ORDER BY c.relname
+    """))).mappings().all()
+
+    particiones = []
+    for fila in filas:
+        coincidencia = PATRON_PARTICION.match(fila["nombre"])
+        mes = date(int(coincidencia.group(1)), int(coincidencia.group(2)), 1) if coincidencia else None
+        particiones.append({**fila, "mes": mes})
+    return particiones
+
+
+async def asegurar_particiones(meses_adelante: int = PARTICIONES_MESES_ADELANTE):
+    """Crea las particiones del mes actual y de los próximos meses si faltan"""
+    mes_actual = date.today().replace(day=1)
+    creadas = []
+    async with engine.begin() as conn:
+        for n in range(meses_adelante + 1):
+            desde = _sumar_meses(mes_actual, n)
+            nombre = _nombre_particion(desde)
+            existe = (await conn.execute(text("SELECT to_regclass(:nombre)"), {"nombre": nombre})).scalar()
+            if existe:
+                continue
+            await conn.execute(text(
+                f"CREATE TABLE {nombre} PARTITION OF prestamos "
+                f"FOR VALUES FROM ('{desde.isoformat()}') TO ('{_sumar_meses(desde, 1).isoformat()}')"
+            ))
+            creadas.append(nombre)
+    if creadas:
+        print(f"✅ Particiones creadas: {', '.join(creadas)}")
+    return creadas
+
+
+def _comprimir(origen: str, destino: str):
+    """Comprime el CSV volcado y borra el original; corre en un hilo aparte"""
+    with open(origen, "rb") as entrada, gzip.open(destino, "wb") as salida:
+        shutil.copyfileobj(entrada, salida, 1024 * 1024)
+    os.remove(origen)
+
+
+async def archivar_particion(nombre: str):
+    """
+    Vuelca una partición cerrada a CSV comprimido y luego la separa y elimina.
+
+    El volcado y los totales se sacan de una instantánea (REPEATABLE READ) sin
+    bloquear `prestamos`, y la compresión corre en un hilo. Solo DETACH, la
+    suma de esos totales a los resúmenes archivados y DROP van en una
+    transacción corta con ACCESS EXCLUSIVE sobre `prestamos`; si la partición
+    cambió desde la instantánea esa transacción se deshace y queda adjunta.
+    """
+    if not PATRON_PARTICION.match(nombre):
+        raise ValueError(f"Nombre de partición inválido: {nombre}")
+    inicio = time.perf_counter()
+    os.makedirs(ARCHIVO_DIR, exist_ok=True)
+    volcado = os.path.join(ARCHIVO_DIR, f"{nombre}.csv")
+    archivo = f"{volcado}.gz"
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="REPEATABLE READ")
+        async with conn.begin():
+            # Solo lectura sobre una partición entera: sin límite de tiempo
+            await conn.execute(SIN_LIMITE_SENTENCIAS)
+            abierto = (await conn.execute(
+                text(f"SELECT 1 FROM {nombre} WHERE estado IS DISTINCT FROM 'devuelto' LIMIT 1")
+            )).first()
+            if abierto:
+                return None
+            filas = (await conn.execute(text(f"SELECT count(*) FROM {nombre}"))).scalar()
+
+            # asyncpg escribe el archivo desde su executor, no en el event loop
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_from_table(nombre, output=volcado, format="csv", header=True)
+
+            # Totales de la misma instantánea, guardados en tablas temporales de esta conexión
+            await conn.execute(text(f"""
+                CREATE TEMP TABLE archivo_usuarios AS
+                SELECT usuario_id, count(*) AS prestamos_totales, coalesce(sum(multa), 0) AS multa_total
+                FROM {nombre} GROUP BY usuario_id
+            """))
+            await conn.execute(text(f"""
+                CREATE TEMP TABLE archivo_libros AS
+                SELECT libro_id, count(*) AS prestamos_totales FROM {nombre} GROUP BY libro_id
+            """))
+
+        try:
+            await asyncio.to_thread(_comprimir, volcado, archivo)
+
+            conn = await conn.execution_options(isolation_level="READ COMMITTED")
+            async with conn.begin():
+                await conn.execute(text(f"ALTER TABLE prestamos DETACH PARTITION {nombre}"))
+                actuales = (await conn.execute(text(f"SELECT count(*) FROM {nombre}"))).scalar()
+                if actuales != filas:
+                    raise RuntimeError(
+                        f"La partición {nombre} cambió durante el volcado ({filas} -> {actuales} filas)"
+                    )
+                await conn.execute(text("""
+                    INSERT INTO usuario_resumen_archivado AS r (usuario_id, prestamos_totales, multa_total)
+                    SELECT usuario_id, prestamos_totales, multa_total FROM archivo_usuarios
+                    ON CONFLICT (usuario_id) DO UPDATE SET
+                        prestamos_totales = r.prestamos_totales + EXCLUDED.prestamos_totales,
+                        multa_total = r.multa_total + EXCLUDED.multa_total
+                """))
+                await conn.execute(text("""
+                    INSERT INTO libro_resumen_archivado AS r (libro_id, prestamos_totales)
+                    SELECT libro_id, prestamos_totales FROM archivo_libros
+                    ON CONFLICT (libro_id) DO UPDATE SET
+                        prestamos_totales = r.prestamos_totales + EXCLUDED.prestamos_totales
+                """))
+                await conn.execute(text(f"DROP TABLE {nombre}"))
+        except BaseException:
+            # El archivo de una partición que sigue adjunta se rehace en la próxima pasada
+            for ruta in (volcado, archivo):
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+            raise
+        finally:
+            # La conexión vuelve al pool: las temporales no deben sobrevivir
+            async with conn.begin():
+                await conn.execute(text("DROP TABLE IF EXISTS archivo_usuarios, archivo_libros"))
+
+    resultado = {
+        "particion": nombre,
+        "archivo": archivo,
+        "filas": filas,
+        "bytes": os.path.getsize(archivo),
+        "fecha": datetime.utcnow(),
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
+    historial_archivo.append(resultado)
+    print(f"📦 Partición {nombre} archivada: {filas} filas en {archivo}")
+    return resultado
+
+
+async def archivar_particiones_antiguas(meses_retencion: int = ARCHIVO_MESES_RETENCION):
+    """Archiva las particiones mensuales más antiguas que la retención"""
+    limite = _sumar_meses(date.today().replace(day=1), -meses_retencion)
+    async with engine.connect() as conn:
+        candidatas = [p["nombre"] for p in await listar_particiones(conn) if p["mes"] and p["mes"] < limite]
+
+    archivadas = []
+    for nombre in candidatas:
+        resultado = await archivar_particion(nombre)
+        if resultado:
+            archivadas.append(resultado)
+    return archivadas
+
+
+async def tarea_particiones():
+    """Mantenimiento diario: particiones futuras y archivo de las antiguas"""
+    while True:
+        try:
+            await asegurar_particiones()
+            await archivar_particiones_antiguas()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error en mantenimiento de particiones: {e}")
+        await asyncio.sleep(PARTICIONES_INTERVALO_SEGUNDOS)
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import select, func, cast, Float
+
+from models import engine, Prestamo
+from database import MULTA_POR_DIA
+
+# Tramos de días de retraso: [0, 1), [1, 8), [8, 31), [31, 91), [91, ∞)
+LIMITES_TRAMOS = np.array([1, 8, 31, 91])
+NOMBRES_TRAMOS = ["al_dia", "1-7", "8-30", "31-90", "90+"]
+ESTADOS_ABIERTOS = ["activo", "vencido"]
+# Filas por viaje al cargar los arreglos
+REPORTE_LOTE = 50_000
+# Escenarios por reporte; cada uno ocupa una fila de la matriz de multas
+MAX_ESCENARIOS = 20
+# Cuántos usuarios y libros con más multa incluir en el reporte
+REPORTE_TOP = 10
+
+
+async def cargar_prestamos_abiertos(lote: int = REPORTE_LOTE):
+    """
+    Carga en arreglos de NumPy las columnas que necesita el reporte.
+
+    Solo se traen préstamos activos o vencidos, por columnas y sin objetos ORM. La
+    fecha esperada llega como segundos desde epoch para no crear un datetime por fila.
+    """
+    consulta = select(
+        Prestamo.usuario_id,
+        Prestamo.libro_id,
+        cast(func.extract("epoch", Prestamo.fecha_devolucion_esperada), Float),
+        (Prestamo.estado == "vencido"),
+    ).where(Prestamo.estado.in_(ESTADOS_ABIERTOS)).execution_options(yield_per=lote)
+
+    partes = []
+    async with engine.connect() as conn:
+        resultado = await conn.stream(consulta)
+        async for filas in resultado.partitions():
+            partes.append(np.array(filas, dtype=np.float64))
+
+    datos = np.concatenate(partes) if partes else np.empty((0, 4))
+    return {
+        "usuario_id": datos[:, 0].astype(np.int64),
+        "libro_id": datos[:, 1].astype(np.int64),
+        "vencimiento": datos[:, 2],
+        "vencido": datos[:, 3].astype(bool),
+    }
+
+
+def dias_de_retraso(vencimiento, ahora: datetime):
+    """Días completos de retraso a la fecha `ahora`, igual que calcular_multa (nunca negativos)"""
+    # Las fechas de la base son UTC sin zona; una fecha sin zona se toma como UTC
+    if ahora.tzinfo is None:
+        ahora = ahora.replace(tzinfo=timezone.utc)
+    segundos = ahora.timestamp() - vencimiento
+    return np.maximum(np.floor(segundos / 86400), 0).astype(np.int64)
+
+
+def proyectar_multas(dias, tarifas, gracias):
+    """
+    Multas de todos los préstamos bajo varios escenarios a la vez.
+
+    Devuelve una matriz (escenarios × préstamos): en cada escenario se cobran
+    `tarifa` por día después de los primeros `gracia` días de retraso.
+    """
+    tarifas = np.asarray(tarifas, dtype=np.float64)[:, None]
+    gracias = np.asarray(gracias, dtype=np.int64)[:, None]
+    return np.maximum(dias[None, :] - gracias, 0) * tarifas
+
+
+def _agrupar(ids):
+    """
+    (ids distintos, índice de grupo por fila). Con ids densos el propio id sirve de
+    índice y se evita ordenar; si no, se compactan con np.unique.
+    """
+    if len(ids) and 0 <= ids.min() and ids.max() < 4 * len(ids):
+        return np.arange(ids.max() + 1), ids
+    return np.unique(ids, return_inverse=True)
+
+
+def _top(grupos, montos, n):
+    unicos, inversos = grupos
+    totales = np.bincount(inversos, weights=montos, minlength=len(unicos))
+    orden = np.argpartition(totales, -n)[-n:] if len(totales) > n else np.arange(len(totales))
+    orden = orden[np.argsort(totales[orden])[::-1]]
+    return [{"id": int(unicos[i]), "multa": round(float(totales[i]), 2)} for i in orden if totales[i] > 0]
+
+
+def calcular_reporte(arreglos, escenarios, ahora: datetime, top: int = REPORTE_TOP):
+    """Reporte de multas proyectadas por escenario, tramo de retraso y estado"""
+    dias = dias_de_retraso(arreglos["vencimiento"], ahora)
+    multas = proyectar_multas(dias, [e["tarifa_dia"] for e in escenarios], [e["dias_gracia"] for e in escenarios])
+
+    tramos = np.digitize(dias, LIMITES_TRAMOS)
+    conteo_tramos = np.bincount(tramos, minlength=len(NOMBRES_TRAMOS))
+    estados = arreglos["vencido"].astype(np.int64)
+    # Agrupaciones por usuario y por libro, compartidas por todos los escenarios
+    usuarios = _agrupar(arreglos["usuario_id"])
+    libros = _agrupar(arreglos["libro_id"])
+
+    resultado = []
+    for escenario, multa in zip(escenarios, multas):
+        por_tramo = np.bincount(tramos, weights=multa, minlength=len(NOMBRES_TRAMOS))
+        por_estado = np.bincount(estados, weights=multa, minlength=2)
+        resultado.append({
+            **escenario,
+            "multa_total": round(float(multa.sum()), 2),
+            "prestamos_con_multa": int(np.count_nonzero(multa)),
+            "por_tramo": {
+                nombre: {"prestamos": int(conteo_tramos[i]), "multa": round(float(por_tramo[i]), 2)}
+                for i, nombre in enumerate(NOMBRES_TRAMOS)
+            },
+            "por_estado": {"activo": round(float(por_estado[0]), 2), "vencido": round(float(por_estado[1]), 2)},
+            "top_usuarios": _top(usuarios, multa, top),
+            "top_libros": _top(libros, multa, top),
+        })
+    return resultado
+
+
+async def reporte_multas(escenarios=None, ahora: datetime = None):
+    """Carga los préstamos abiertos y calcula el reporte fuera del event loop"""
+    escenarios = escenarios or [{"tarifa_dia": MULTA_POR_DIA, "dias_gracia": 0}]
+    ahora = ahora or datetime.utcnow()
+
+    inicio = time.perf_counter()
+    arreglos = await cargar_prestamos_abiertos()
+    carga_ms = (time.perf_counter() - inicio) * 1000
+
+    inicio = time.perf_counter()
+    escenarios_calculados = await asyncio.to_thread(calcular_reporte, arreglos, escenarios, ahora)
+    calculo_ms = (time.perf_counter() - inicio) * 1000
+
+    return {
+        "fecha": ahora,
+        "prestamos_abiertos": len(arreglos["vencimiento"]),
+        "escenarios": escenarios_calculados,
+        "carga_ms": round(carga_ms, 2),
+        "calculo_ms": round(calculo_ms, 2),
+    }
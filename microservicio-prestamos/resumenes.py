@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from models import engine, UsuarioResumen, LibroResumen, SIN_LIMITE_SENTENCIAS
+
+RECONCILIAR_INTERVALO_SEGUNDOS = int(os.getenv("RESUMEN_RECONCILIAR_INTERVALO", "86400"))
+
+# Último resultado de la reconciliación
+ultima_reconciliacion = {}
+
+# Diferencias entre los resúmenes y lo que dicen los préstamos, incluidos los archivados
+SQL_DIFERENCIAS_USUARIOS = """
+    WITH real AS (
+        SELECT usuario_id, sum(activos) AS prestamos_activos, sum(totales) AS prestamos_totales,
+               sum(multa) AS multa_total
+        FROM (
+            SELECT usuario_id, (estado IN ('activo', 'vencido'))::int AS activos, 1 AS totales,
+                   coalesce(multa, 0) AS multa
+            FROM prestamos
+            UNION ALL
+            SELECT usuario_id, 0, prestamos_totales, multa_total FROM usuario_resumen_archivado
+        ) t
+        GROUP BY usuario_id
+    )
+    SELECT coalesce(real.usuario_id, r.usuario_id) AS usuario_id,
+           coalesce(real.prestamos_activos, 0) AS prestamos_activos,
+           coalesce(real.prestamos_totales, 0) AS prestamos_totales,
+           coalesce(real.multa_total, 0) AS multa_total
+    FROM real FULL OUTER JOIN usuario_resumen r ON r.usuario_id = real.usuario_id
+    WHERE r.usuario_id IS NULL OR real.usuario_id IS NULL
+       OR r.prestamos_activos <> real.prestamos_activos
+       OR r.prestamos_totales <> real.prestamos_totales
+       OR abs(r.multa_total - real.multa_total) > 0.001
+"""
+
+SQL_DIFERENCIAS_LIBROS = """
+    WITH real AS (
+        SELECT libro_id, sum(activos) AS prestamos_activos, sum(totales) AS prestamos_totales
+        FROM (
+            SELECT libro_id, (estado IN ('activo', 'vencido'))::int AS activos, 1 AS totales
+            FROM prestamos
+            UNION ALL
+            SELECT libro_id, 0, prestamos_totales FROM libro_resumen_archivado
+        ) t
+        GROUP BY libro_id
+    )
+    SELECT coalesce(real.libro_id, r.libro_id) AS libro_id,
+           coalesce(real.prestamos_activos, 0) AS prestamos_activos,
+           coalesce(real.prestamos_totales, 0) AS prestamos_totales
+    FROM real FULL OUTER JOIN libro_resumen r ON r.libro_id = real.libro_id
+    WHERE r.libro_id IS NULL OR real.libro_id IS NULL
+       OR r.prestamos_activos <> real.prestamos_activos
+       OR r.prestamos_totales <> real.prestamos_totales
+"""
+
+# Corrección de una sola clave con lo último confirmado. Antes se bloquea su fila
+# de resumen, así los triggers de esa clave esperan en lugar de cruzarse.
+SQL_BLOQUEAR_USUARIO = "SELECT 1 FROM usuario_resumen WHERE usuario_id = :id FOR UPDATE"
+SQL_CORREGIR_USUARIO = """
+    INSERT INTO usuario_resumen (usuario_id, prestamos_activos, prestamos_totales, multa_total, actualizado_en)
+    SELECT :id, coalesce(sum(activos), 0), coalesce(sum(totales), 0), coalesce(sum(multa), 0), now()
+    FROM (
+        SELECT (estado IN ('activo', 'vencido'))::int AS activos, 1 AS totales, coalesce(multa, 0) AS multa
+        FROM prestamos WHERE usuario_id = :id
+        UNION ALL
+        SELECT 0, prestamos_totales, multa_total FROM usuario_resumen_archivado WHERE usuario_id = :id
+    ) t
+    ON CONFLICT (usuario_id) DO UPDATE SET
+        prestamos_activos = EXCLUDED.prestamos_activos,
+        prestamos_totales = EXCLUDED.prestamos_totales,
+        multa_total = EXCLUDED.multa_total,
+        actualizado_en = now()
+"""
+
+SQL_BLOQUEAR_LIBRO = "SELECT 1 FROM libro_resumen WHERE libro_id = :id FOR UPDATE"
+SQL_CORREGIR_LIBRO = """
+    INSERT INTO libro_resumen (libro_id, prestamos_activos, prestamos_totales, actualizado_en)
+    SELECT :id, coalesce(sum(activos), 0), coalesce(sum(totales), 0), now()
+    FROM (
+        SELECT (estado IN ('activo', 'vencido'))::int AS activos, 1 AS totales
+        FROM prestamos WHERE libro_id = :id
+        UNION ALL
+        SELECT 0, prestamos_totales FROM libro_resumen_archivado WHERE libro_id = :id
+    ) t
+    ON CONFLICT (libro_id) DO UPDATE SET
+        prestamos_activos = EXCLUDED.prestamos_activos,
+        prestamos_totales = EXCLUDED.prestamos_totales,
+        actualizado_en = now()
+"""
+
+
+async def obtener_resumen_usuario(db, usuario_id):
+    """Resumen de un usuario por clave primaria; un usuario sin préstamos no tiene fila"""
+    resumen = await db.get(UsuarioResumen, usuario_id)
+    if resumen is None:
+        return {"usuario_id": usuario_id, "prestamos_activos": 0, "prestamos_totales": 0, "multa_total": 0.0}
+    return {
+        "usuario_id": usuario_id,
+        "prestamos_activos": resumen.prestamos_activos,
+        "prestamos_totales": resumen.prestamos_totales,
+        "multa_total": resumen.multa_total,
+    }
+
+
+async def obtener_resumen_libro(db, libro_id):
+    """Resumen de un libro por clave primaria"""
+    resumen = await db.get(LibroResumen, libro_id)
+    if resumen is None:
+        return {"libro_id": libro_id, "prestamos_activos": 0, "prestamos_totales": 0}
+    return {
+        "libro_id": libro_id,
+        "prestamos_activos": resumen.prestamos_activos,
+        "prestamos_totales": resumen.prestamos_totales,
+    }
+
+
+async def reconciliar_resumenes(corregir: bool = False):
+    """
+    Compara los resúmenes con un recálculo completo sobre `prestamos`.
+
+    Es un recorrido completo de la tabla, por eso corre con poca frecuencia y no
+    en el camino de las peticiones. Las diferencias salen de una instantánea de
+    solo lectura; con `corregir` cada clave distinta se recalcula y reescribe
+    después en su propia transacción READ COMMITTED, donde escribir junto a los
+    triggers no provoca errores de serialización.
+    """
+    inicio = time.perf_counter()
+    # Lectura consistente de prestamos y resúmenes frente a escrituras concurrentes
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="REPEATABLE READ")
+        async with conn.begin():
+            await conn.execute(SIN_LIMITE_SENTENCIAS)
+            usuarios = (await conn.execute(text(SQL_DIFERENCIAS_USUARIOS))).mappings().all()
+            libros = (await conn.execute(text(SQL_DIFERENCIAS_LIBROS))).mappings().all()
+
+    if corregir:
+        correcciones = [(SQL_BLOQUEAR_USUARIO, SQL_CORREGIR_USUARIO, f["usuario_id"]) for f in usuarios]
+        correcciones += [(SQL_BLOQUEAR_LIBRO, SQL_CORREGIR_LIBRO, f["libro_id"]) for f in libros]
+        for bloquear, corregir_clave, clave in correcciones:
+            async with engine.begin() as conn:
+                await conn.execute(text(bloquear), {"id": clave})
+                await conn.execute(text(corregir_clave), {"id": clave})
+
+    resultado = {
+        "fecha": datetime.utcnow(),
+        "usuarios_con_diferencias": len(usuarios),
+        "libros_con_diferencias": len(libros),
+        "corregido": corregir,
+        "ejemplos_usuarios": [dict(f) for f in usuarios[:10]],
+        "ejemplos_libros": [dict(f) for f in libros[:10]],
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
+    ultima_reconciliacion.clear()
+    ultima_reconciliacion.update(resultado)
+    if usuarios or libros:
+        print(f"⚠️ Reconciliación de resúmenes: {len(usuarios)} usuarios y {len(libros)} libros con diferencias")
+    return resultado
+
+
+async def tarea_reconciliacion_resumenes():
+    """Reconciliación periódica que corrige las diferencias encontradas"""
+    while True:
+        await asyncio.sleep(RECONCILIAR_INTERVALO_SEGUNDOS)
+        try:
+            await reconciliar_resumenes(corregir=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error en reconciliación de resúmenes: {e}")
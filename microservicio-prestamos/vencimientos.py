@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import text
+from models import engine
+from database import MULTA_POR_DIA
+
+# Configuración del barrido de préstamos vencidos
+BARRIDO_INTERVALO_SEGUNDOS = int(os.getenv("BARRIDO_VENCIDOS_INTERVALO", "300"))
+BARRIDO_LOTE = int(os.getenv("BARRIDO_VENCIDOS_LOTE", "5000"))
+
+# Últimas ejecuciones del barrido, para consulta desde la API
+historial_barridos = deque(maxlen=50)
+
+# Marca como vencidos los préstamos activos cuya fecha esperada ya pasó.
+# SKIP LOCKED evita esperar filas que una devolución tiene bloqueadas.
+SQL_MARCAR_VENCIDOS = text("""
+    WITH lote AS (
+        SELECT id FROM prestamos
+        WHERE estado = 'activo' AND fecha_devolucion_esperada < CAST(:ahora AS timestamp)
+        LIMIT :lote
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE prestamos p
+    SET estado = 'vencido',
+        dias_retraso = floor(extract(epoch FROM (CAST(:ahora AS timestamp) - p.fecha_devolucion_esperada)) / 86400)::int,
+        multa = floor(extract(epoch FROM (CAST(:ahora AS timestamp) - p.fecha_devolucion_esperada)) / 86400) * CAST(:multa_dia AS float8)
+    FROM lote
+    WHERE p.id = lote.id
+""")
+
+# Acumula días y multa en los préstamos que ya estaban vencidos. Solo toca las
+# filas cuyo número de días cambió, por lo que cada fila se actualiza una vez al día.
+SQL_ACUMULAR_MULTAS = text("""
+    WITH lote AS (
+        SELECT id FROM prestamos
+        WHERE estado = 'vencido'
+          AND id > :desde_id
+          AND dias_retraso < floor(extract(epoch FROM (CAST(:ahora AS timestamp) - fecha_devolucion_esperada)) / 86400)
+        ORDER BY id
+        LIMIT :lote
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE prestamos p
+    SET dias_retraso = floor(extract(epoch FROM (CAST(:ahora AS timestamp) - p.fecha_devolucion_esperada)) / 86400)::int,
+        multa = floor(extract(epoch FROM (CAST(:ahora AS timestamp) - p.fecha_devolucion_esperada)) / 86400) * CAST(:multa_dia AS float8)
+    FROM lote
+    WHERE p.id = lote.id
+    RETURNING p.id
+""")
+
+
+async def barrer_vencidos(lote: int = BARRIDO_LOTE):
+    """
+    Marca préstamos vencidos y acumula sus multas con UPDATE por conjuntos.
+
+    Cada lote se confirma en su propia transacción para que los bloqueos duren
+    poco. Devuelve y registra cuántas filas se tocaron y cuánto tardó.
+    """
+    inicio = time.perf_counter()
+    ahora = datetime.utcnow()
+    parametros = {"ahora": ahora, "lote": lote, "multa_dia": MULTA_POR_DIA}
+    marcados = 0
+    acumulados = 0
+    lotes = 0
+
+    while True:
+        async with engine.begin() as conn:
+            filas = (await conn.execute(SQL_MARCAR_VENCIDOS, parametros)).rowcount
+        marcados += filas
+        lotes += 1
+        if filas < lote:
+            break
+
+    # Recorre por id creciente para no volver sobre filas saltadas por SKIP LOCKED
+    desde_id = 0
+    while True:
+        async with engine.begin() as conn:
+            ids = (await conn.execute(SQL_ACUMULAR_MULTAS, {**parametros, "desde_id": desde_id})).scalars().all()
+        acumulados += len(ids)
+        lotes += 1
+        if len(ids) < lote:
+            break
+        desde_id = max(ids)
+
+    resultado = {
+        "fecha": ahora,
+        "marcados_vencidos": marcados,
+        "multas_actualizadas": acumulados,
+        "lotes": lotes,
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
+    historial_barridos.append(resultado)
+    if marcados or acumulados:
+        print(f"📅 Barrido de vencidos: {marcados} marcados, {acumulados} multas actualizadas "
+              f"en {resultado['duracion_ms']} ms")
+    return resultado
+
+
+async def tarea_barrido_vencidos():
+    """Tarea periódica que ejecuta el barrido de vencidos"""
+    while True:
+        try:
+            await barrer_vencidos()
+            await asyncio.sleep(BARRIDO_INTERVALO_SEGUNDOS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error en barrido de préstamos vencidos: {e}")
+            await asyncio.sleep(BARRIDO_INTERVALO_SEGUNDOS)
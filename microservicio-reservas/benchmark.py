@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import MongoClient
+
+import database
+from escritor import EscritorNotificaciones
+from models import TipoNotificacion
+
+
+def _cliente_por_peticion():
+    """Comportamiento anterior de get_database: cliente nuevo y ping en cada llamada"""
+    client = MongoClient(database.MONGO_URL)
+    client.admin.command('ping')
+    return client[database.DB_NAME], client
+
+
+def _cliente_compartido():
+    return database.get_database(), None
+
+
+def _peticion(obtener_db, latencias):
+    """Lo que hace GET /reservas/usuario/{id}: obtener la base y leer las reservas del usuario"""
+    inicio = time.perf_counter()
+    db, client = obtener_db()
+    list(db.reservas.find({"usuario_id": random.randint(1, 1000)}).limit(20))
+    latencias.append((time.perf_counter() - inicio) * 1000)
+    # Sin cerrar, como antes, el cliente quedaría vivo hasta el recolector de basura
+    if client is not None:
+        client.close()
+
+
+def medir(obtener_db, peticiones, hilos):
+    latencias = []
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        list(ejecutor.map(lambda _: _peticion(obtener_db, latencias), range(peticiones)))
+    duracion = time.perf_counter() - inicio
+    latencias.sort()
+    return {
+        "rps": peticiones / duracion,
+        "p50": statistics.median(latencias),
+        "p95": latencias[min(int(len(latencias) * 0.95), len(latencias) - 1)],
+    }
+
+
+async def duplicados(base_url, rondas, concurrentes):
+    """
+    Dispara a la vez varias creaciones de la misma reserva contra el servicio y
+    comprueba que solo una prospera y que en la base queda una sola activa.
+    """
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("❌ duplicados requiere 'httpx' (pip install httpx)")
+
+    db = database.get_database()
+    fallos = 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        for ronda in range(rondas):
+            datos = {"usuario_id": random.randint(1_000_000, 9_999_999), "libro_id": random.randint(1, 5000)}
+            respuestas = await asyncio.gather(*(client.post("/reservas", json=datos) for _ in range(concurrentes)))
+            creadas = sum(r.status_code == 200 for r in respuestas)
+            rechazadas = sum(r.status_code == 400 for r in respuestas)
+            activas = db.reservas.count_documents({**datos, "estado": "activa"})
+            correcta = creadas == 1 and activas == 1 and creadas + rechazadas == concurrentes
+            fallos += not correcta
+            print(f"{'✅' if correcta else '❌'} ronda {ronda + 1}: {creadas} creadas, {rechazadas} rechazadas, "
+                  f"{activas} activas en la base")
+            db.reservas.update_many({**datos, "estado": "activa"}, {"$set": {"estado": "cancelada"}})
+    if fallos:
+        raise SystemExit(f"❌ {fallos} rondas con reservas duplicadas")
+
+
+# Usuario ficticio para las notificaciones del benchmark; se borran al terminar
+USUARIO_BENCHMARK = -1
+
+
+async def _producir_notificaciones(guardar, total, concurrentes):
+    """`concurrentes` productores guardan `total` notificaciones; devuelve latencias por llamada en ms"""
+    latencias = []
+
+    async def productor(cantidad):
+        for _ in range(cantidad):
+            notificacion = database.construir_notificacion(
+                USUARIO_BENCHMARK, TipoNotificacion.RECORDATORIO, "benchmark del escritor"
+            )
+            inicio = time.perf_counter()
+            await guardar(notificacion)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+
+    por_productor = total // concurrentes
+    await asyncio.gather(*(productor(por_productor) for _ in range(concurrentes)))
+    return latencias
+
+
+async def escritor_notificaciones(total, concurrentes):
+    """
+    Latencia que ve un endpoint al registrar una notificación: insert_one en el
+    propio event loop (comportamiento anterior) contra encolar en el escritor.
+    """
+    db = database.get_database()
+
+    async def directo(notificacion):
+        db.notificaciones.insert_one(notificacion)
+        database.despues_de_insertar(db, [notificacion])
+
+    escritor = EscritorNotificaciones()
+    escritor.iniciar()
+    modos = {"insert_one": directo, "escritor": escritor.encolar}
+
+    print(f"{'modo':<12}{'notif/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for nombre, guardar in modos.items():
+        inicio = time.perf_counter()
+        latencias = await _producir_notificaciones(guardar, total, concurrentes)
+        if nombre == "escritor":
+            await escritor.cerrar()
+        duracion = time.perf_counter() - inicio
+        latencias.sort()
+        print(f"{nombre:<12}{len(latencias) / duracion:>10.0f}{statistics.median(latencias):>10.3f}"
+              f"{latencias[min(int(len(latencias) * 0.99), len(latencias) - 1)]:>10.3f}{latencias[-1]:>10.3f}")
+    print(f"Escritor: {escritor.estado()}")
+
+    db.notificaciones.delete_many({"usuario_id": USUARIO_BENCHMARK})
+    db.contadores_notificaciones.delete_one({"_id": USUARIO_BENCHMARK})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks del microservicio de reservas")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("clientes", help="Latencia con un cliente de MongoDB por petición contra uno compartido")
+    p.add_argument("--peticiones", type=int, default=500)
+    p.add_argument("--hilos", type=int, nargs="+", default=[1, 8, 32])
+
+    p = sub.add_parser("duplicados", help="Creaciones concurrentes de la misma reserva")
+    p.add_argument("--url", default="http://localhost:8004")
+    p.add_argument("--rondas", type=int, default=20)
+    p.add_argument("--concurrentes", type=int, default=20)
+
+    p = sub.add_parser("escritor", help="Notificaciones con insert_one por petición contra el escritor por lotes")
+    p.add_argument("--total", type=int, default=20000)
+    p.add_argument("--concurrentes", type=int, default=50)
+
+    args = parser.parse_args()
+    database.conectar()
+    if args.comando == "clientes":
+        modos = {"por petición": _cliente_por_peticion, "compartido": _cliente_compartido}
+        print(f"{'modo':<14}{'hilos':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for hilos in args.hilos:
+            for nombre, obtener_db in modos.items():
+                r = medir(obtener_db, args.peticiones, hilos)
+                print(f"{nombre:<14}{hilos:>8}{r['rps']:>10.0f}{r['p50']:>10.2f}{r['p95']:>10.2f}")
+        print(f"Pool compartido: {database.estado_pool()}")
+    elif args.comando == "duplicados":
+        asyncio.run(duplicados(args.url, args.rondas, args.concurrentes))
+    elif args.comando == "escritor":
+        asyncio.run(escritor_notificaciones(args.total, args.concurrentes))
+    database.cerrar_conexion()
@@ -0,0 +1,209 @@
+import os
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+
+from models import EstadoReserva
+
+# Mientras no haya devoluciones registradas, cada puesto en la fila equivale a un préstamo completo
+COLA_INTERVALO_POR_DEFECTO_HORAS = float(os.getenv("COLA_INTERVALO_POR_DEFECTO_HORAS", str(15 * 24)))
+# Peso de la última devolución en el promedio móvil del intervalo entre devoluciones
+COLA_ALFA_INTERVALO = 0.3
+
+FILTRO_EN_COLA = {"estado": EstadoReserva.ACTIVA.value}
+
+# Contadores de la fila en `colas`: todas las secuencias <= base ya salieron de la
+# fila y `bajas` guarda las que salieron por encima de base (cancelaciones y
+# vencimientos en medio de la fila). Así puesto y largo salen del documento del
+# libro sin contar reservas.
+CONTADORES_NUEVA_COLA = {"base": 0}
+
+
+def siguiente_secuencia(db, libro_id):
+    """Número de llegada a la fila del libro; crece siempre, nunca se reutiliza"""
+    cola = db.colas.find_one_and_update(
+        {"_id": libro_id},
+        {"$inc": {"siguiente": 1}, "$setOnInsert": CONTADORES_NUEVA_COLA},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return cola["siguiente"]
+
+
+def registrar_baja(db, libro_id, secuencia):
+    """
+    Anota que una secuencia salió de la fila (cumplida, cancelada, vencida o nunca insertada).
+
+    Es idempotente: $addToSet no repite la secuencia y el filtro por base ignora
+    las que ya quedaron absorbidas. Después intenta correr base sobre las bajas
+    contiguas para que la lista solo guarde los huecos de en medio de la fila.
+    """
+    if secuencia is None:
+        return
+    db.colas.update_one({"_id": libro_id, "base": {"$lt": secuencia}}, {"$addToSet": {"bajas": secuencia}})
+
+    cola = db.colas.find_one({"_id": libro_id}, {"base": 1, "bajas": 1})
+    if not cola or "base" not in cola:
+        return
+    bajas = set(cola.get("bajas", []))
+    base = cola["base"]
+    while base + 1 in bajas:
+        base += 1
+    if base > cola["base"]:
+        # Condicionado a la base leída: si otro proceso ya la corrió, esta pasada no hace falta
+        db.colas.update_one(
+            {"_id": libro_id, "base": cola["base"]},
+            {"$set": {"base": base}, "$pull": {"bajas": {"$lte": base}}},
+        )
+
+
+def registrar_bajas(db, reservas):
+    """registrar_baja para varias reservas con libro_id y secuencia"""
+    for reserva in reservas:
+        registrar_baja(db, reserva["libro_id"], reserva.get("secuencia"))
+
+
+def longitud_cola(db, libro_id):
+    """Reservas activas en la fila: secuencias entregadas menos las que ya salieron"""
+    cola = db.colas.find_one({"_id": libro_id}, {"siguiente": 1, "base": 1, "bajas": 1})
+    if not cola:
+        return 0
+    return cola.get("siguiente", 0) - cola.get("base", 0) - len(cola.get("bajas", []))
+
+
+def posicion_en_cola(db, reserva):
+    """Puesto (1 = siguiente en recibir el libro) de una reserva activa"""
+    cola = db.colas.find_one({"_id": reserva["libro_id"]}, {"base": 1, "bajas": 1}) or {}
+    secuencia = reserva["secuencia"]
+    salidas_antes = sum(1 for baja in cola.get("bajas", []) if baja < secuencia)
+    return secuencia - cola.get("base", 0) - salidas_antes
+
+
+def intervalo_devoluciones_horas(db, libro_id):
+    cola = db.colas.find_one({"_id": libro_id}, {"intervalo_medio_horas": 1})
+    if cola and cola.get("intervalo_medio_horas"):
+        return cola["intervalo_medio_horas"]
+    return COLA_INTERVALO_POR_DEFECTO_HORAS
+
+
+def estimar_espera(db, libro_id, posicion):
+    """Espera estimada para el puesto dado según el ritmo reciente de devoluciones del libro"""
+    horas = intervalo_devoluciones_horas(db, libro_id) * posicion
+    return {
+        "espera_estimada_horas": round(horas, 1),
+        "fecha_estimada": datetime.utcnow() + timedelta(hours=horas),
+    }
+
+
+def registrar_devolucion(db, libro_id, evento_id, fecha):
+    """
+    Actualiza el promedio móvil del intervalo entre devoluciones del libro.
+
+    Guarda el último evento aplicado para que una entrega repetida no cuente dos veces.
+    """
+    cola = db.colas.find_one({"_id": libro_id}) or {}
+    if cola.get("ultimo_evento_devolucion") == evento_id:
+        return
+    cambios = {"ultima_devolucion": fecha, "ultimo_evento_devolucion": evento_id}
+    anterior = cola.get("ultima_devolucion")
+    if anterior and fecha > anterior:
+        intervalo = (fecha - anterior).total_seconds() / 3600
+        medio = cola.get("intervalo_medio_horas")
+        cambios["intervalo_medio_horas"] = (
+            intervalo if medio is None else COLA_ALFA_INTERVALO * intervalo + (1 - COLA_ALFA_INTERVALO) * medio
+        )
+    db.colas.update_one({"_id": libro_id}, {"$set": cambios, "$setOnInsert": CONTADORES_NUEVA_COLA}, upsert=True)
+
+
+def promover_siguiente(db, libro_id, evento_id):
+    """
+    Entrega el ejemplar devuelto a la cabeza de la fila.
+
+    La reserva con menor secuencia pasa a cumplida en una sola operación atómica,
+    de modo que dos devoluciones simultáneas promueven a dos personas distintas.
+    Si el evento ya promovió a alguien, devuelve esa misma reserva.
+    """
+    promovida = db.reservas.find_one({"evento_promocion": evento_id})
+    if promovida:
+        registrar_baja(db, libro_id, promovida.get("secuencia"))
+        return promovida
+    promovida = db.reservas.find_one_and_update(
+        {"libro_id": libro_id, **FILTRO_EN_COLA},
+        {"$set": {
+            "estado": EstadoReserva.CUMPLIDA.value,
+            "evento_promocion": evento_id,
+            "fecha_promocion": datetime.utcnow(),
+        }},
+        sort=[("secuencia", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    if promovida:
+        registrar_baja(db, libro_id, promovida.get("secuencia"))
+    return promovida
+
+
+def asignar_secuencias_pendientes(db):
+    """Da secuencia, por orden de fecha_reserva, a las reservas activas creadas antes de la fila"""
+    pendientes = list(db.reservas.find(
+        {**FILTRO_EN_COLA, "secuencia": {"$exists": False}},
+        {"libro_id": 1},
+    ).sort([("libro_id", 1), ("fecha_reserva", 1)]))
+    if not pendientes:
+        return 0
+
+    por_libro = {}
+    for reserva in pendientes:
+        por_libro.setdefault(reserva["libro_id"], []).append(reserva["_id"])
+
+    operaciones = []
+    for libro_id, ids in por_libro.items():
+        # Reserva un bloque de secuencias consecutivas con un solo $inc
+        cola = db.colas.find_one_and_update(
+            {"_id": libro_id},
+            {"$inc": {"siguiente": len(ids)}, "$setOnInsert": CONTADORES_NUEVA_COLA},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        primera = cola["siguiente"] - len(ids) + 1
+        operaciones.extend(
+            UpdateOne({"_id": reserva_id}, {"$set": {"secuencia": primera + i}})
+            for i, reserva_id in enumerate(ids)
+        )
+    db.reservas.bulk_write(operaciones, ordered=False)
+    print(f"✅ Secuencias de fila asignadas a {len(operaciones)} reservas")
+    return len(operaciones)
+
+
+def inicializar_contadores_cola(db):
+    """
+    Calcula base y bajas de las filas que aún no los tienen (creadas antes de los contadores).
+
+    Toda secuencia entregada que no pertenece a una reserva activa ya salió de la
+    fila, así que basta con las secuencias activas de cada libro.
+    """
+    sin_contadores = {c["_id"]: c.get("siguiente", 0) for c in db.colas.find({"base": {"$exists": False}}, {"siguiente": 1})}
+    if not sin_contadores:
+        return 0
+
+    activas = {}
+    for reserva in db.reservas.find(
+        {"libro_id": {"$in": list(sin_contadores)}, **FILTRO_EN_COLA, "secuencia": {"$exists": True}},
+        {"libro_id": 1, "secuencia": 1},
+    ):
+        activas.setdefault(reserva["libro_id"], set()).add(reserva["secuencia"])
+
+    operaciones = []
+    for libro_id, siguiente in sin_contadores.items():
+        secuencias = activas.get(libro_id)
+        if secuencias:
+            base = min(secuencias) - 1
+            bajas = [s for s in range(base + 1, siguiente + 1) if s not in secuencias]
+        else:
+            base, bajas = siguiente, []
+        operaciones.append(UpdateOne(
+            {"_id": libro_id, "base": {"$exists": False}},
+            {"$set": {"base": base, "bajas": bajas}},
+        ))
+    db.colas.bulk_write(operaciones, ordered=False)
+    print(f"✅ Contadores de fila calculados para {len(operaciones)} libros")
+    return len(operaciones)
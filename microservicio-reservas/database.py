@@ -1,24 +1,138 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, monitoring
 from pymongo.errors import ConnectionFailure
+from bson import ObjectId
+from collections import Counter
 import os
+import threading
+import base64
 from datetime import datetime, timedelta
+from cola import asignar_secuencias_pendientes, inicializar_contadores_cola, registrar_bajas
+from difusion import difusor
 
 # Configuración de MongoDB
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
 DB_NAME = "biblioteca_reservas"
 
-def get_database():
-    """Obtiene la conexión a la base de datos MongoDB"""
+# Tamaño de página por defecto y máximo del listado de notificaciones
+PAGINA_POR_DEFECTO = 50
+PAGINA_MAXIMA = 200
+
+# Pool de conexiones y timeouts del cliente compartido
+MONGO_MAX_POOL = int(os.getenv("MONGO_MAX_POOL", "50"))
+MONGO_MIN_POOL = int(os.getenv("MONGO_MIN_POOL", "5"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+
+
+class MetricasPool(monitoring.ConnectionPoolListener):
+    """Cuenta conexiones abiertas y en uso a partir de los eventos del pool de pymongo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.abiertas = 0
+        self.en_uso = 0
+        self.pico_en_uso = 0
+        self.creadas = 0
+        self.checkouts = 0
+        self.checkouts_fallidos = 0
+
+    def connection_created(self, event):
+        with self._lock:
+            self.abiertas += 1
+            self.creadas += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.abiertas -= 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.en_uso += 1
+            self.checkouts += 1
+            self.pico_en_uso = max(self.pico_en_uso, self.en_uso)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.en_uso -= 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkouts_fallidos += 1
+
+    # Eventos que no afectan los contadores
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+metricas_pool = MetricasPool()
+# Un único cliente por proceso; pymongo es thread-safe y maneja su propio pool
+_client = None
+
+def conectar():
+    """Crea el cliente compartido (si no existe) y verifica la conexión una sola vez"""
+    global _client
+    if _client is not None:
+        return _client
     try:
-        client = MongoClient(MONGO_URL)
-        # Verificar conexión
+        client = MongoClient(
+            MONGO_URL,
+            maxPoolSize=MONGO_MAX_POOL,
+            minPoolSize=MONGO_MIN_POOL,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[metricas_pool],
+        )
         client.admin.command('ping')
         print("✅ Conectado a MongoDB exitosamente")
-        return client[DB_NAME]
+        _client = client
+        return _client
     except ConnectionFailure as e:
         print(f"❌ Error conectando a MongoDB: {e}")
         raise
 
+def cerrar_conexion():
+    """Cierra el cliente compartido y su pool"""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+def get_database():
+    """Base de datos de reservas sobre el cliente compartido"""
+    return conectar()[DB_NAME]
+
+def estado_pool():
+    """Configuración y uso actual del pool de conexiones"""
+    return {
+        "max_pool": MONGO_MAX_POOL,
+        "min_pool": MONGO_MIN_POOL,
+        "abiertas": metricas_pool.abiertas,
+        "en_uso": metricas_pool.en_uso,
+        "pico_en_uso": metricas_pool.pico_en_uso,
+        "creadas": metricas_pool.creadas,
+        "checkouts": metricas_pool.checkouts,
+        "checkouts_fallidos": metricas_pool.checkouts_fallidos,
+    }
+
 def initialize_database():
     """Inicializa la base de datos con colecciones e índices"""
     db = get_database()
@@ -41,9 +155,66 @@ def initialize_database():
     db.reservas.create_index([("libro_id", 1)])
     db.reservas.create_index([("estado", 1)])
     db.reservas.create_index([("fecha_vencimiento", 1)])
+    # Reservas vencidas con la notificación pendiente (barrido interrumpido)
+    db.reservas.create_index(
+        [("notificado", 1)],
+        name="vencidas_sin_notificar",
+        partialFilterExpression={"estado": "vencida", "notificado": False}
+    )
     
     db.notificaciones.create_index([("usuario_id", 1)])
     db.notificaciones.create_index([("fecha_creacion", 1)])
+    # Listado paginado por usuario (y reenvío a las conexiones en vivo) y su variante de solo no leídas
+    db.notificaciones.create_index(
+        [("usuario_id", 1), ("fecha_creacion", -1), ("_id", -1)],
+        name="usuario_fecha"
+    )
+    db.notificaciones.create_index(
+        [("usuario_id", 1), ("fecha_creacion", -1), ("_id", -1)],
+        name="usuario_fecha_no_leidas",
+        partialFilterExpression={"leida": False}
+    )
+    # Contadores de no leídas: la primera vez se calculan desde las notificaciones existentes
+    if db.contadores_notificaciones.estimated_document_count() == 0:
+        contadores = [
+            {"_id": c["_id"], "no_leidas": c["total"]}
+            for c in db.notificaciones.aggregate([
+                {"$match": {"leida": False}},
+                {"$group": {"_id": "$usuario_id", "total": {"$sum": 1}}},
+            ])
+        ]
+        if contadores:
+            db.contadores_notificaciones.insert_many(contadores)
+    # Un evento de préstamo genera como mucho una notificación por usuario
+    db.notificaciones.create_index(
+        [("evento_id", 1), ("usuario_id", 1)],
+        unique=True,
+        partialFilterExpression={"evento_id": {"$exists": True}}
+    )
+    
+    # Fila por libro: las reservas antiguas reciben secuencia antes de crear el índice único
+    asignar_secuencias_pendientes(db)
+    db.reservas.create_index(
+        [("libro_id", 1), ("secuencia", 1)],
+        name="cola_activa",
+        unique=True,
+        partialFilterExpression={"estado": "activa"}
+    )
+    # Una sola reserva activa por usuario y libro, garantizada por la base y no por una consulta previa
+    resolver_reservas_duplicadas(db)
+    db.reservas.create_index(
+        [("usuario_id", 1), ("libro_id", 1)],
+        name="reserva_activa_unica",
+        unique=True,
+        partialFilterExpression={"estado": "activa"}
+    )
+    # Puesto y largo de la fila salen de contadores en `colas`
+    inicializar_contadores_cola(db)
+    # Una devolución promueve como mucho una reserva
+    db.reservas.create_index(
+        [("evento_promocion", 1)],
+        partialFilterExpression={"evento_promocion": {"$exists": True}}
+    )
     
     print("✅ Índices creados correctamente")
     return db
@@ -52,18 +223,30 @@ def calcular_fecha_vencimiento(dias_reserva=7):
     """Calcula la fecha de vencimiento de la reserva"""
     return datetime.utcnow() + timedelta(days=dias_reserva)
 
-def verificar_reserva_activa(db, usuario_id, libro_id):
-    """Verifica si el usuario ya tiene una reserva activa para el mismo libro"""
-    reserva = db.reservas.find_one({
-        "usuario_id": usuario_id,
-        "libro_id": libro_id,
-        "estado": "activa"
-    })
-    return reserva is not None
+def resolver_reservas_duplicadas(db):
+    """
+    Deja una sola reserva activa por (usuario_id, libro_id): conserva la más
+    antigua y cancela el resto, para poder crear el índice único.
+    """
+    duplicadas = db.reservas.aggregate([
+        {"$match": {"estado": "activa"}},
+        {"$sort": {"fecha_reserva": 1}},
+        {"$group": {"_id": {"usuario_id": "$usuario_id", "libro_id": "$libro_id"}, "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ])
+    sobrantes = [id_ for grupo in duplicadas for id_ in grupo["ids"][1:]]
+    if sobrantes:
+        db.reservas.update_many(
+            {"_id": {"$in": sobrantes}},
+            {"$set": {"estado": "cancelada", "notificado": True}}
+        )
+        registrar_bajas(db, db.reservas.find({"_id": {"$in": sobrantes}}, {"libro_id": 1, "secuencia": 1}))
+        print(f"⚠️ {len(sobrantes)} reservas activas duplicadas canceladas")
+    return len(sobrantes)
 
-def crear_notificacion(db, usuario_id, tipo, mensaje, reserva_id=None):
-    """Crea una notificación para el usuario"""
-    notificacion = {
+def construir_notificacion(usuario_id, tipo, mensaje, reserva_id=None):
+    """Arma el documento de una notificación sin guardarlo"""
+    return {
         "usuario_id": usuario_id,
         "tipo": tipo,  # "vencimiento", "disponible", "recordatorio"
         "mensaje": mensaje,
@@ -71,6 +254,86 @@ def crear_notificacion(db, usuario_id, tipo, mensaje, reserva_id=None):
         "leida": False,
         "fecha_creacion": datetime.utcnow()
     }
+
+def crear_notificacion(db, usuario_id, tipo, mensaje, reserva_id=None):
+    """Crea una notificación para el usuario"""
+    notificacion = construir_notificacion(usuario_id, tipo, mensaje, reserva_id)
     
     db.notificaciones.insert_one(notificacion)
-    return notificacion
\ No newline at end of file
+    despues_de_insertar(db, [notificacion])
+    return notificacion
+
+def despues_de_insertar(db, notificaciones):
+    """
+    Suma las notificaciones ya guardadas a los contadores de no leídas y las
+    difunde en vivo. Se llama en todos los puntos que insertan notificaciones.
+    """
+    if not notificaciones:
+        return
+    por_usuario = Counter(n["usuario_id"] for n in notificaciones if not n.get("leida"))
+    if por_usuario:
+        db.contadores_notificaciones.bulk_write([
+            UpdateOne({"_id": usuario_id}, {"$inc": {"no_leidas": cantidad}}, upsert=True)
+            for usuario_id, cantidad in por_usuario.items()
+        ], ordered=False)
+    difusor.publicar(notificaciones)
+
+def descontar_leidas(db, usuario_id, cantidad):
+    """Resta del contador las notificaciones que pasaron a leídas"""
+    if cantidad:
+        db.contadores_notificaciones.update_one({"_id": usuario_id}, {"$inc": {"no_leidas": -cantidad}})
+
+def contar_no_leidas(db, usuario_id, exacto=False):
+    """
+    No leídas de un usuario leyendo su contador (una búsqueda por _id).
+
+    Con `exacto` cuenta sobre el índice parcial de no leídas y corrige el
+    contador si se había desviado (por ejemplo, un proceso caído entre la
+    inserción y el $inc).
+    """
+    if not exacto:
+        contador = db.contadores_notificaciones.find_one({"_id": usuario_id})
+        return contador["no_leidas"] if contador else 0
+    total = db.notificaciones.count_documents({"usuario_id": usuario_id, "leida": False})
+    db.contadores_notificaciones.update_one({"_id": usuario_id}, {"$set": {"no_leidas": total}}, upsert=True)
+    return total
+
+def codificar_cursor(fecha, id_):
+    """Cursor opaco con la clave (fecha_creacion, _id) de la última notificación de una página"""
+    return base64.urlsafe_b64encode(f"{fecha.isoformat()}|{id_}".encode()).decode()
+
+def decodificar_cursor(cursor):
+    """Devuelve (fecha, _id) de un cursor; lanza ValueError si es inválido"""
+    try:
+        fecha, id_ = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(fecha), ObjectId(id_)
+    except Exception as e:
+        raise ValueError("Cursor inválido") from e
+
+def pagina_notificaciones(db, usuario_id, solo_no_leidas=False, cursor=None, limite=PAGINA_POR_DEFECTO):
+    """
+    Página de notificaciones de un usuario, de la más nueva a la más vieja.
+
+    Paginación por clave sobre (usuario_id, fecha_creacion, _id): cada página es un
+    tramo del índice, sin saltar documentos. Las no leídas usan el índice parcial.
+    """
+    filtro = {"usuario_id": usuario_id}
+    if solo_no_leidas:
+        filtro["leida"] = False
+    if cursor:
+        fecha, id_ = decodificar_cursor(cursor)
+        filtro["$or"] = [
+            {"fecha_creacion": {"$lt": fecha}},
+            {"fecha_creacion": fecha, "_id": {"$lt": id_}},
+        ]
+
+    filas = list(
+        db.notificaciones.find(filtro)
+        .sort([("fecha_creacion", -1), ("_id", -1)])
+        .limit(limite + 1)
+    )
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(filas[-1]["fecha_creacion"], filas[-1]["_id"])
+    return filas, siguiente
\ No newline at end of file
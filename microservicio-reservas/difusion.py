@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from datetime import timedelta
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Límites de memoria: conexiones abiertas y notificaciones en espera por conexión
+MAX_SUSCRIPTORES = int(os.getenv("NOTIFICACIONES_MAX_SUSCRIPTORES", "10000"))
+COLA_POR_SUSCRIPTOR = int(os.getenv("NOTIFICACIONES_COLA_SUSCRIPTOR", "100"))
+# Máximo de notificaciones reenviadas al reconectar con Last-Event-ID
+MAX_REENVIO = 500
+# Una notificación puede guardarse después de otra más nueva (lotes y reintentos del
+# escritor, relojes de réplicas distintas): el reenvío repasa esta ventana hacia atrás
+SOLAPE_REENVIO_SEGUNDOS = float(os.getenv("NOTIFICACIONES_SOLAPE_REENVIO_SEGUNDOS", "60"))
+# Ids ya enviados que recuerda cada conexión: lo encolado mientras se reenviaba
+# desde la base no supera la cola, así que con el doble alcanza para no repetir
+RECORDADAS_POR_CONEXION = 2 * COLA_POR_SUSCRIPTOR
+# El token de reanudación ya no sirve (inválido o fuera del oplog): hay que abrir uno nuevo
+CODIGOS_TOKEN_PERDIDO = {260, 280, 286}
+ESPERA_MAX_STREAM_SEGUNDOS = 30
+
+
+class Suscripcion:
+    """Conexión de un usuario: una cola acotada y una marca de desborde"""
+
+    __slots__ = ("usuario_id", "cola", "desbordada")
+
+    def __init__(self, usuario_id):
+        self.usuario_id = usuario_id
+        self.cola = asyncio.Queue(maxsize=COLA_POR_SUSCRIPTOR)
+        self.desbordada = False
+
+
+class Difusor:
+    """
+    Pub/sub en proceso que reparte notificaciones nuevas a las conexiones de cada usuario.
+
+    Si MongoDB es un replica set, la fuente es un change stream sobre
+    `notificaciones`, que ve también lo insertado por otras réplicas. En un
+    servidor standalone no hay change streams y se publica lo que inserta este
+    mismo proceso. Una conexión inactiva solo ocupa una cola vacía; si un cliente
+    lento llena la suya se marca como desbordada y se cierra para que reconecte
+    y recupere lo perdido desde la base con su último id.
+    """
+
+    def __init__(self):
+        self._suscriptores = {}
+        self._conexiones = 0
+        self._loop = None
+        self._detener = threading.Event()
+        self.modo = "local"
+        self.metricas = {"publicadas": 0, "entregadas": 0, "desbordes": 0}
+
+    def iniciar(self, db):
+        """Toma el event loop actual y, si se puede, abre el change stream en un hilo"""
+        self._loop = asyncio.get_running_loop()
+        try:
+            stream = db.notificaciones.watch([{"$match": {"operationType": "insert"}}])
+        except OperationFailure:
+            print("ℹ️ MongoDB sin change streams: notificaciones en vivo solo de esta réplica")
+            return
+        self.modo = "change_stream"
+        threading.Thread(target=self._seguir_stream, args=(db, stream), daemon=True).start()
+        print("✅ Notificaciones en vivo desde change stream")
+
+    def detener(self):
+        self._detener.set()
+
+    def _seguir_stream(self, db, stream):
+        token = None
+        espera = 1
+        while not self._detener.is_set():
+            try:
+                # Reabrir también puede fallar (servidor caído, elección): se reintenta con espera creciente
+                if stream is None:
+                    stream = db.notificaciones.watch([{"$match": {"operationType": "insert"}}], resume_after=token)
+                with stream:
+                    for cambio in stream:
+                        token = cambio["_id"]
+                        espera = 1
+                        self._loop.call_soon_threadsafe(self._repartir, [cambio["fullDocument"]])
+                        if self._detener.is_set():
+                            return
+            except PyMongoError as e:
+                if isinstance(e, OperationFailure) and e.code in CODIGOS_TOKEN_PERDIDO:
+                    # Lo ocurrido mientras tanto lo recuperan los clientes con su Last-Event-ID
+                    print("Token del change stream perdido: se sigue con uno nuevo desde ahora")
+                    token = None
+                print(f"Change stream de notificaciones interrumpido: {e}")
+                self._detener.wait(espera)
+                espera = min(espera * 2, ESPERA_MAX_STREAM_SEGUNDOS)
+            stream = None
+
+    def publicar(self, notificaciones):
+        """
+        Anuncia notificaciones recién insertadas (con su _id).
+
+        Se puede llamar desde cualquier hilo. Con change stream activo no hace
+        nada, porque el stream ya las entregará.
+        """
+        if self.modo != "local" or self._loop is None or not notificaciones:
+            return
+        self._loop.call_soon_threadsafe(self._repartir, list(notificaciones))
+
+    def _repartir(self, notificaciones):
+        for notificacion in notificaciones:
+            self.metricas["publicadas"] += 1
+            for suscripcion in list(self._suscriptores.get(notificacion["usuario_id"], ())):
+                try:
+                    suscripcion.cola.put_nowait(notificacion)
+                    self.metricas["entregadas"] += 1
+                except asyncio.QueueFull:
+                    suscripcion.desbordada = True
+                    self.metricas["desbordes"] += 1
+
+    def suscribir(self, usuario_id):
+        """Registra una conexión; devuelve None si se alcanzó el máximo"""
+        if self._conexiones >= MAX_SUSCRIPTORES:
+            return None
+        suscripcion = Suscripcion(usuario_id)
+        self._suscriptores.setdefault(usuario_id, set()).add(suscripcion)
+        self._conexiones += 1
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        conjunto = self._suscriptores.get(suscripcion.usuario_id)
+        if conjunto is not None and suscripcion in conjunto:
+            conjunto.discard(suscripcion)
+            self._conexiones -= 1
+            if not conjunto:
+                del self._suscriptores[suscripcion.usuario_id]
+
+    def estado(self):
+        return {
+            "modo": self.modo,
+            "conexiones": self._conexiones,
+            "usuarios": len(self._suscriptores),
+            "max_conexiones": MAX_SUSCRIPTORES,
+            **self.metricas,
+        }
+
+
+def insertadas_de(notificaciones, error=None):
+    """Las notificaciones de un insert_many que sí se guardaron (descarta las del BulkWriteError)"""
+    if error is None:
+        return notificaciones
+    fallidas = {e["index"] for e in error.details.get("writeErrors", [])}
+    return [n for i, n in enumerate(notificaciones) if i not in fallidas]
+
+
+def pendientes_desde(db, usuario_id, ultimo_id):
+    """
+    Notificaciones del usuario desde `ultimo_id`, en orden (fecha_creacion, _id).
+
+    No se reanuda con `_id > ultimo_id`: los ObjectId de réplicas distintas no
+    están ordenados entre sí. Se parte de la fecha de creación de la última
+    enviada menos SOLAPE_REENVIO_SEGUNDOS, así lo guardado tarde por otro
+    escritor también se reenvía; lo que el cliente ya tenía lo descarta por id.
+    """
+    if not ultimo_id or not ObjectId.is_valid(ultimo_id):
+        return []
+    ultimo_id = ObjectId(ultimo_id)
+    ultima = db.notificaciones.find_one({"_id": ultimo_id, "usuario_id": usuario_id}, {"fecha_creacion": 1})
+    # Si ya se compactó, la fecha sale del propio ObjectId
+    fecha = ultima["fecha_creacion"] if ultima else ultimo_id.generation_time.replace(tzinfo=None)
+    return list(db.notificaciones.find({
+        "usuario_id": usuario_id,
+        "fecha_creacion": {"$gte": fecha - timedelta(seconds=SOLAPE_REENVIO_SEGUNDOS)},
+        "_id": {"$ne": ultimo_id},
+    }).sort([("fecha_creacion", 1), ("_id", 1)]).limit(MAX_REENVIO))
+
+
+def _evento_sse(notificacion):
+    datos = {
+        "id": str(notificacion["_id"]),
+        "usuario_id": notificacion["usuario_id"],
+        "tipo": notificacion["tipo"],
+        "mensaje": notificacion["mensaje"],
+        "reserva_id": notificacion.get("reserva_id"),
+        "leida": notificacion.get("leida", False),
+        "fecha_creacion": notificacion["fecha_creacion"].isoformat(),
+    }
+    return f"id: {datos['id']}\nevent: notificacion\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+async def eventos_sse(db, suscripcion, ultimo_id=None, latido_segundos=15):
+    """
+    Flujo Server-Sent Events de una suscripción.
+
+    Primero reenvía desde la base lo creado desde `ultimo_id` (Last-Event-ID),
+    con el solape de pendientes_desde, y luego lo que llega en vivo, descartando
+    lo ya enviado por esta conexión. Lo enviado se reconoce por id en un
+    conjunto acotado, no comparando ObjectIds: los de réplicas distintas no
+    están ordenados entre sí. Un comentario de latido cada
+    `latido_segundos` mantiene viva la conexión a través de proxies.
+    """
+    enviadas = set()
+    orden = deque()
+
+    def recordar(notificacion_id):
+        enviadas.add(notificacion_id)
+        orden.append(notificacion_id)
+        if len(orden) > RECORDADAS_POR_CONEXION:
+            enviadas.discard(orden.popleft())
+
+    try:
+        yield "retry: 3000\n\n"
+        if ultimo_id and ObjectId.is_valid(ultimo_id):
+            recordar(ObjectId(ultimo_id))
+        for notificacion in await asyncio.to_thread(pendientes_desde, db, suscripcion.usuario_id, ultimo_id):
+            recordar(notificacion["_id"])
+            yield _evento_sse(notificacion)
+
+        while not suscripcion.desbordada:
+            try:
+                notificacion = await asyncio.wait_for(suscripcion.cola.get(), timeout=latido_segundos)
+            except asyncio.TimeoutError:
+                yield ": latido\n\n"
+                continue
+            if notificacion["_id"] in enviadas:
+                continue
+            recordar(notificacion["_id"])
+            yield _evento_sse(notificacion)
+        # Desbordada: al cerrar, el cliente reconecta con su último id y recupera lo perdido
+    finally:
+        difusor.cancelar(suscripcion)
+
+
+difusor = Difusor()
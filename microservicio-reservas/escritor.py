@@ -0,0 +1,164 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from pymongo.errors import BulkWriteError
+
+from database import get_database, despues_de_insertar
+from difusion import insertadas_de
+
+# Cola acotada: al llenarse, quien encola espera a que se libere espacio
+ESCRITOR_COLA_MAX = int(os.getenv("NOTIFICACIONES_COLA_MAX", "10000"))
+# Un lote se escribe al juntar ESCRITOR_LOTE notificaciones o al pasar ESCRITOR_INTERVALO_MS desde la primera
+ESCRITOR_LOTE = int(os.getenv("NOTIFICACIONES_LOTE", "500"))
+ESCRITOR_INTERVALO_MS = int(os.getenv("NOTIFICACIONES_INTERVALO_MS", "50"))
+# Intentos por lote antes de descartarlo y tiempo máximo de vaciado al apagar
+ESCRITOR_REINTENTOS = 3
+ESCRITOR_VACIADO_SEGUNDOS = 10
+
+
+def guardar_lote(notificaciones, aplicadas=None):
+    """
+    Inserta un lote de notificaciones y actualiza contadores y difusión.
+
+    Los _id se asignan antes del primer intento, así que un reintento tras una
+    escritura parcial choca con lo ya guardado (código 11000) y no duplica nada.
+    Un 11000 puede venir de un intento anterior o de un evento_id repetido: se
+    consulta qué _id del lote ya están en la base, y esos cuentan como propios.
+    `aplicadas` guarda entre intentos los _id cuyos efectos ya se aplicaron, así
+    un reintento completa lo que quedó a medias sin contar nada dos veces.
+    Devuelve a cuántas se les aplicaron los efectos en esta llamada.
+    """
+    aplicadas = set() if aplicadas is None else aplicadas
+    db = get_database()
+    try:
+        db.notificaciones.insert_many(notificaciones, ordered=False)
+        guardadas = notificaciones
+    except BulkWriteError as e:
+        errores = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errores):
+            raise
+        chocadas = [notificaciones[error["index"]]["_id"] for error in errores]
+        nuestras = {n["_id"] for n in db.notificaciones.find({"_id": {"$in": chocadas}}, {"_id": 1})}
+        guardadas = insertadas_de(notificaciones, e) + [n for n in notificaciones if n["_id"] in nuestras]
+    pendientes = [n for n in guardadas if n["_id"] not in aplicadas]
+    despues_de_insertar(db, pendientes)
+    aplicadas.update(n["_id"] for n in pendientes)
+    return len(pendientes)
+
+
+class EscritorNotificaciones:
+    """
+    Escritura diferida y por lotes de las notificaciones de la API.
+
+    Los endpoints encolan el documento ya construido y responden sin esperar a
+    MongoDB; una tarea de fondo junta lo encolado y lo guarda con un insert_many
+    en un hilo aparte. La cola es acotada: si la base no da abasto, `encolar`
+    espera a que haya lugar en vez de acumular memoria sin límite. Si la tarea
+    no está en marcha (scripts, pruebas) se escribe en el momento.
+    """
+
+    def __init__(self):
+        self._cola = None
+        self._tarea = None
+        self._latencias_ms = deque(maxlen=500)
+        self.metricas = {
+            "encoladas": 0,
+            "escritas": 0,
+            "lotes": 0,
+            "esperas_cola_llena": 0,
+            "max_profundidad": 0,
+            "errores": 0,
+            "descartadas": 0,
+        }
+
+    def iniciar(self):
+        self._cola = asyncio.Queue(maxsize=ESCRITOR_COLA_MAX)
+        self._tarea = asyncio.create_task(self._ejecutar())
+
+    async def encolar(self, notificacion):
+        """Agrega una notificación a la cola; solo espera si la cola está llena"""
+        if self._tarea is None or self._tarea.done():
+            await asyncio.to_thread(guardar_lote, [notificacion])
+            return
+        if self._cola.full():
+            self.metricas["esperas_cola_llena"] += 1
+        await self._cola.put(notificacion)
+        self.metricas["encoladas"] += 1
+        self.metricas["max_profundidad"] = max(self.metricas["max_profundidad"], self._cola.qsize())
+
+    async def _juntar_lote(self):
+        lote = [await self._cola.get()]
+        limite = time.monotonic() + ESCRITOR_INTERVALO_MS / 1000
+        while len(lote) < ESCRITOR_LOTE:
+            # Lo que ya está en la cola se toma sin esperar
+            while len(lote) < ESCRITOR_LOTE and not self._cola.empty():
+                lote.append(self._cola.get_nowait())
+            restante = limite - time.monotonic()
+            if len(lote) >= ESCRITOR_LOTE or restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self._cola.get(), timeout=restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _escribir(self, lote):
+        # Compartido entre intentos: un fallo después de insertar no repite ni pierde efectos
+        aplicadas = set()
+        for intento in range(1, ESCRITOR_REINTENTOS + 1):
+            inicio = time.perf_counter()
+            try:
+                await asyncio.to_thread(guardar_lote, lote, aplicadas)
+            except Exception as e:
+                self.metricas["errores"] += 1
+                print(f"❌ Error guardando lote de {len(lote)} notificaciones (intento {intento}): {e}")
+                await asyncio.sleep(0.5 * intento)
+                continue
+            self._latencias_ms.append((time.perf_counter() - inicio) * 1000)
+            self.metricas["escritas"] += len(aplicadas)
+            self.metricas["lotes"] += 1
+            return
+        self.metricas["escritas"] += len(aplicadas)
+        self.metricas["descartadas"] += len(lote) - len(aplicadas)
+
+    async def _ejecutar(self):
+        while True:
+            lote = await self._juntar_lote()
+            try:
+                await self._escribir(lote)
+            finally:
+                for _ in lote:
+                    self._cola.task_done()
+
+    async def cerrar(self):
+        """Al apagar: espera a que se guarde lo encolado y detiene la tarea"""
+        if self._tarea is None:
+            return
+        pendientes = self._cola.qsize()
+        try:
+            await asyncio.wait_for(self._cola.join(), timeout=ESCRITOR_VACIADO_SEGUNDOS)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Apagado con {self._cola.qsize()} notificaciones sin guardar")
+        self._tarea.cancel()
+        self._tarea = None
+        if pendientes:
+            print(f"✅ {pendientes} notificaciones pendientes guardadas al apagar")
+
+    def estado(self):
+        latencias = sorted(self._latencias_ms)
+        return {
+            "activo": self._tarea is not None and not self._tarea.done(),
+            "profundidad": self._cola.qsize() if self._cola else 0,
+            "capacidad": ESCRITOR_COLA_MAX,
+            "lote_max": ESCRITOR_LOTE,
+            "intervalo_ms": ESCRITOR_INTERVALO_MS,
+            **self.metricas,
+            "tamanio_medio_lote": round(self.metricas["escritas"] / self.metricas["lotes"], 1) if self.metricas["lotes"] else 0,
+            "escritura_p50_ms": round(latencias[len(latencias) // 2], 2) if latencias else None,
+            "escritura_p95_ms": round(latencias[min(int(len(latencias) * 0.95), len(latencias) - 1)], 2) if latencias else None,
+        }
+
+
+escritor = EscritorNotificaciones()
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
@@ -6,10 +7,27 @@ from datetime import datetime, timedelta
 from enum import Enum
 import asyncio
 from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 # Importar nuestros módulos de MongoDB
-from database import get_database, initialize_database, calcular_fecha_vencimiento, verificar_reserva_activa, crear_notificacion
+from database import get_database, conectar, cerrar_conexion, estado_pool, initialize_database, calcular_fecha_vencimiento, construir_notificacion
+from database import (
+    despues_de_insertar, descontar_leidas, contar_no_leidas, pagina_notificaciones,
+    PAGINA_POR_DEFECTO, PAGINA_MAXIMA,
+)
 from models import EstadoReserva, TipoNotificacion, ReservaDocument
+from vencimientos import barrer_reservas_vencidas, historial_barridos
+from programador import programador, liberar_liderazgo
+from difusion import difusor, eventos_sse, insertadas_de
+from escritor import escritor
+from retencion import (
+    POLITICA_RETENCION, aplicar_indices_ttl, compactar_notificaciones, tamanio_coleccion,
+    resumenes_usuario, tarea_retencion, historial_compactaciones,
+)
+from cola import (
+    siguiente_secuencia, longitud_cola, posicion_en_cola, estimar_espera,
+    registrar_devolucion, promover_siguiente, registrar_baja,
+)
 
 app = FastAPI(title="Microservicio de Reservas")
 
@@ -50,72 +68,68 @@ class NotificacionResponse(BaseModel):
     leida: bool
     fecha_creacion: datetime
 
-# Tarea en segundo plano para verificar reservas vencidas
-async def verificar_reservas_vencidas():
-    """Tarea periódica para verificar y actualizar reservas vencidas"""
-    while True:
-        try:
-            db = get_database()
-            fecha_actual = datetime.utcnow()
-            
-            # Buscar reservas activas que hayan vencido
-            reservas_vencidas = db.reservas.find({
-                "estado": EstadoReserva.ACTIVA,
-                "fecha_vencimiento": {"$lt": fecha_actual}
-            })
-            
-            for reserva in reservas_vencidas:
-                # Actualizar estado a vencida
-                db.reservas.update_one(
-                    {"_id": reserva["_id"]},
-                    {"$set": {"estado": EstadoReserva.VENCIDA, "notificado": True}}
-                )
-                
-                # Crear notificación de vencimiento
-                crear_notificacion(
-                    db,
-                    reserva["usuario_id"],
-                    TipoNotificacion.VENCIMIENTO,
-                    f"Tu reserva del libro ID {reserva['libro_id']} ha vencido",
-                    str(reserva["_id"])
-                )
-                
-                print(f"📅 Reserva {reserva['_id']} marcada como vencida")
-            
-            await asyncio.sleep(3600)  # Verificar cada hora
-            
-        except Exception as e:
-            print(f"Error en verificación de reservas vencidas: {e}")
-            await asyncio.sleep(300)
+class PaginaNotificaciones(BaseModel):
+    items: List[NotificacionResponse]
+    siguiente_cursor: Optional[str] = None
+    no_leidas: int = 0
+
+class MarcarLeidas(BaseModel):
+    usuario_id: int
+    ids: Optional[List[str]] = None
+    todas: bool = False
+
+class EventoPrestamo(BaseModel):
+    id: int
+    tipo: str
+    prestamo_id: int
+    usuario_id: int
+    libro_id: int
+    fecha: Optional[datetime] = None
+
+class LoteEventosPrestamo(BaseModel):
+    eventos: List[EventoPrestamo]
 
 # Inicializar base de datos al iniciar
 @app.on_event("startup")
 async def startup_event():
     print("🚀 Inicializando microservicio de reservas con MongoDB...")
+    # Cliente compartido por todas las peticiones y tareas del proceso
+    conectar()
     initialize_database()
+    # Índices TTL por tipo de notificación según la política de retención
+    aplicar_indices_ttl(get_database())
+    # Notificaciones en vivo: change stream si hay replica set, si no publicación local
+    difusor.iniciar(get_database())
+    # Notificaciones de la API: cola acotada que se guarda por lotes
+    escritor.iniciar()
     print("✅ Base de datos de reservas lista")
     
-    # Iniciar tarea en segundo plano
-    asyncio.create_task(verificar_reservas_vencidas())
+    # Vencimientos a su hora con un heap de temporizadores (solo en la réplica líder)
+    app.state.tarea_vencidas = asyncio.create_task(programador.ejecutar())
+    # Resúmenes mensuales de las notificaciones antiguas
+    app.state.tarea_retencion = asyncio.create_task(tarea_retencion())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.tarea_vencidas.cancel()
+    app.state.tarea_retencion.cancel()
+    await escritor.cerrar()
+    difusor.detener()
+    if programador.es_lider:
+        liberar_liderazgo()
+    cerrar_conexion()
 
 @app.get("/")
 async def root():
     return {"message": "Microservicio de Reservas funcionando con MongoDB"}
 
 @app.post("/reservas", response_model=ReservaResponse)
-async def crear_reserva(reserva_data: ReservaCreate, background_tasks: BackgroundTasks):
+async def crear_reserva(reserva_data: ReservaCreate):
     db = get_database()
     
     try:
         print(f"📝 Creando reserva para usuario {reserva_data.usuario_id}, libro {reserva_data.libro_id}")
         
-        # Verificar si ya existe una reserva activa para el mismo libro y usuario
-        if verificar_reserva_activa(db, reserva_data.usuario_id, reserva_data.libro_id):
-            raise HTTPException(
-                status_code=400, 
-                detail="Ya tienes una reserva activa para este libro"
-            )
-        
         # Calcular fecha de vencimiento
         fecha_vencimiento = calcular_fecha_vencimiento(reserva_data.dias_reserva)
         
@@ -129,31 +143,42 @@ async def crear_reserva(reserva_data: ReservaCreate, background_tasks: Backgroun
         # Convertir a dict y agregar campo notificado
         reserva_dict = reserva_doc.to_dict()
         reserva_dict["notificado"] = False
+        # Puesto de llegada en la fila del libro
+        reserva_dict["secuencia"] = siguiente_secuencia(db, reserva_data.libro_id)
         
-        result = db.reservas.insert_one(reserva_dict)
-        
-        # Obtener la reserva creada
-        reserva_creada = db.reservas.find_one({"_id": result.inserted_id})
+        # El índice único parcial (usuario_id, libro_id) con estado activa rechaza
+        # la segunda reserva aunque lleguen dos peticiones a la vez
+        try:
+            result = db.reservas.insert_one(reserva_dict)
+        except DuplicateKeyError:
+            # La secuencia ya se entregó: cuenta como salida para no dejar un hueco en la fila
+            registrar_baja(db, reserva_data.libro_id, reserva_dict["secuencia"])
+            raise HTTPException(
+                status_code=400, 
+                detail="Ya tienes una reserva activa para este libro"
+            )
+        programador.programar(str(result.inserted_id), fecha_vencimiento)
         
-        # Crear notificación de reserva exitosa
-        crear_notificacion(
-            db,
+        # La notificación se guarda por lotes en segundo plano
+        await escritor.encolar(construir_notificacion(
             reserva_data.usuario_id,
             TipoNotificacion.RECORDATORIO,
             f"Reserva creada exitosamente para el libro ID {reserva_data.libro_id}. Vence el {fecha_vencimiento.strftime('%d/%m/%Y')}",
             str(result.inserted_id)
-        )
+        ))
         
         print(f"✅ Reserva creada exitosamente: {result.inserted_id}")
         
+        # La respuesta sale del documento insertado, sin volver a leerlo
         return {
-            "id": str(reserva_creada["_id"]),
-            "usuario_id": reserva_creada["usuario_id"],
-            "libro_id": reserva_creada["libro_id"],
-            "fecha_reserva": reserva_creada["fecha_reserva"],
-            "fecha_vencimiento": reserva_creada["fecha_vencimiento"],
-            "estado": reserva_creada["estado"],
-            "notificado": reserva_creada["notificado"]
+            "id": str(result.inserted_id),
+            "usuario_id": reserva_dict["usuario_id"],
+            "libro_id": reserva_dict["libro_id"],
+            "fecha_reserva": reserva_dict["fecha_reserva"],
+            "fecha_vencimiento": reserva_dict["fecha_vencimiento"],
+            "estado": reserva_dict["estado"],
+            "created_at": reserva_dict["created_at"],
+            "notificado": reserva_dict["notificado"]
         }
         
     except HTTPException:
@@ -181,6 +206,21 @@ async def listar_reservas():
         for reserva in reservas
     ]
 
+@app.post("/reservas/vencidas/barrer")
+async def ejecutar_barrido_reservas():
+    """Ejecuta el barrido de reservas vencidas en el momento"""
+    return await asyncio.to_thread(barrer_reservas_vencidas)
+
+@app.get("/reservas/vencidas/barridos")
+async def listar_barridos_reservas():
+    """Últimas ejecuciones del barrido con filas afectadas y duración"""
+    return list(historial_barridos)
+
+@app.get("/reservas/vencidas/programador")
+async def estado_programador():
+    """Temporizadores pendientes, liderazgo y retraso máximo de disparo"""
+    return programador.estado()
+
 @app.get("/reservas/usuario/{usuario_id}", response_model=List[ReservaResponse])
 async def obtener_reservas_usuario(usuario_id: int):
     db = get_database()
@@ -226,6 +266,46 @@ async def obtener_reserva(reserva_id: str):
     except Exception as e:
         raise HTTPException(status_code=400, detail="ID de reserva inválido")
 
+@app.get("/reservas/{reserva_id}/posicion")
+async def obtener_posicion_reserva(reserva_id: str):
+    """Puesto en la fila del libro, largo de la fila y espera estimada"""
+    db = get_database()
+    
+    if not ObjectId.is_valid(reserva_id):
+        raise HTTPException(status_code=400, detail="ID de reserva inválido")
+    reserva = db.reservas.find_one({"_id": ObjectId(reserva_id)}, {"libro_id": 1, "estado": 1, "secuencia": 1})
+    if not reserva:
+        raise HTTPException(status_code=404, detail="Reserva no encontrada")
+    if reserva["estado"] != EstadoReserva.ACTIVA or "secuencia" not in reserva:
+        raise HTTPException(status_code=400, detail="La reserva no está en la fila")
+    
+    posicion = posicion_en_cola(db, reserva)
+    return {
+        "reserva_id": reserva_id,
+        "libro_id": reserva["libro_id"],
+        "posicion": posicion,
+        "longitud": longitud_cola(db, reserva["libro_id"]),
+        **estimar_espera(db, reserva["libro_id"], posicion),
+    }
+
+@app.get("/colas/libros/{libro_id}")
+async def obtener_cola_libro(libro_id: int):
+    """Largo de la fila de un libro, quién sigue y espera estimada para quien se sume ahora"""
+    db = get_database()
+    
+    longitud = longitud_cola(db, libro_id)
+    cabeza = db.reservas.find_one(
+        {"libro_id": libro_id, "estado": EstadoReserva.ACTIVA.value},
+        {"usuario_id": 1},
+        sort=[("secuencia", 1)]
+    )
+    return {
+        "libro_id": libro_id,
+        "longitud": longitud,
+        "siguiente_usuario_id": cabeza["usuario_id"] if cabeza else None,
+        **estimar_espera(db, libro_id, longitud + 1),
+    }
+
 @app.post("/reservas/{reserva_id}/cancelar")
 async def cancelar_reserva(reserva_id: str):
     db = get_database()
@@ -243,15 +323,16 @@ async def cancelar_reserva(reserva_id: str):
             {"_id": ObjectId(reserva_id)},
             {"$set": {"estado": EstadoReserva.CANCELADA, "notificado": True}}
         )
+        registrar_baja(db, reserva["libro_id"], reserva.get("secuencia"))
+        programador.cancelar(reserva_id)
         
         # Crear notificación de cancelación
-        crear_notificacion(
-            db,
+        await escritor.encolar(construir_notificacion(
             reserva["usuario_id"],
             TipoNotificacion.CANCELACION,
             f"Tu reserva del libro ID {reserva['libro_id']} ha sido cancelada",
             reserva_id
-        )
+        ))
         
         print(f"✅ Reserva {reserva_id} cancelada exitosamente")
         
@@ -261,43 +342,181 @@ async def cancelar_reserva(reserva_id: str):
         print(f"❌ Error cancelando reserva: {str(e)}")
         raise HTTPException(status_code=400, detail="ID de reserva inválido")
 
+# EVENTOS DEL MICROSERVICIO DE PRÉSTAMOS
+@app.post("/eventos/prestamos")
+async def procesar_eventos_prestamos(lote: LoteEventosPrestamo):
+    """
+    Entrega cada ejemplar devuelto al primero en la fila del libro y le avisa.
+
+    Cada notificación lleva el id del evento y un índice único (evento_id,
+    usuario_id) descarta las entregas repetidas de la outbox.
+    """
+    db = get_database()
+    notificaciones = []
+    
+    for evento in lote.eventos:
+        if evento.tipo != "prestamo_devuelto":
+            continue
+        
+        registrar_devolucion(db, evento.libro_id, evento.id, evento.fecha or datetime.utcnow())
+        reserva = promover_siguiente(db, evento.libro_id, evento.id)
+        if not reserva:
+            continue
+        programador.cancelar(str(reserva["_id"]))
+        
+        notificacion = construir_notificacion(
+            reserva["usuario_id"],
+            TipoNotificacion.DISPONIBLE,
+            f"El libro ID {evento.libro_id} que reservaste ya está disponible",
+            str(reserva["_id"])
+        )
+        notificacion["evento_id"] = evento.id
+        notificaciones.append(notificacion)
+    
+    if not notificaciones:
+        return {"notificaciones_creadas": 0}
+    
+    try:
+        result = db.notificaciones.insert_many(notificaciones, ordered=False)
+        creadas = len(result.inserted_ids)
+        despues_de_insertar(db, notificaciones)
+    except BulkWriteError as e:
+        # Los duplicados (código 11000) son eventos ya procesados; cualquier otro error se propaga
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        creadas = e.details["nInserted"]
+        despues_de_insertar(db, insertadas_de(notificaciones, e))
+    
+    return {"notificaciones_creadas": creadas}
+
 # NUEVOS ENDPOINTS PARA NOTIFICACIONES
-@app.get("/notificaciones/usuario/{usuario_id}", response_model=List[NotificacionResponse])
-async def obtener_notificaciones_usuario(usuario_id: int):
+@app.get("/notificaciones/usuario/{usuario_id}", response_model=PaginaNotificaciones)
+async def obtener_notificaciones_usuario(
+    usuario_id: int,
+    solo_no_leidas: bool = Query(False, description="Solo notificaciones sin leer"),
+    cursor: Optional[str] = Query(None, description="Cursor devuelto por la página anterior"),
+    limite: int = Query(PAGINA_POR_DEFECTO, ge=1, le=PAGINA_MAXIMA),
+):
     db = get_database()
     
-    notificaciones = db.notificaciones.find({"usuario_id": usuario_id}).sort("fecha_creacion", -1)
+    try:
+        notificaciones, siguiente = pagina_notificaciones(db, usuario_id, solo_no_leidas, cursor, limite)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
     
-    return [
-        {
-            "id": str(notif["_id"]),
-            "usuario_id": notif["usuario_id"],
-            "tipo": notif["tipo"],
-            "mensaje": notif["mensaje"],
-            "reserva_id": notif.get("reserva_id"),
-            "leida": notif["leida"],
-            "fecha_creacion": notif["fecha_creacion"]
-        }
-        for notif in notificaciones
-    ]
+    return {
+        "items": [
+            {
+                "id": str(notif["_id"]),
+                "usuario_id": notif["usuario_id"],
+                "tipo": notif["tipo"],
+                "mensaje": notif["mensaje"],
+                "reserva_id": notif.get("reserva_id"),
+                "leida": notif["leida"],
+                "fecha_creacion": notif["fecha_creacion"]
+            }
+            for notif in notificaciones
+        ],
+        "siguiente_cursor": siguiente,
+        "no_leidas": contar_no_leidas(db, usuario_id),
+    }
+
+@app.get("/notificaciones/usuario/{usuario_id}/resumenes")
+async def obtener_resumenes_usuario(usuario_id: int, meses: int = Query(12, ge=1, le=120)):
+    """Conteos mensuales por tipo de las notificaciones ya compactadas"""
+    db = get_database()
+    return {"usuario_id": usuario_id, "resumenes": resumenes_usuario(db, usuario_id, meses)}
+
+@app.get("/notificaciones/usuario/{usuario_id}/no-leidas")
+async def obtener_no_leidas(usuario_id: int, exacto: bool = False):
+    """Contador de no leídas para el distintivo de la interfaz; `exacto` recuenta y corrige"""
+    db = get_database()
+    return {"usuario_id": usuario_id, "no_leidas": contar_no_leidas(db, usuario_id, exacto)}
+
+@app.get("/notificaciones/usuario/{usuario_id}/stream")
+async def stream_notificaciones(usuario_id: int, request: Request, desde: Optional[str] = None):
+    """
+    Notificaciones nuevas en vivo (Server-Sent Events).
+    
+    Al reconectar, el navegador manda Last-Event-ID y se reenvía lo perdido;
+    `desde` permite lo mismo a clientes que no usan EventSource. El reenvío
+    repasa SOLAPE_REENVIO_SEGUNDOS hacia atrás: el cliente descarta por id
+    las que ya tenía.
+    """
+    suscripcion = difusor.suscribir(usuario_id)
+    if suscripcion is None:
+        raise HTTPException(status_code=503, detail="Demasiadas conexiones en vivo, reintenta más tarde")
+    
+    ultimo_id = request.headers.get("last-event-id") or desde
+    return StreamingResponse(
+        eventos_sse(get_database(), suscripcion, ultimo_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/notificaciones/stream/estado")
+async def estado_stream_notificaciones():
+    """Conexiones en vivo, fuente de eventos y métricas de entrega"""
+    return difusor.estado()
+
+@app.get("/notificaciones/retencion")
+async def estado_retencion():
+    """Política por tipo, tamaño actual de la colección y últimas compactaciones"""
+    db = get_database()
+    return {
+        "politica": POLITICA_RETENCION,
+        "tamanio": await asyncio.to_thread(tamanio_coleccion, db),
+        "resumenes": await asyncio.to_thread(tamanio_coleccion, db, "resumenes_notificaciones"),
+        "compactaciones": list(historial_compactaciones),
+    }
+
+@app.post("/notificaciones/retencion/compactar")
+async def compactar_notificaciones_ahora():
+    """Pasa ya a resúmenes mensuales lo que superó el plazo de su tipo; informa tamaño antes y después"""
+    return await asyncio.to_thread(compactar_notificaciones)
+
+@app.get("/notificaciones/escritor/estado")
+async def estado_escritor_notificaciones():
+    """Profundidad de la cola de escritura, tamaño de lote y latencia de cada insert_many"""
+    return escritor.estado()
+
+@app.post("/notificaciones/leer")
+async def marcar_notificaciones_leidas(datos: MarcarLeidas):
+    """Marca como leídas varias notificaciones de un usuario, o todas, con un solo update_many"""
+    db = get_database()
+    
+    filtro = {"usuario_id": datos.usuario_id, "leida": False}
+    if not datos.todas:
+        if not datos.ids:
+            raise HTTPException(status_code=400, detail="Indica ids o todas=true")
+        if not all(ObjectId.is_valid(i) for i in datos.ids):
+            raise HTTPException(status_code=400, detail="ID de notificación inválido")
+        filtro["_id"] = {"$in": [ObjectId(i) for i in datos.ids]}
+    
+    result = db.notificaciones.update_many(filtro, {"$set": {"leida": True, "fecha_lectura": datetime.utcnow()}})
+    descontar_leidas(db, datos.usuario_id, result.modified_count)
+    
+    return {"marcadas": result.modified_count, "no_leidas": contar_no_leidas(db, datos.usuario_id)}
 
 @app.post("/notificaciones/{notificacion_id}/leer")
 async def marcar_notificacion_leida(notificacion_id: str):
     db = get_database()
     
-    try:
-        result = db.notificaciones.update_one(
-            {"_id": ObjectId(notificacion_id)},
-            {"$set": {"leida": True}}
-        )
-        
-        if result.modified_count == 0:
-            raise HTTPException(status_code=404, detail="Notificación no encontrada")
-        
-        return {"message": "Notificación marcada como leída"}
-        
-    except Exception as e:
+    if not ObjectId.is_valid(notificacion_id):
         raise HTTPException(status_code=400, detail="ID de notificación inválido")
+    
+    # Solo descuenta del contador si la notificación estaba sin leer
+    notificacion = db.notificaciones.find_one_and_update(
+        {"_id": ObjectId(notificacion_id), "leida": False},
+        {"$set": {"leida": True, "fecha_lectura": datetime.utcnow()}},
+        projection={"usuario_id": 1}
+    )
+    if notificacion:
+        descontar_leidas(db, notificacion["usuario_id"], 1)
+    elif not db.notificaciones.find_one({"_id": ObjectId(notificacion_id)}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Notificación no encontrada")
+    
+    return {"message": "Notificación marcada como leída"}
 
 @app.get("/health")
 async def health_check():
@@ -315,13 +534,17 @@ async def health_check():
             "service": "reservas", 
             "database": "MongoDB",
             "total_reservas": total_reservas,
-            "reservas_activas": reservas_activas
+            "reservas_activas": reservas_activas,
+            "pool": estado_pool(),
+            "escritor_notificaciones": escritor.estado()["profundidad"]
         }
     except Exception as e:
         return {
             "status": "unhealthy",
             "service": "reservas", 
-            "error": str(e)
+            "error": str(e),
+            "pool": estado_pool(),
+            "escritor_notificaciones": escritor.estado()["profundidad"]
         }
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+import asyncio
+import heapq
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from database import get_database
+from models import EstadoReserva
+from vencimientos import barrer_reservas_vencidas, expirar_reservas
+
+# Solo se mantienen en memoria los vencimientos de esta ventana; el resto se
+# carga en las recargas periódicas
+PROGRAMADOR_HORIZONTE_SEGUNDOS = int(os.getenv("PROGRAMADOR_HORIZONTE", "1800"))
+PROGRAMADOR_RECARGA_SEGUNDOS = int(os.getenv("PROGRAMADOR_RECARGA", "300"))
+# Concesión de liderazgo: solo una réplica dispara vencimientos
+LIDER_TTL_SEGUNDOS = int(os.getenv("PROGRAMADOR_LIDER_TTL", "30"))
+LIDER_CLAVE = "vencimientos_reservas"
+INSTANCIA_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _timestamp(fecha: datetime) -> float:
+    # Las fechas en Mongo son UTC sin zona
+    return fecha.replace(tzinfo=timezone.utc).timestamp()
+
+
+def renovar_liderazgo():
+    """
+    Toma o renueva la concesión de liderazgo; devuelve si esta instancia es líder.
+
+    La concesión es un documento con dueño y expiración. Solo se puede tomar si
+    ya es propia o si venció; si otra réplica la tiene vigente, el upsert choca
+    con el _id existente y esta instancia queda como seguidora.
+    """
+    db = get_database()
+    ahora = datetime.utcnow()
+    try:
+        db.lideres.find_one_and_update(
+            {"_id": LIDER_CLAVE, "$or": [{"duenio": INSTANCIA_ID}, {"expira": {"$lt": ahora}}]},
+            {"$set": {"duenio": INSTANCIA_ID, "expira": ahora + timedelta(seconds=LIDER_TTL_SEGUNDOS)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def liberar_liderazgo():
+    """Suelta la concesión al apagar para que otra réplica la tome sin esperar el TTL"""
+    get_database().lideres.delete_one({"_id": LIDER_CLAVE, "duenio": INSTANCIA_ID})
+
+
+def cargar_ventana(hasta: datetime):
+    """Reservas activas que vencen antes de `hasta`, por el índice de fecha_vencimiento"""
+    return [
+        (str(r["_id"]), r["fecha_vencimiento"])
+        for r in get_database().reservas.find(
+            {"estado": EstadoReserva.ACTIVA.value, "fecha_vencimiento": {"$lt": hasta}},
+            {"fecha_vencimiento": 1},
+        )
+    ]
+
+
+class ProgramadorVencimientos:
+    """
+    Min-heap de vencimientos de reservas que dispara cada uno a su hora.
+
+    El heap guarda (instante, reserva_id). Cancelar no recorre el heap: quita la
+    reserva de `vigentes` y la entrada vieja se descarta al salir. Entre eventos
+    la tarea duerme hasta el próximo vencimiento, así el costo en reposo es nulo.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._vigentes = {}
+        self._despertar = None
+        self._proxima_recarga = 0.0
+        self._proxima_renovacion = 0.0
+        self.es_lider = False
+        self.metricas = {
+            "disparadas": 0,
+            "vencidas": 0,
+            "notificaciones": 0,
+            "retraso_max_ms": 0.0,
+            "ultima_recarga": None,
+        }
+
+    def programar(self, reserva_id: str, fecha_vencimiento: datetime):
+        """Agrega o mueve el temporizador de una reserva (al crearla)"""
+        if not self.es_lider:
+            return
+        instante = _timestamp(fecha_vencimiento)
+        if instante > time.time() + PROGRAMADOR_HORIZONTE_SEGUNDOS:
+            return  # Entrará en una recarga posterior
+        proximo = self._heap[0][0] if self._heap else None
+        self._vigentes[reserva_id] = instante
+        heapq.heappush(self._heap, (instante, reserva_id))
+        if self._despertar is not None and (proximo is None or instante < proximo):
+            self._despertar.set()
+
+    def cancelar(self, reserva_id: str):
+        """Descarta el temporizador de una reserva (al cancelarla o cumplirla)"""
+        self._vigentes.pop(reserva_id, None)
+
+    def _reemplazar(self, entradas):
+        self._vigentes = {reserva_id: _timestamp(fecha) for reserva_id, fecha in entradas}
+        self._heap = [(instante, reserva_id) for reserva_id, instante in self._vigentes.items()]
+        heapq.heapify(self._heap)
+
+    def _extraer_vencidos(self, ahora: float):
+        vencidos = []
+        while self._heap and self._heap[0][0] <= ahora:
+            instante, reserva_id = heapq.heappop(self._heap)
+            # Entradas de reservas canceladas o reprogramadas
+            if self._vigentes.get(reserva_id) != instante:
+                continue
+            del self._vigentes[reserva_id]
+            vencidos.append(reserva_id)
+            self.metricas["retraso_max_ms"] = max(self.metricas["retraso_max_ms"], (ahora - instante) * 1000)
+        return vencidos
+
+    async def _recargar(self):
+        # Recupera lo vencido mientras nadie era líder y notificaciones pendientes
+        await asyncio.to_thread(barrer_reservas_vencidas)
+        hasta = datetime.utcnow() + timedelta(seconds=PROGRAMADOR_HORIZONTE_SEGUNDOS)
+        self._reemplazar(await asyncio.to_thread(cargar_ventana, hasta))
+        self.metricas["ultima_recarga"] = datetime.utcnow()
+        self._proxima_recarga = time.monotonic() + PROGRAMADOR_RECARGA_SEGUNDOS
+
+    async def ejecutar(self):
+        """Bucle principal: liderazgo, recargas y disparo de vencimientos"""
+        self._despertar = asyncio.Event()
+        while True:
+            try:
+                if time.monotonic() >= self._proxima_renovacion:
+                    era_lider = self.es_lider
+                    self.es_lider = await asyncio.to_thread(renovar_liderazgo)
+                    self._proxima_renovacion = time.monotonic() + LIDER_TTL_SEGUNDOS / 3
+                    if self.es_lider and not era_lider:
+                        print(f"👑 {INSTANCIA_ID} dispara los vencimientos de reservas")
+                        self._proxima_recarga = 0.0
+                    elif not self.es_lider:
+                        self._reemplazar([])
+
+                if self.es_lider:
+                    if time.monotonic() >= self._proxima_recarga:
+                        await self._recargar()
+                    vencidos = self._extraer_vencidos(time.time())
+                    if vencidos:
+                        marcadas, notificaciones = await asyncio.to_thread(
+                            expirar_reservas, [ObjectId(r) for r in vencidos]
+                        )
+                        self.metricas["disparadas"] += len(vencidos)
+                        self.metricas["vencidas"] += marcadas
+                        self.metricas["notificaciones"] += notificaciones
+
+                espera = self._proxima_renovacion - time.monotonic()
+                if self.es_lider:
+                    espera = min(espera, self._proxima_recarga - time.monotonic())
+                    if self._heap:
+                        espera = min(espera, self._heap[0][0] - time.time())
+                self._despertar.clear()
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), timeout=max(espera, 0))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error en programador de vencimientos: {e}")
+                await asyncio.sleep(5)
+
+    def estado(self):
+        proximo = min(self._vigentes.values()) if self._vigentes else None
+        return {
+            "instancia": INSTANCIA_ID,
+            "es_lider": self.es_lider,
+            "temporizadores": len(self._vigentes),
+            "entradas_heap": len(self._heap),
+            "proximo_vencimiento": datetime.utcfromtimestamp(proximo) if proximo else None,
+            **self.metricas,
+            "retraso_max_ms": round(self.metricas["retraso_max_ms"], 2),
+        }
+
+
+programador = ProgramadorVencimientos()
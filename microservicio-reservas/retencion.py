@@ -0,0 +1,259 @@
+import asyncio
+import os
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from database import get_database, descontar_leidas
+from models import TipoNotificacion
+from programador import programador
+
+# Días por tipo de notificación:
+#   ttl_dias: una vez leída, MongoDB la borra con un índice TTL pasados estos días
+#   resumen_dias: pasada esta antigüedad se suma al resumen mensual del usuario y se borra
+# 0 desactiva la regla. Cada valor se puede cambiar con RETENCION_<TIPO>_TTL_DIAS / _RESUMEN_DIAS.
+POLITICA_POR_DEFECTO = {
+    TipoNotificacion.RECORDATORIO: {"ttl_dias": 30, "resumen_dias": 90},
+    TipoNotificacion.CANCELACION: {"ttl_dias": 90, "resumen_dias": 180},
+    TipoNotificacion.VENCIMIENTO: {"ttl_dias": 180, "resumen_dias": 365},
+    TipoNotificacion.DISPONIBLE: {"ttl_dias": 180, "resumen_dias": 365},
+}
+RETENCION_LOTE = int(os.getenv("RETENCION_LOTE", "1000"))
+RETENCION_INTERVALO_SEGUNDOS = int(os.getenv("RETENCION_INTERVALO", "86400"))
+
+historial_compactaciones = deque(maxlen=20)
+
+
+def _politica():
+    politica = {}
+    for tipo, reglas in POLITICA_POR_DEFECTO.items():
+        prefijo = f"RETENCION_{tipo.name}"
+        politica[tipo.value] = {
+            "ttl_dias": int(os.getenv(f"{prefijo}_TTL_DIAS", reglas["ttl_dias"])),
+            "resumen_dias": int(os.getenv(f"{prefijo}_RESUMEN_DIAS", reglas["resumen_dias"])),
+        }
+    return politica
+
+
+POLITICA_RETENCION = _politica()
+
+
+def aplicar_indices_ttl(db):
+    """
+    Crea, ajusta o quita un índice TTL parcial por tipo sobre fecha_lectura.
+
+    Cada índice solo cubre las leídas de su tipo, así las no leídas nunca
+    vencen. Si cambió la cantidad de días, se modifica con collMod en lugar de
+    reconstruir el índice.
+    """
+    # Leídas antes de que existiera fecha_lectura: su plazo empieza a contar ahora
+    db.notificaciones.update_many(
+        {"leida": True, "fecha_lectura": {"$exists": False}},
+        {"$set": {"fecha_lectura": datetime.utcnow()}}
+    )
+    existentes = db.notificaciones.index_information()
+    for tipo, reglas in POLITICA_RETENCION.items():
+        nombre = f"ttl_leidas_{tipo}"
+        segundos = reglas["ttl_dias"] * 86400
+        actual = existentes.get(nombre)
+        if not segundos:
+            if actual:
+                db.notificaciones.drop_index(nombre)
+        elif actual is None:
+            db.notificaciones.create_index(
+                [("fecha_lectura", 1)],
+                name=nombre,
+                expireAfterSeconds=segundos,
+                partialFilterExpression={"tipo": tipo, "leida": True}
+            )
+        elif actual.get("expireAfterSeconds") != segundos:
+            db.command("collMod", "notificaciones", index={"name": nombre, "expireAfterSeconds": segundos})
+    # Recorrido de las antiguas de un tipo en orden de creación (el _id lleva la fecha)
+    db.notificaciones.create_index([("tipo", 1), ("_id", 1)], name="tipo_id")
+    db.resumenes_notificaciones.create_index([("usuario_id", 1), ("mes", -1)])
+
+
+def tamanio_coleccion(db, nombre="notificaciones"):
+    """Documentos, datos e índices de una colección según collStats, en bytes"""
+    try:
+        stats = db.command("collStats", nombre)
+    except OperationFailure:
+        return {"documentos": db[nombre].estimated_document_count()}
+    return {
+        "documentos": stats.get("count", 0),
+        "datos_bytes": stats.get("size", 0),
+        "almacenamiento_bytes": stats.get("storageSize", 0),
+        "indices_bytes": stats.get("totalIndexSize", 0),
+        "por_indice_bytes": stats.get("indexSizes", {}),
+    }
+
+
+def _clave_resumen(notificacion):
+    return f"{notificacion['usuario_id']}:{notificacion['fecha_creacion'].strftime('%Y-%m')}"
+
+
+def _resumir_lote(db, tipo, notificaciones):
+    """
+    Suma un lote (en orden de _id) a los resúmenes mensuales y borra lo sumado.
+
+    Cada resumen guarda por tipo el último _id sumado. Si un proceso se cae entre
+    el $inc y el borrado, la siguiente pasada vuelve a leer esas notificaciones,
+    ve que ya están contadas y solo las borra. La condición va además en el
+    filtro del update: si otro proceso (la tarea del líder y el endpoint a la
+    vez) ya sumó desde el primer _id del grupo, el update no coincide y el grupo
+    no se cuenta dos veces; de ese grupo solo se borra lo que el otro sumó.
+    Devuelve (resumidas, borradas).
+    """
+    claves = {_clave_resumen(n) for n in notificaciones}
+    ya_contadas = {
+        r["_id"]: r.get("hasta_id", {}).get(tipo)
+        for r in db.resumenes_notificaciones.find(
+            {"_id": {"$in": list(claves)}},
+            {f"hasta_id.{tipo}": 1}
+        )
+    }
+
+    grupos = {}
+    for n in notificaciones:
+        clave = _clave_resumen(n)
+        hasta = ya_contadas.get(clave)
+        if hasta is not None and n["_id"] <= hasta:
+            continue
+        grupo = grupos.setdefault(clave, {
+            "usuario_id": n["usuario_id"], "mes": n["fecha_creacion"].strftime("%Y-%m"), "total": 0, "no_leidas": 0,
+            "desde": n["fecha_creacion"], "hasta": n["fecha_creacion"], "primer_id": n["_id"], "hasta_id": n["_id"],
+        })
+        grupo["total"] += 1
+        grupo["no_leidas"] += not n.get("leida", False)
+        grupo["desde"] = min(grupo["desde"], n["fecha_creacion"])
+        grupo["hasta"] = max(grupo["hasta"], n["fecha_creacion"])
+        grupo["hasta_id"] = n["_id"]
+
+    claves_grupos = list(grupos)
+    operaciones = [
+        UpdateOne(
+            {"_id": clave, f"hasta_id.{tipo}": {"$not": {"$gte": grupos[clave]["primer_id"]}}},
+            {
+                "$setOnInsert": {"usuario_id": grupos[clave]["usuario_id"], "mes": grupos[clave]["mes"]},
+                "$inc": {
+                    "total": grupos[clave]["total"],
+                    f"por_tipo.{tipo}": grupos[clave]["total"],
+                    "no_leidas": grupos[clave]["no_leidas"],
+                },
+                "$min": {"desde": grupos[clave]["desde"]},
+                "$max": {"hasta": grupos[clave]["hasta"], f"hasta_id.{tipo}": grupos[clave]["hasta_id"]},
+            },
+            upsert=True,
+        )
+        for clave in claves_grupos
+    ]
+    bloqueadas = set()
+    if operaciones:
+        try:
+            db.resumenes_notificaciones.bulk_write(operaciones, ordered=False)
+        except BulkWriteError as e:
+            errores = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errores):
+                raise
+            # 11000: otro proceso creó el mismo resumen a la vez (al reintentar el $inc se
+            # aplica como update) o el filtro no coincidió porque ya sumó ese grupo (vuelve a chocar)
+            reintento = [error["index"] for error in errores]
+            try:
+                db.resumenes_notificaciones.bulk_write([operaciones[i] for i in reintento], ordered=False)
+            except BulkWriteError as e:
+                errores = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in errores):
+                    raise
+                bloqueadas = {claves_grupos[reintento[error["index"]]] for error in errores}
+
+    # De un grupo bloqueado solo se borra lo que el otro proceso ya sumó; el resto queda para otra pasada
+    hasta_bloqueadas = {
+        r["_id"]: r.get("hasta_id", {}).get(tipo)
+        for r in db.resumenes_notificaciones.find(
+            {"_id": {"$in": list(bloqueadas)}}, {f"hasta_id.{tipo}": 1}
+        )
+    } if bloqueadas else {}
+    borrables = [
+        n for n in notificaciones
+        if _clave_resumen(n) not in bloqueadas or n["_id"] <= hasta_bloqueadas[_clave_resumen(n)]
+    ]
+
+    db.notificaciones.delete_many({"_id": {"$in": [n["_id"] for n in borrables]}})
+    no_leidas = Counter(n["usuario_id"] for n in borrables if not n.get("leida", False))
+    for usuario_id, cantidad in no_leidas.items():
+        descontar_leidas(db, usuario_id, cantidad)
+    resumidas = sum(g["total"] for clave, g in grupos.items() if clave not in bloqueadas)
+    return resumidas, len(borrables)
+
+
+def compactar_notificaciones(lote: int = RETENCION_LOTE):
+    """
+    Pasa a resúmenes mensuales por usuario las notificaciones más antiguas que
+    el plazo de su tipo y reporta el tamaño de la colección antes y después.
+
+    Es código bloqueante de pymongo: se ejecuta en un hilo aparte.
+    """
+    db = get_database()
+    inicio = time.perf_counter()
+    antes = tamanio_coleccion(db)
+    por_tipo = {}
+
+    for tipo, reglas in POLITICA_RETENCION.items():
+        if not reglas["resumen_dias"]:
+            continue
+        corte = ObjectId.from_datetime(datetime.utcnow() - timedelta(days=reglas["resumen_dias"]))
+        resumidas = borradas = 0
+        while True:
+            notificaciones = list(db.notificaciones.find(
+                {"tipo": tipo, "_id": {"$lt": corte}},
+                {"usuario_id": 1, "leida": 1, "fecha_creacion": 1}
+            ).sort("_id", 1).limit(lote))
+            if not notificaciones:
+                break
+            resumidas_lote, borradas_lote = _resumir_lote(db, tipo, notificaciones)
+            resumidas += resumidas_lote
+            borradas += borradas_lote
+            if len(notificaciones) < lote:
+                break
+        por_tipo[tipo] = {"resumidas": resumidas, "borradas": borradas}
+
+    resultado = {
+        "fecha": datetime.utcnow(),
+        "por_tipo": por_tipo,
+        "antes": antes,
+        "despues": tamanio_coleccion(db),
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
+    historial_compactaciones.append(resultado)
+    borradas = sum(t["borradas"] for t in por_tipo.values())
+    if borradas:
+        print(f"🗜️ Compactación de notificaciones: {borradas} pasadas a resúmenes en {resultado['duracion_ms']} ms")
+    return resultado
+
+
+def resumenes_usuario(db, usuario_id, meses=12):
+    """Resúmenes mensuales de un usuario, del más reciente al más antiguo"""
+    return list(db.resumenes_notificaciones.find(
+        {"usuario_id": usuario_id},
+        {"_id": 0, "hasta_id": 0}
+    ).sort("mes", -1).limit(meses))
+
+
+async def tarea_retencion():
+    """Compactación periódica; solo en la réplica líder de vencimientos, para no repetir trabajo"""
+    proxima = 0.0
+    while True:
+        try:
+            if programador.es_lider and time.monotonic() >= proxima:
+                await asyncio.to_thread(compactar_notificaciones)
+                proxima = time.monotonic() + RETENCION_INTERVALO_SEGUNDOS
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error en compactación de notificaciones: {e}")
+        # El liderazgo se decide después del arranque: se revisa cada minuto
+        await asyncio.sleep(60)
@@ -0,0 +1,81 @@
+"""
+Pruebas de creación de reservas sobre mongomock.
+
+Se ejecutan desde este directorio con `python -m pytest`; requieren pytest y mongomock.
+"""
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+mongomock = pytest.importorskip("mongomock")
+
+import database
+import main
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Base de reservas en memoria con los mismos índices que initialize_database crea en Mongo"""
+    db = mongomock.MongoClient()[database.DB_NAME]
+    monkeypatch.setattr(database, "_client", {database.DB_NAME: db})
+    database.initialize_database()
+    return db
+
+
+def _crear_en_paralelo(peticiones, monkeypatch):
+    """
+    Ejecuta crear_reserva en un hilo por petición y devuelve (respuestas, errores).
+
+    Una barrera tras siguiente_secuencia hace que todas las peticiones pasen por
+    la misma ventana antes de que alguna inserte, como dos réplicas atendiendo a la vez.
+    """
+    barrera = threading.Barrier(len(peticiones))
+    siguiente_secuencia = main.siguiente_secuencia
+
+    def secuencia_sincronizada(db, libro_id):
+        secuencia = siguiente_secuencia(db, libro_id)
+        barrera.wait(timeout=5)
+        return secuencia
+
+    monkeypatch.setattr(main, "siguiente_secuencia", secuencia_sincronizada)
+
+    respuestas, errores = [], []
+
+    def ejecutar(peticion):
+        try:
+            respuestas.append(asyncio.run(main.crear_reserva(peticion)))
+        except HTTPException as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=ejecutar, args=(peticion,)) for peticion in peticiones]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return respuestas, errores
+
+
+def test_reservas_simultaneas_del_mismo_libro_crean_una_sola(db, monkeypatch):
+    peticion = main.ReservaCreate(usuario_id=7, libro_id=42)
+
+    respuestas, errores = _crear_en_paralelo([peticion, peticion], monkeypatch)
+
+    assert len(respuestas) == 1
+    assert [e.status_code for e in errores] == [400]
+    assert errores[0].detail == "Ya tienes una reserva activa para este libro"
+    assert db.reservas.count_documents({"usuario_id": 7, "libro_id": 42, "estado": "activa"}) == 1
+    # La secuencia de la petición rechazada no deja un hueco en la fila
+    assert main.longitud_cola(db, 42) == 1
+
+
+def test_reservas_simultaneas_de_usuarios_distintos_entran_en_la_fila(db, monkeypatch):
+    peticiones = [main.ReservaCreate(usuario_id=usuario_id, libro_id=42) for usuario_id in (1, 2, 3)]
+
+    respuestas, errores = _crear_en_paralelo(peticiones, monkeypatch)
+
+    assert len(respuestas) == 3
+    assert errores == []
+    reservas = list(db.reservas.find({"libro_id": 42}).sort("secuencia", 1))
+    assert [main.posicion_en_cola(db, reserva) for reserva in reservas] == [1, 2, 3]
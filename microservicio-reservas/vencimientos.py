@@ -0,0 +1,141 @@
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+from database import get_database, construir_notificacion, despues_de_insertar
+from models import EstadoReserva, TipoNotificacion
+from difusion import insertadas_de
+from cola import registrar_bajas
+
+# Configuración del barrido de reservas vencidas
+BARRIDO_LOTE = int(os.getenv("RESERVAS_BARRIDO_LOTE", "1000"))
+
+# Últimas ejecuciones del barrido, para consulta desde la API
+historial_barridos = deque(maxlen=50)
+
+# Reservas ya vencidas cuya notificación aún no se registró
+FILTRO_SIN_NOTIFICAR = {"estado": EstadoReserva.VENCIDA.value, "notificado": False}
+
+
+def _notificar_lote(db, reservas):
+    """
+    Inserta las notificaciones de vencimiento de un lote y marca las reservas como notificadas.
+
+    Cada notificación lleva evento_id = "vencimiento:<reserva>"; el índice único
+    (evento_id, usuario_id) descarta la segunda copia si un barrido se repite.
+    """
+    notificaciones = []
+    for reserva in reservas:
+        notificacion = construir_notificacion(
+            reserva["usuario_id"],
+            TipoNotificacion.VENCIMIENTO,
+            f"Tu reserva del libro ID {reserva['libro_id']} ha vencido",
+            str(reserva["_id"]),
+        )
+        notificacion["evento_id"] = f"vencimiento:{reserva['_id']}"
+        notificaciones.append(notificacion)
+
+    insertadas = len(notificaciones)
+    try:
+        db.notificaciones.insert_many(notificaciones, ordered=False)
+        despues_de_insertar(db, notificaciones)
+    except BulkWriteError as e:
+        errores = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errores):
+            raise
+        insertadas = e.details.get("nInserted", 0)
+        despues_de_insertar(db, insertadas_de(notificaciones, e))
+
+    db.reservas.update_many(
+        {"_id": {"$in": [r["_id"] for r in reservas]}},
+        {"$set": {"notificado": True}},
+    )
+    return insertadas
+
+
+def _marcar_vencidas(db, ids, ahora):
+    """Pasa a vencidas y sin notificar las reservas del lote que sigan activas y ya vencieron"""
+    # El filtro por estado evita pisar una reserva cancelada o cumplida entre medio
+    marcadas = db.reservas.update_many(
+        {"_id": {"$in": ids}, "estado": EstadoReserva.ACTIVA.value, "fecha_vencimiento": {"$lte": ahora}},
+        {"$set": {"estado": EstadoReserva.VENCIDA.value, "notificado": False, "fecha_expiracion": ahora}},
+    ).modified_count
+    if marcadas:
+        registrar_bajas(db, db.reservas.find(
+            {"_id": {"$in": ids}, "estado": EstadoReserva.VENCIDA.value, "fecha_expiracion": ahora},
+            {"libro_id": 1, "secuencia": 1},
+        ))
+    return marcadas
+
+
+def _notificar_pendientes(db, lote):
+    """Notifica las reservas vencidas pendientes, incluidas las de un barrido interrumpido"""
+    notificaciones = 0
+    lotes = 0
+    while True:
+        reservas = list(db.reservas.find(FILTRO_SIN_NOTIFICAR, {"usuario_id": 1, "libro_id": 1}).limit(lote))
+        if not reservas:
+            break
+        notificaciones += _notificar_lote(db, reservas)
+        lotes += 1
+        if len(reservas) < lote:
+            break
+    return notificaciones, lotes
+
+
+def expirar_reservas(ids, lote: int = BARRIDO_LOTE):
+    """Vence reservas concretas cuyo temporizador se cumplió; devuelve (marcadas, notificaciones)"""
+    db = get_database()
+    ahora = datetime.utcnow()
+    marcadas = sum(_marcar_vencidas(db, ids[i:i + lote], ahora) for i in range(0, len(ids), lote))
+    notificaciones, _ = _notificar_pendientes(db, lote)
+    return marcadas, notificaciones
+
+
+def barrer_reservas_vencidas(lote: int = BARRIDO_LOTE):
+    """
+    Marca como vencidas las reservas activas cuya fecha pasó y notifica a sus usuarios.
+
+    Trabaja por lotes acotados: un update_many marca el lote como vencido y sin
+    notificar, y luego un insert_many registra las notificaciones. Si el proceso
+    se cae entre ambos pasos, el siguiente barrido encuentra esas reservas por
+    `notificado: False` y completa el envío. Es código bloqueante de pymongo:
+    se ejecuta en un hilo aparte.
+    """
+    db = get_database()
+    inicio = time.perf_counter()
+    ahora = datetime.utcnow()
+    marcadas = 0
+    lotes = 0
+
+    while True:
+        ids = [r["_id"] for r in db.reservas.find(
+            {"estado": EstadoReserva.ACTIVA.value, "fecha_vencimiento": {"$lt": ahora}},
+            {"_id": 1},
+        ).limit(lote)]
+        if not ids:
+            break
+        marcadas += _marcar_vencidas(db, ids, ahora)
+        lotes += 1
+        if len(ids) < lote:
+            break
+
+    notificaciones, lotes_notificados = _notificar_pendientes(db, lote)
+    lotes += lotes_notificados
+
+    resultado = {
+        "fecha": ahora,
+        "marcadas_vencidas": marcadas,
+        "notificaciones_creadas": notificaciones,
+        "lotes": lotes,
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
+    historial_barridos.append(resultado)
+    if marcadas or notificaciones:
+        print(f"📅 Barrido de reservas: {marcadas} vencidas, {notificaciones} notificaciones "
+              f"en {resultado['duracion_ms']} ms")
+    return resultado
+